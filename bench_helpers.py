@@ -0,0 +1,99 @@
+"""Эталонные реализации и симуляции, общие для тестов и бенчмарков"""
+
+import heapq
+import re
+from datetime import timedelta
+
+import news_parser
+from news_config import CLICKBAIT_PATTERNS, EXCLUDE_KEYWORDS, IMPORTANCE_RULES, MAX_NEWS_PER_RUN
+
+
+def legacy_importance(news_item):
+    """calculate_importance до компиляции матчера (эталон)"""
+    title = news_item['title'].lower()
+    original_title = news_item['title']
+    score = 0
+    matched_categories = []
+    
+    for exclude in EXCLUDE_KEYWORDS:
+        if exclude in title:
+            return 0, ['EXCLUDED']
+    
+    for pattern in CLICKBAIT_PATTERNS:
+        if re.search(pattern, original_title):
+            return 0, ['CLICKBAIT']
+    
+    for category, rules in IMPORTANCE_RULES.items():
+        for keyword in rules['keywords']:
+            if keyword.lower() in title:
+                score += rules['weight']
+                if category not in matched_categories:
+                    matched_categories.append(category)
+                break
+    
+    if 'sec' in title and 'CRITICAL' not in matched_categories and 'HIGH' not in matched_categories:
+        score += 50
+        matched_categories.append('HIGH')
+    
+    if 'bitcoin' in title or re.search(r'\bbtc\b', title):
+        score *= 1.3
+    
+    if re.search(r'\$\s*[\d,]+\.?\d*\s*[mbk]?|\$\s*[\d,]+|\d+\.?\d*%', title, re.IGNORECASE):
+        score *= 1.2
+    
+    score *= news_item['source_weight']
+    
+    return round(score), matched_categories
+
+
+def simulate_polling(scheduler, source_name, arrivals, duration, start):
+    """Опрашиваем источник по расписанию, задержка - от появления записи до опроса"""
+    now = scheduler.sources[source_name]['next_poll']
+    latencies = []
+    visible = 0
+    polls = 0
+    while now < duration:
+        polls += 1
+        while visible < len(arrivals) and arrivals[visible] <= now:
+            latencies.append(now - arrivals[visible])
+            visible += 1
+        feed = [start + timedelta(seconds=arrival) for arrival in arrivals[max(0, visible - 25):visible]]
+        scheduler.record(source_name, now, feed)
+        now = scheduler.sources[source_name]['next_poll']
+    return latencies, polls
+
+
+def fetch_all_news(cursors=None):
+    """Собираем новости из всех источников (параллельно) одним списком (эталон для тестов)
+    
+    Порядок RSS_SOURCES, чтобы результат не зависел от скорости источников.
+    """
+    by_source = dict(news_parser.iter_fetched_news(cursors))
+    return [item for source_name in news_parser.RSS_SOURCES for item in by_source.get(source_name, [])]
+
+
+def deduplicate_news(news_list):
+    """Удаляем дубликаты по similarity попарно (эталон для select_unique_top_news)"""
+    if not news_list:
+        return []
+    
+    sorted_news = sorted(news_list, key=lambda x: (x['source_priority'], -x['score']))
+    
+    unique_news = []
+    for item in sorted_news:
+        is_dup = False
+        for unique_item in unique_news:
+            similarity = news_parser.token_similarity(news_parser.title_tokens(item), news_parser.title_tokens(unique_item))
+            if similarity >= news_parser.BATCH_DEDUP_THRESHOLD:
+                is_dup = True
+                break
+        
+        if not is_dup:
+            unique_news.append(item)
+    
+    return unique_news
+
+
+def select_top_news(final_news, limit=MAX_NEWS_PER_RUN):
+    """Топ новостей по баллу (при равенстве - в порядке после дедупликации)"""
+    return heapq.nlargest(limit, final_news, key=lambda x: x['score'])
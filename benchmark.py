@@ -0,0 +1,534 @@
+"""Бенчмарки горячих участков парсера (без сети)
+
+Запуск: python benchmark.py > bench_output.txt
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import news_parser
+from news_config import EXCLUDE_KEYWORDS, IMPORTANCE_RULES
+from bench_helpers import deduplicate_news, legacy_importance, select_top_news, simulate_polling
+
+
+WORDS = [
+    'bitcoin', 'btc', 'ethereum', 'eth', 'sec', 'etf', 'approves', 'denies', 'blackrock',
+    'fidelity', 'surges', 'plunges', 'fed', 'cuts', 'rates', 'market', 'crash', 'hack',
+    'exchange', 'binance', 'coinbase', 'stablecoin', 'depegs', 'after', 'exploit', 'to',
+    'the', 'of', 'in', 'as', 'record', 'high', 'traders', 'whales', 'inflows', 'outflows',
+    '$100m', '$1b', '10%', 'treasury', 'yields', 'tokenized', 'funds', 'wall', 'street'
+]
+
+
+def _rare_words(count, seed=9):
+    """Редкие слова (имена, тикеры, компании) без ключевых слов конфига внутри"""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        word = ''.join(rng.choice('bcdfgklmnprstvz') + rng.choice('aeiou') for _ in range(rng.randint(2, 4)))
+        if not news_parser.TITLE_MATCHER.find(word):
+            words.add(word)
+    return sorted(words)
+
+
+# В реальных заголовках редких слов большинство
+RARE_WORDS = _rare_words(4500)
+
+
+def synthetic_titles(count, seed=42):
+    """Синтетические заголовки, похожие на реальные"""
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(count):
+        words = [rng.choice(WORDS if rng.random() < 0.5 else RARE_WORDS) for _ in range(rng.randint(5, 14))]
+        titles.append(' '.join(words).capitalize() + rng.choice(['', '.', '!', ':']))
+    return titles
+
+
+def legacy_similarity(title1, title2):
+    """calculate_similarity до кэширования токенов (токенизация на каждый вызов)"""
+    def tokenize(text):
+        text = text.lower()
+        text = re.sub(r'[^\w\s]', '', text)
+        return set(text.split())
+    
+    tokens1 = tokenize(title1)
+    tokens2 = tokenize(title2)
+    
+    if not tokens1 or not tokens2:
+        return 0.0
+    
+    intersection = len(tokens1.intersection(tokens2))
+    union = len(tokens1.union(tokens2))
+    
+    return intersection / union if union > 0 else 0.0
+
+
+def bench_similarity(corpus_size=10000, queries=50):
+    """Старый и новый путь similarity на корпусе из 10k заголовков"""
+    print(f"\n🔬 Similarity: {queries} queries x {corpus_size} titles")
+    
+    corpus = synthetic_titles(corpus_size)
+    query_titles = synthetic_titles(queries, seed=7)
+    
+    started = time.perf_counter()
+    legacy_hits = sum(
+        1 for query in query_titles for title in corpus
+        if legacy_similarity(query, title) >= 0.5
+    )
+    legacy_time = time.perf_counter() - started
+    
+    news_parser.tokenize_title.cache_clear()
+    started = time.perf_counter()
+    corpus_tokens = [news_parser.tokenize_title(title) for title in corpus]
+    query_tokens = [news_parser.tokenize_title(title) for title in query_titles]
+    cached_hits = sum(
+        1 for query in query_tokens for tokens in corpus_tokens
+        if news_parser.token_similarity(query, tokens) >= 0.5
+    )
+    cached_time = time.perf_counter() - started
+    
+    assert legacy_hits == cached_hits
+    pairs = corpus_size * queries
+    print(f"  legacy (re-tokenize per call): {legacy_time:.3f}s ({pairs / legacy_time:,.0f} pairs/s)")
+    print(f"  precomputed token sets:        {cached_time:.3f}s ({pairs / cached_time:,.0f} pairs/s)")
+    print(f"  speedup: x{legacy_time / cached_time:.1f}, matches: {cached_hits}")
+
+
+def bench_scoring(count=20000):
+    """calculate_importance: старый построчный скан и скомпилированный матчер"""
+    print(f"\n🧮 Scoring: {count} titles")
+    
+    items = [{'title': title, 'source_weight': 1.2} for title in synthetic_titles(count)]
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        legacy = [legacy_importance(item) for item in items]
+        legacy_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        compiled = [news_parser.calculate_importance(item) for item in items]
+        compiled_time = time.perf_counter() - started
+    
+    assert legacy == compiled
+    print(f"  legacy scan:      {legacy_time:.3f}s ({count / legacy_time:,.0f} titles/s)")
+    print(f"  compiled matcher: {compiled_time:.3f}s ({count / compiled_time:,.0f} titles/s)")
+    
+    # Как растет стоимость при увеличении списков ключевых слов
+    rng = random.Random(3)
+    base_keywords = EXCLUDE_KEYWORDS + [k for rules in IMPORTANCE_RULES.values() for k in rules['keywords']]
+    titles = [item['title'].lower() for item in items[:5000]]
+    for factor in (1, 10):
+        keywords = base_keywords + [
+            f"{rng.choice(WORDS)} {rng.choice(WORDS)}{i}" for i in range(len(base_keywords) * (factor - 1))
+        ]
+        matcher = news_parser.KeywordMatcher([(keyword, keyword) for keyword in keywords])
+        
+        started = time.perf_counter()
+        for title in titles:
+            [keyword for keyword in keywords if keyword in title]
+        scan_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        for title in titles:
+            matcher.find(title)
+        matcher_time = time.perf_counter() - started
+        
+        print(f"  x{factor:<2} keywords ({len(keywords)}): scan {scan_time * 1e6 / len(titles):.1f}us/title, "
+              f"automaton {matcher_time * 1e6 / len(titles):.1f}us/title")
+
+
+def bench_score_batch(count=200000):
+    """score_batch на архиве заголовков против поштучного calculate_importance"""
+    print(f"\n📊 Batch scoring: {count} items (numpy: {'yes' if news_parser.get_numpy() else 'no'})")
+    
+    titles = synthetic_titles(count)
+    items = [{'title': title, 'source': 'coindesk', 'source_weight': 1.2} for title in titles]
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        single = [news_parser.calculate_importance(item) for item in items]
+        single_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        scores, categories = news_parser.score_batch(items)
+        batch_time = time.perf_counter() - started
+    
+    assert [score for score, _ in single] == scores
+    print(f"  calculate_importance loop: {single_time:.3f}s ({count / single_time:,.0f} items/s)")
+    print(f"  score_batch:               {batch_time:.3f}s ({count / batch_time:,.0f} items/s)")
+
+
+def bench_replay(days=90, entries_per_source=3, important_share=0.02):
+    """Replay архива за несколько месяцев (каждые 30 минут по всем источникам)
+    
+    Как в реальных лентах, только малая доля заголовков проходит порог.
+    """
+    sources = ['coindesk', 'decrypt', 'marketwatch', 'reuters']
+    runs = days * 48
+    rng = random.Random(5)
+    titles = iter([
+        title if rng.random() < important_share
+        else ' '.join(rng.choice(RARE_WORDS) for _ in range(rng.randint(5, 14)))
+        for title in synthetic_titles(runs * len(sources) * entries_per_source, seed=1)
+    ])
+    start = datetime(2026, 1, 1)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'archive.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for run in range(runs):
+                fetched_at = start + timedelta(minutes=30 * run)
+                for source in sources:
+                    for i in range(entries_per_source):
+                        f.write(json.dumps({
+                            'fetched_at': fetched_at.isoformat(), 'source': source,
+                            'title': next(titles), 'link': f'https://example.com/{source}/{run}/{i}',
+                            'summary': '', 'published_date': fetched_at.isoformat(), 'image_url': None
+                        }) + '\n')
+        
+        print(f"\n🔁 Replay: {days} days, {runs} runs, {runs * len(sources) * entries_per_source} entries")
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            report = news_parser.replay_archive(path)
+            elapsed = time.perf_counter() - started
+    
+    for name, stage in report['stages'].items():
+        rate = stage['items'] / stage['seconds'] if stage['seconds'] else 0
+        print(f"  {name:<7} {stage['items']:>8} items {rate:>12,.0f} items/s")
+    print(f"  total {elapsed:.2f}s, would publish {len(report['published'])}")
+
+
+def bench_published_store(sizes=(1000, 10000, 100000), new_per_run=5):
+    """Загрузка и сохранение опубликованных: JSON (indent=2), SQLite и журнал"""
+    print(f"\n🗄 Published store: load + save {new_per_run} new items")
+    
+    now = datetime.now()
+    names = ['PUBLISHED_FILE', 'PUBLISHED_DB_FILE', 'PUBLISHED_SNAPSHOT_FILE', 'PUBLISHED_JOURNAL_FILE', 'PUBLISHED_BACKEND']
+    saved = {name: getattr(news_parser, name) for name in names}
+    for size in sizes:
+        titles = synthetic_titles(size + new_per_run, seed=size)
+        history = [
+            {'title': title, 'link': f'https://example.com/{i}',
+             'published_date': (now - timedelta(seconds=i)).isoformat(),
+             'tokens': sorted(news_parser.tokenize_title(title))}
+            for i, title in enumerate(titles[:size])
+        ]
+        new_items = [
+            {'title': title, 'link': f'https://example.com/new/{i}', 'published_date': now.isoformat(),
+             'tokens': sorted(news_parser.tokenize_title(title))}
+            for i, title in enumerate(titles[size:])
+        ]
+        
+        timings = {}
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            for name in names[:4]:
+                setattr(news_parser, name, os.path.join(tmp, os.path.basename(saved[name])))
+            try:
+                for backend in ('json', 'sqlite', 'journal'):
+                    news_parser.PUBLISHED_BACKEND = backend
+                    news_parser.save_published_news(history)
+                    news_parser.close_published_store()
+                    
+                    started = time.perf_counter()
+                    published = news_parser.load_published_news()
+                    loaded = time.perf_counter()
+                    news_parser.save_published_news(published + new_items)
+                    timings[backend] = (loaded - started, time.perf_counter() - loaded)
+                    news_parser.close_published_store()
+            finally:
+                news_parser.close_published_store()
+                for name, value in saved.items():
+                    setattr(news_parser, name, value)
+        
+        print(f"  {size:>7} items: " + ', '.join(
+            f"{backend} load {load * 1000:.1f}ms save {save * 1000:.1f}ms"
+            for backend, (load, save) in timings.items()
+        ))
+
+
+def bench_news_items(count=100000):
+    """Память и время прохода для dict и NewsItem на синтетических лентах"""
+    print(f"\n🧩 News items: {count} entries")
+    
+    rng = random.Random(8)
+    sources = list(news_parser.RSS_SOURCES)
+    titles = synthetic_titles(count, seed=12)
+    start = datetime(2026, 1, 1)
+    
+    def make_fields(i, title):
+        source = sources[i % len(sources)]
+        return {
+            'title': title, 'link': f'https://example.com/{source}/{i}',
+            'summary': ' '.join(rng.choice(RARE_WORDS) for _ in range(30)),
+            'published_date': start + timedelta(minutes=i), 'source': source,
+            'source_weight': 1.2, 'source_priority': 1 + i % 5, 'image_url': f'https://example.com/{i}.jpg',
+            'entry_id': f'https://example.com/{source}/{i}', 'tokens': news_parser.tokenize_title(title)
+        }
+    
+    # Строки и токены создаются до замера - они общие для обоих вариантов
+    records = [make_fields(i, title) for i, title in enumerate(titles)]
+    
+    for name, build in (('dict', dict), ('NewsItem', news_parser.NewsItem.from_dict)):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        items = [build(record) for record in records]
+        containers = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            scores, categories = news_parser.score_batch(items, verbose=False)
+            passed = news_parser.apply_thresholds(items, scores, categories)
+            top = sorted(items, key=lambda x: (x['source_priority'], -x.get('score', 0)))[:5]
+            elapsed = time.perf_counter() - started
+        
+        print(f"  {name:<8} {containers / len(items):>6.0f} B/item (containers), "
+              f"score+threshold+sort {elapsed:.3f}s ({len(passed)} above threshold)")
+        del items, top
+
+
+def bench_top_news(sizes=(1000, 5000), limit=5):
+    """Отбор топ-5: попарная дедупликация против кучи с индексом (сортировка по приоритету в обоих)"""
+    print(f"\n🏆 Top-{limit} selection")
+    
+    rng = random.Random(4)
+    for size in sizes:
+        # Как в реальных лентах: в основном редкие слова, часть историй в нескольких источниках
+        stories = [[rng.choice(RARE_WORDS) for _ in range(rng.randint(5, 12))] for _ in range(size * 3 // 4)]
+        candidates = []
+        for i in range(size):
+            words = rng.choice(stories) + [rng.choice(WORDS) for _ in range(rng.randint(0, 3))]
+            title = ' '.join(rng.sample(words, len(words)))
+            candidates.append({
+                'title': title, 'link': f'https://example.com/{i}', 'score': rng.choice([60, 75, 90, 100, 130, 150]),
+                'source_priority': rng.randint(1, 5), 'tokens': news_parser.tokenize_title(title)
+            })
+        
+        started = time.perf_counter()
+        unique = deduplicate_news(candidates)
+        expected = select_top_news(unique, limit=limit)
+        legacy_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        top, unique_count = news_parser.select_unique_top_news(candidates, limit=limit)
+        heap_time = time.perf_counter() - started
+        
+        assert top == expected and unique_count == len(unique)
+        print(f"  {size:>6} candidates: sort+pairwise {legacy_time:.3f}s, heap+index {heap_time:.3f}s "
+              f"(x{legacy_time / heap_time:.1f}), {unique_count} unique")
+
+
+def scaled_feed(content, factor):
+    """Лента с записями, повторенными factor раз (большой feed из фикстуры)"""
+    head, rest = content.split(b'<item>', 1)
+    body, tail = rest.rsplit(b'</item>', 1)
+    return head + (b'<item>' + body + b'</item>') * factor + tail
+
+
+def bench_feed_parser(factors=(1, 40), repeats=20):
+    """Разбор записанных лент: потоковый парсер против feedparser (время и пик памяти)"""
+    print("\n📰 Feed parsing (fixtures/feeds)")
+    
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'feeds')
+    parsers = (('feedparser', news_parser._feedparser_entries), ('fast', news_parser.parse_rss_fast))
+    
+    for filename in sorted(os.listdir(fixtures_dir)):
+        with open(os.path.join(fixtures_dir, filename), 'rb') as f:
+            recorded = f.read()
+        
+        for factor in factors:
+            content = scaled_feed(recorded, factor)
+            runs = max(1, repeats // factor)
+            results = {}
+            for name, parse in parsers:
+                started = time.perf_counter()
+                for _ in range(runs):
+                    entries = parse(content)
+                elapsed = (time.perf_counter() - started) / runs
+                
+                tracemalloc.start()
+                parse(content)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results[name] = (elapsed, peak, len(entries))
+            
+            (slow, slow_peak, count), (fast, fast_peak, _) = results['feedparser'], results['fast']
+            print(f"  {filename:<16} {count:>5} items {len(content) / 1024:>7.0f} KB: "
+                  f"feedparser {slow * 1000:7.1f}ms {slow_peak / 1024:>7.0f} KB peak, "
+                  f"fast {fast * 1000:6.1f}ms {fast_peak / 1024:>6.0f} KB peak (x{slow / fast:.0f})")
+
+
+def bench_daemon_latency(mean_gaps=(300, 600, 1200, 1800, 3600), days=7):
+    """Задержка от появления записи в ленте до опроса: cron раз в 30 минут против --daemon"""
+    print(f"\n⏲ Feed-to-poll latency, {days} days of Poisson arrivals per source")
+    
+    rng = random.Random(23)
+    start = datetime(2026, 10, 1)
+    duration = days * 24 * 3600
+    cron = news_parser.REPLAY_RUN_MINUTES * 60
+    
+    for mean_gap in mean_gaps:
+        arrivals = []
+        moment = rng.expovariate(1 / mean_gap)
+        while moment < duration:
+            arrivals.append(moment)
+            moment += rng.expovariate(1 / mean_gap)
+        
+        cron_latencies = sorted(cron - arrival % cron for arrival in arrivals)
+        scheduler = news_parser.SourceScheduler(['source'], 0.0)
+        latencies, polls = simulate_polling(scheduler, 'source', arrivals, duration, start)
+        latencies.sort()
+        
+        print(f"  story every {mean_gap // 60:>3} min: cron median {cron_latencies[len(cron_latencies) // 2] / 60:5.1f} min, "
+              f"daemon median {latencies[len(latencies) // 2]:4.0f}s, p90 {latencies[len(latencies) * 9 // 10]:4.0f}s, "
+              f"{polls / (days * 24):.0f} polls/hour")
+
+
+class SlidingWindowChannel:
+    """Канал с лимитом limit постов за window секунд, сверх лимита - 429"""
+    
+    def __init__(self, limit, window, raise_on_limit):
+        self.limit = limit
+        self.window = window
+        self.raise_on_limit = raise_on_limit
+        self.sent_at = []
+        self.rejected = 0
+    
+    def publish(self, news_item, processed_image=None):
+        now = time.monotonic()
+        self.sent_at = [at for at in self.sent_at if at > now - self.window]
+        if len(self.sent_at) >= self.limit:
+            self.rejected += 1
+            if self.raise_on_limit:
+                raise news_parser.PublishRateLimited('telegram', self.sent_at[0] + self.window - now)
+            return False
+        self.sent_at.append(now)
+        return True
+
+
+def bench_publish_rate_limit(posts=15, limit=5, window=1.0):
+    """Публикация в канал с лимитом: фиксированная пауза без повторов против token bucket + retry_after"""
+    print(f"\n📬 Publishing {posts} posts to a channel limited to {limit} posts per {window:.0f}s")
+    
+    items = [{'title': f'News {i}', 'source': 'decrypt'} for i in range(posts)]
+    modes = [
+        ('fixed 0.1s interval, 429 lost', {'rate': 10.0, 'burst': 1}, False),
+        ('token bucket + retry_after', {'rate': limit / window, 'burst': limit}, True),
+    ]
+    names = ['publish_to_telegram', 'prepare_telegram_image', 'get_alpha_take', 'ALPHA_TAKE_BATCH_ENABLED',
+             'TWITTER_ENABLED', 'PUBLISH_RATE_LIMITS']
+    original = {name: getattr(news_parser, name) for name in names}
+    news_parser.prepare_telegram_image = lambda news_item: None
+    news_parser.get_alpha_take = lambda news_item: None
+    news_parser.ALPHA_TAKE_BATCH_ENABLED = False
+    news_parser.TWITTER_ENABLED = False
+    try:
+        for label, rate_limit, raise_on_limit in modes:
+            channel = SlidingWindowChannel(limit, window, raise_on_limit)
+            news_parser.publish_to_telegram = channel.publish
+            news_parser.PUBLISH_RATE_LIMITS = {'telegram': rate_limit}
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = news_parser.publish_news(items)
+            elapsed = time.perf_counter() - started
+            delivered = sum(1 for _, telegram_ok, _ in results if telegram_ok)
+            print(f"  {label:<32} delivered {delivered:>2}/{posts}, lost {posts - delivered:>2}, "
+                  f"429 responses {channel.rejected:>2}, {elapsed:.2f}s")
+    finally:
+        for name, value in original.items():
+            setattr(news_parser, name, value)
+
+
+HEAVY_MODULES = ('openai', 'feedparser', 'numpy', 'PIL', 'tweepy')
+
+# Запуск cron без сети, где ни одна новость не прошла порог
+EMPTY_RUN_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import news_parser
+from news_parser import NewsItem
+news_parser.fetch_rss_feed = lambda name, config, cache=None, cursor=None: [NewsItem(
+    title=f'{{name}} weekly market roundup', link=f'https://example.com/{{name}}', source=name,
+    source_weight=config['weight_multiplier'], source_priority=config['priority'])]
+news_parser.main()
+print('HEAVY', ','.join(m for m in {heavy!r} if m in sys.modules))
+print('ELAPSED', time.perf_counter() - started)
+"""
+
+
+def bench_cold_start(runs=5):
+    """Холодный старт: -X importtime news_parser и запуск cron, который ничего не нашел"""
+    print("\n🧊 Cold start")
+    
+    root = os.path.dirname(os.path.abspath(__file__))
+    report = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import news_parser'],
+        cwd=root, capture_output=True, text=True, check=True
+    ).stderr
+    
+    # import time: self [us] | cumulative | imported package
+    top_level = {}
+    for line in report.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            top_level[name.strip()] = int(parts[1])
+    
+    print(f"  import news_parser: {top_level.get('news_parser', 0) / 1000:.0f}ms, slowest direct imports:")
+    for name, micros in sorted(top_level.items(), key=lambda x: -x[1])[1:8]:
+        print(f"    {name:<20} {micros / 1000:6.1f}ms")
+    
+    timings = []
+    heavy = ''
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = subprocess.run(
+                [sys.executable, '-c', EMPTY_RUN_SCRIPT.format(root=root, heavy=HEAVY_MODULES)],
+                cwd=tmp, capture_output=True, text=True, check=True
+            ).stdout
+        values = dict(line.split(' ', 1) for line in output.splitlines() if line.startswith(('HEAVY', 'ELAPSED')))
+        timings.append(float(values['ELAPSED']))
+        heavy = values.get('HEAVY', '').strip()
+    
+    timings.sort()
+    print(f"  empty cron run (offline): median {timings[len(timings) // 2] * 1000:.0f}ms, "
+          f"heavy modules loaded: {heavy or 'none'}")
+
+
+def main():
+    print("=" * 70)
+    print("⏱ CRYPTO NEWS BOT - BENCHMARKS")
+    print("=" * 70)
+    
+    bench_similarity()
+    bench_scoring()
+    bench_score_batch()
+    bench_replay()
+    bench_published_store()
+    bench_news_items()
+    bench_top_news()
+    bench_feed_parser()
+    bench_daemon_latency()
+    bench_publish_rate_limit()
+    bench_cold_start()
+    
+    print("\n" + "=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -140,6 +140,36 @@ MIN_IMPORTANCE_SCORE = 60  # Только важные новости
 # Только супер критичные broad market события
 STOCK_MARKET_THRESHOLD = 120  # CRITICAL events only (fed, crashes, major indices)
 
+# Источники, к которым применяется STOCK_MARKET_THRESHOLD
+STOCK_MARKET_SOURCES = ['marketwatch', 'yahoo_finance', 'reuters']
+
+# Сколько новостей публикуем за один запуск
+MAX_NEWS_PER_RUN = 5
+
+# Интервал cron для replay архива без fetched_at (минуты)
+REPLAY_RUN_MINUTES = 30
+
+# Режим --daemon: каждый источник опрашивается по своему расписанию
+DAEMON_MIN_INTERVAL = 20        # Чаще не опрашиваем источник, сек
+DAEMON_MAX_INTERVAL = 300       # Реже не опрашиваем работающий источник, сек (тихие ленты - раз в 5 мин)
+DAEMON_ERROR_MAX_INTERVAL = 600 # Предел backoff, если источник отвечает ошибками, сек
+DAEMON_GAP_FRACTION = 0.05      # Интервал опроса - доля среднего промежутка между записями (медиана задержки ~4% промежутка)
+DAEMON_GAP_SMOOTHING = 0.2      # Вес нового промежутка в скользящем среднем
+DAEMON_IDLE_BACKOFF = 1.5       # Рост интервала после опроса без новых записей (не больше 2x от расчетного)
+DAEMON_PUBLISH_WINDOW = 30 * 60 # Не больше MAX_NEWS_PER_RUN публикаций за это окно, сек (как у cron)
+
+# Сколько дней храним опубликованные новости для проверки дубликатов
+# (проверка идет через индекс, поэтому окно можно увеличивать)
+PUBLISHED_WINDOW_DAYS = 7
+
+# Где храним опубликованные новости:
+#   'journal' - published_news.snapshot.jsonl + published_news.journal.jsonl (текстовые, удобно коммитить в git)
+#   'sqlite'  - published_news.db
+#   'json'    - published_news.json (старый формат, файл переписывается целиком)
+# При первом запуске записи переносятся из published_news.db или published_news.json
+PUBLISHED_BACKEND = 'journal'
+PUBLISHED_COMPACT_EVERY = 100   # Сколько записей в журнале до перезаписи snapshot
+
 # Порог схожести для дедупликации (0.0-1.0)
 # Используем разные пороги для разных проверок:
 
@@ -162,6 +192,52 @@ SOURCE_PRIORITY = {
 # Twitter Integration
 TWITTER_ENABLED = True  # Set to False to disable Twitter posts
 
+# Загрузка RSS
+FETCH_TIMEOUT = 10      # Timeout одного источника, сек (можно переопределить 'timeout' в RSS_SOURCES)
+FETCH_DEADLINE = 25     # Общий дедлайн на загрузку всех источников, сек
+FETCH_MAX_WORKERS = 8   # Сколько источников качаем одновременно
+FETCH_FAST_PARSER = True   # RSS 2.0 разбираем потоковым XML парсером, feedparser - если схема незнакомая
+
+# HTTP транспорт (одна keep-alive сессия на весь запуск)
+HTTP_TIMEOUT = 10        # Timeout запроса по умолчанию, сек
+HTTP_HOST_TIMEOUTS = {   # Timeout для отдельных хостов, сек
+    'api.telegram.org': 20,   # sendPhoto с загрузкой картинки
+    'api.twitter.com': 15,
+}
+HTTP_RETRIES = 2         # Повторы при обрыве соединения и 5xx (POST - только если запрос не ушел)
+HTTP_BACKOFF = 0.5       # Пауза между повторами: 0.5s, 1s, 2s...
+HTTP_POOL_HOSTS = 32     # Сколько хостов держим в пуле
+HTTP_POOL_MAXSIZE = 10   # Keep-alive соединений на один хост
+
+# Публикация: token bucket на канал - burst постов подряд без паузы, дальше rate постов в секунду
+PUBLISH_RATE_LIMITS = {
+    'telegram': {'rate': 20 / 60, 'burst': 5},   # Telegram: не больше 20 сообщений в минуту в один канал
+    'twitter': {'rate': 1.0, 'burst': 5},         # Twitter: окна лимитов читаем из заголовков ответа
+}
+PUBLISH_MAX_WAIT = 60        # Канал просит подождать (429) дольше - посты ждут в outbox следующего запуска, сек
+OUTBOX_MAX_ATTEMPTS = 5      # Сколько раз повторяем пост после ошибок (лимиты каналов не считаются)
+OUTBOX_MAX_AGE_HOURS = 12    # Неотправленные посты старше этого выбрасываем - новость уже не новость
+
+# Картинки CoinDesk (обрезка watermark)
+IMAGE_MAX_BYTES = 15 * 1024 * 1024   # Картинки больше не скачиваем и не обрезаем
+IMAGE_MAX_SIDE = 2560                # Telegram все равно уменьшает фото до 2560px
+IMAGE_JPEG_QUALITY = 85              # Качество JPEG после обрезки
+IMAGE_CACHE_TTL_DAYS = 7             # Через сколько дней сверяем ETag оригинала
+IMAGE_CACHE_MAX_ENTRIES = 300        # Сверх этого вытесняются давно не использованные
+TELEGRAM_FILE_ID_MAX_ENTRIES = 2000  # Сколько file_id загруженных в Telegram фото помним
+
+# OpenAI Alpha Take
+ALPHA_TAKE_TIMEOUT = 10      # Timeout одного запроса (без повторов), сек
+ALPHA_TAKE_DEADLINE = 25     # Общий дедлайн на все Alpha Take запуска, сек
+ALPHA_TAKE_MAX_WORKERS = 5   # Сколько запросов к OpenAI одновременно
+ALPHA_TAKE_BATCH_ENABLED = False  # Промахи кэша одним запросом: дешевле, но все новости ждут общий ответ
+ALPHA_TAKE_CACHE_TTL_DAYS = 7         # Сколько дней ответ из кэша считается свежим
+ALPHA_TAKE_CACHE_MAX_ENTRIES = 2000   # Сверх этого вытесняются давно не использованные
+
+# Метрики запуска (время стадий, счетчики)
+METRICS_FILE = 'run_metrics.json'   # JSON-сводка последнего запуска
+METRICS_PROMETHEUS_FILE = None      # Файл для textfile collector node_exporter (None - не пишем)
+
 # Источники RSS
 RSS_SOURCES = {
     'coindesk': {
@@ -6,22 +6,41 @@
 Публикует в Telegram и Twitter
 """
 
-import feedparser
+import argparse
+import importlib.util
 import requests
 import os
 import json
-from datetime import datetime, timedelta
+import hashlib
+import heapq
+import sqlite3
+from collections import deque
+from datetime import datetime, timedelta, timezone
 import re
 import html
+import signal
 import io
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from dataclasses import dataclass, fields
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.etree import ElementTree
 
-# OpenAI Integration
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    print("⚠️ OpenAI not available - Alpha Take will be skipped")
+# Тяжелые библиотеки (openai, feedparser, numpy, PIL, tweepy) импортируются
+# там, где нужны: запуск без новостей до них не доходит
+
+# NumPy опционален - без него score_batch считает в чистом Python
+np = None
+_numpy_loaded = False
+
+# OpenAI Integration (проверяем установку без импорта)
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
 
 from news_config import (
     RSS_SOURCES, 
@@ -29,14 +48,57 @@ from news_config import (
     EXCLUDE_KEYWORDS, 
     MIN_IMPORTANCE_SCORE,
     STOCK_MARKET_THRESHOLD,
+    STOCK_MARKET_SOURCES,
+    MAX_NEWS_PER_RUN,
+    PUBLISHED_WINDOW_DAYS,
+    PUBLISHED_BACKEND,
+    PUBLISHED_COMPACT_EVERY,
+    REPLAY_RUN_MINUTES,
+    DAEMON_MIN_INTERVAL,
+    DAEMON_MAX_INTERVAL,
+    DAEMON_ERROR_MAX_INTERVAL,
+    DAEMON_GAP_FRACTION,
+    DAEMON_GAP_SMOOTHING,
+    DAEMON_IDLE_BACKOFF,
+    DAEMON_PUBLISH_WINDOW,
     SOURCE_PRIORITY,
     TWITTER_ENABLED,
+    PUBLISH_RATE_LIMITS,
+    PUBLISH_MAX_WAIT,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_MAX_AGE_HOURS,
+    FETCH_TIMEOUT,
+    FETCH_DEADLINE,
+    FETCH_MAX_WORKERS,
+    FETCH_FAST_PARSER,
+    HTTP_TIMEOUT,
+    HTTP_HOST_TIMEOUTS,
+    HTTP_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_POOL_HOSTS,
+    HTTP_POOL_MAXSIZE,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_SIDE,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_CACHE_TTL_DAYS,
+    IMAGE_CACHE_MAX_ENTRIES,
+    TELEGRAM_FILE_ID_MAX_ENTRIES,
+    ALPHA_TAKE_TIMEOUT,
+    ALPHA_TAKE_DEADLINE,
+    ALPHA_TAKE_MAX_WORKERS,
+    ALPHA_TAKE_BATCH_ENABLED,
+    ALPHA_TAKE_CACHE_TTL_DAYS,
+    ALPHA_TAKE_CACHE_MAX_ENTRIES,
+    METRICS_FILE,
+    METRICS_PROMETHEUS_FILE,
     CLICKBAIT_PATTERNS,
     ALLOWED_HASHTAGS
 )
 
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHANNEL_ID = os.environ.get('TELEGRAM_CHANNEL_ID')
+# Можно направить на свой Bot API сервер (или заглушку в тестах)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
 
 TWITTER_API_KEY = os.environ.get('TWITTER_API_KEY')
 TWITTER_API_SECRET = os.environ.get('TWITTER_API_SECRET')
@@ -44,71 +106,1274 @@ TWITTER_ACCESS_TOKEN = os.environ.get('TWITTER_ACCESS_TOKEN')
 TWITTER_ACCESS_TOKEN_SECRET = os.environ.get('TWITTER_ACCESS_TOKEN_SECRET')
 
 PUBLISHED_FILE = 'published_news.json'
+PUBLISHED_DB_FILE = 'published_news.db'
+PUBLISHED_SNAPSHOT_FILE = 'published_news.snapshot.jsonl'
+PUBLISHED_JOURNAL_FILE = 'published_news.journal.jsonl'
+CURSOR_FILE = 'feed_cursors.json'
+OUTBOX_FILE = 'publish_outbox.json'
+
+# Кэши между запусками (в GitHub Actions сохраняются через actions/cache)
+CACHE_DIR = '.cache'
+FEED_CACHE_FILE = os.path.join(CACHE_DIR, 'feed_cache.json')
+ALPHA_TAKE_CACHE_FILE = os.path.join(CACHE_DIR, 'alpha_take_cache.db')
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, 'images')
+
+# Лимит Telegram на загружаемое фото
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+
+# Сколько ждать, если канал ответил 429 без retry_after, сек
+PUBLISH_DEFAULT_RETRY_AFTER = 60
+
+# Время загрузки каждого источника за последний запуск (секунды)
+FETCH_TIMINGS = {}
+
+# Статистика conditional-запросов за последний запуск
+FEED_CACHE_STATS = {}
+
+# Сколько новостей прошло через стадии конвейера за последний запуск
+PIPELINE_STATS = {}
 
+# Запросы клиента OpenAI (httpx) за запуск: host -> requests/connections
+OPENAI_HTTP_STATS = {}
 
-def fetch_rss_feed(source_name, feed_config):
-    """Парсим RSS feed"""
+# Каналы под лимитом после последнего publish_news: канал -> когда можно снова
+PUBLISH_RETRY_AT = {}
+
+# Границы бакетов гистограмм времени, сек
+METRICS_TIME_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Префикс имен в Prometheus textfile
+METRICS_PROMETHEUS_PREFIX = 'crypto_news_bot_'
+
+
+def _metric_name(name, labels):
+    """Имя метрики с метками в формате Prometheus: fetch_seconds{source="coindesk"}"""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """Счетчики и гистограммы стадий за один запуск
+    
+    Метка - именованный аргумент: METRICS.inc('fetch_entries', 12, source='coindesk').
+    Пишут из пулов потоков (загрузка, публикация), поэтому под lock.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started_at = datetime.now()
+            self._started = time.monotonic()
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        """Значение в гистограмму (время - в секундах, бакеты METRICS_TIME_BUCKETS)"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'count': 0, 'sum': 0.0, 'min': value, 'max': value,
+                    'buckets': [0] * len(METRICS_TIME_BUCKETS)
+                }
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+            for index, bound in enumerate(METRICS_TIME_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """with METRICS.timer('score_seconds'): ... - время блока в гистограмму"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def summary(self):
+        """Машиночитаемая сводка запуска (для JSON)"""
+        with self._lock:
+            counters = {_metric_name(*key): value for key, value in sorted(self.counters.items())}
+            histograms = {
+                _metric_name(*key): {
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 4),
+                    'min': round(histogram['min'], 4),
+                    'max': round(histogram['max'], 4)
+                }
+                for key, histogram in sorted(self.histograms.items())
+            }
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_seconds': round(time.monotonic() - self._started, 3),
+            'counters': counters,
+            'histograms': histograms
+        }
+    
+    def prometheus(self):
+        """Текст в формате Prometheus exposition (значения за последний запуск)"""
+        prefix = METRICS_PROMETHEUS_PREFIX
+        lines = [
+            f'# TYPE {prefix}run_duration_seconds gauge',
+            f'{prefix}run_duration_seconds {time.monotonic() - self._started:.3f}',
+            f'# TYPE {prefix}last_run_timestamp_seconds gauge',
+            f'{prefix}last_run_timestamp_seconds {self.started_at.timestamp():.0f}'
+        ]
+        
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {prefix}{name} gauge')
+                typed.add(name)
+            lines.append(f'{prefix}{_metric_name(name, labels)} {value}')
+        
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                typed.add(name)
+            for bound, count in zip(METRICS_TIME_BUCKETS, histogram['buckets']):
+                lines.append(f'{prefix}{_metric_name(name + "_bucket", labels + (("le", bound),))} {count}')
+            lines.append(f'{prefix}{_metric_name(name + "_bucket", labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{prefix}{_metric_name(name + "_sum", labels)} {histogram["sum"]:.6f}')
+            lines.append(f'{prefix}{_metric_name(name + "_count", labels)} {histogram["count"]}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def _write_atomic(path, text):
+    """Пишем файл через временный и os.replace - читатель не увидит половину"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def emit_run_metrics(path=METRICS_FILE, prometheus_path=METRICS_PROMETHEUS_FILE):
+    """Сохраняем сводку запуска в JSON и, если задан путь, в Prometheus textfile"""
+    summary = METRICS.summary()
     try:
-        feed = feedparser.parse(feed_config['url'])
+        if path:
+            _write_atomic(path, json.dumps(summary, ensure_ascii=False, indent=2) + '\n')
+        if prometheus_path:
+            _write_atomic(prometheus_path, METRICS.prometheus())
+    except OSError as e:
+        print(f"⚠️ Error saving metrics: {e}")
+        return summary
+    
+    print(f"📈 Run metrics: {summary['duration_seconds']:.2f}s total, saved to {path or prometheus_path}")
+    return summary
+
+
+def get_numpy():
+    """NumPy при первом обращении (None, если не установлен)"""
+    global np, _numpy_loaded
+    
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
+
+
+def http_timeout(url):
+    """Timeout для хоста из HTTP_HOST_TIMEOUTS или HTTP_TIMEOUT"""
+    return HTTP_HOST_TIMEOUTS.get(urlsplit(url).hostname, HTTP_TIMEOUT)
+
+
+class HttpSession(requests.Session):
+    """requests.Session с timeout по хосту, если вызывающий его не передал
+    
+    Нужно и для tweepy: он ходит через session.request без timeout.
+    """
+    
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = http_timeout(url)
+        return super().request(method, url, *args, **kwargs)
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Общая keep-alive сессия на весь запуск (создается при первом обращении)
+    
+    GET повторяется при обрывах и 5xx с backoff, POST - только при
+    ошибке подключения (запрос до сервера не дошел, дубля не будет).
+    """
+    global _http_session
+    
+    with _http_session_lock:
+        if _http_session is not None:
+            return _http_session
         
-        if not feed.entries:
-            return []
+        retry = Retry(
+            total=HTTP_RETRIES,
+            backoff_factor=HTTP_BACKOFF,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET', 'HEAD'],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_HOSTS,
+            pool_maxsize=HTTP_POOL_MAXSIZE,
+            max_retries=retry
+        )
+        session = HttpSession()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http_session = session
+        return _http_session
+
+
+def http_connection_stats():
+    """Запросы и открытые соединения по хостам: {host: {'requests', 'connections'}}"""
+    stats = {}
+    
+    with _http_session_lock:
+        session = _http_session
+    if session is not None:
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = stats.setdefault(pool.host, {'requests': 0, 'connections': 0})
+                host['requests'] += pool.num_requests
+                host['connections'] += pool.num_connections
+    
+    for host, counts in OPENAI_HTTP_STATS.items():
+        merged = stats.setdefault(host, {'requests': 0, 'connections': 0})
+        merged['requests'] += counts['requests']
+        merged['connections'] += len(counts['connections'])
+    
+    return stats
+
+
+def close_http_session():
+    """Печатаем переиспользование соединений и закрываем сессию запуска"""
+    global _http_session
+    
+    stats = http_connection_stats()
+    total_requests = sum(host['requests'] for host in stats.values())
+    if total_requests:
+        total_connections = sum(host['connections'] for host in stats.values())
+        print(f"🔌 HTTP: {total_requests} requests over {total_connections} connections "
+              f"({total_requests - total_connections} reused)")
+        for host, counts in sorted(stats.items(), key=lambda x: -x[1]['requests']):
+            print(f"  {host}: {counts['requests']} requests, {counts['connections']} connections")
+            METRICS.inc('http_requests', counts['requests'], host=host)
+            METRICS.inc('http_connections', counts['connections'], host=host)
+    
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
+    OPENAI_HTTP_STATS.clear()
+
+
+def load_feed_cache():
+    """Загружаем ETag/Last-Modified и последние распарсенные записи источников"""
+    try:
+        with open(FEED_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_feed_cache(cache):
+    """Сохраняем кэш источников"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(FEED_CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+
+
+@dataclass(slots=True)
+class NewsItem:
+    """Новость из RSS
+    
+    Слоты вместо dict - в несколько раз меньше памяти на архивах в
+    сотни тысяч записей. Доступ как у dict (item['title'], item.get(),
+    'score' in item) оставлен для форматтеров и функций, которые
+    принимают и обычные dict. Незаполненное поле (None) считается
+    отсутствующим ключом.
+    """
+    title: str
+    link: str = ''
+    summary: str = ''
+    published_date: datetime = None
+    source: str = ''
+    source_weight: float = 1.0
+    source_priority: int = 99
+    image_url: str = None
+    entry_id: str = None
+    tokens: frozenset = None
+    score: int = None
+    categories: list = None
+    alpha_take_data: dict = None
+    
+    @classmethod
+    def from_dict(cls, data):
+        """NewsItem из dict (лишние ключи отбрасываются)"""
+        return cls(**{key: value for key, value in data.items() if key in NEWS_ITEM_FIELDS})
+    
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in NEWS_ITEM_FIELDS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        if key not in NEWS_ITEM_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in NEWS_ITEM_FIELDS and getattr(self, key) is not None
+    
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in NEWS_ITEM_FIELDS else None
+        return default if value is None else value
+    
+    def keys(self):
+        return [key for key in NEWS_ITEM_ORDER if getattr(self, key) is not None]
+    
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+
+# Порядок объявления - ключи в JSON (кэш, архив, outbox) не скачут между запусками
+NEWS_ITEM_ORDER = tuple(field.name for field in fields(NewsItem))
+NEWS_ITEM_FIELDS = frozenset(NEWS_ITEM_ORDER)
+
+
+def news_item_to_record(item):
+    """news_item -> JSON-запись для кэша и архива (даты в ISO, без токенов)"""
+    record = {key: value for key, value in item.items() if key != 'tokens'}
+    record['published_date'] = item['published_date'].isoformat()
+    return record
+
+
+def news_item_from_record(record):
+    """JSON-запись -> NewsItem"""
+    item = NewsItem.from_dict(record)
+    item.published_date = datetime.fromisoformat(record['published_date'])
+    item.tokens = tokenize_title(item.title)
+    return item
+
+
+def record_news_archive(path, records, fetched_at, verbose=True):
+    """Дописываем записи ленты (news_item_to_record) в архив (JSONL) для replay"""
+    with open(path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps({'fetched_at': fetched_at.isoformat(), **record}, ensure_ascii=False) + '\n')
+    if verbose:
+        print(f"✓ Recorded {len(records)} entries to {path}")
+
+
+def load_feed_cursors():
+    """Загружаем курсоры источников (high-water mark по дате публикации)"""
+    try:
+        with open(CURSOR_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_feed_cursors(cursors):
+    """Сохраняем курсоры источников (без служебных seen_* текущего прохода)"""
+    cursors = {
+        source_name: {key: value for key, value in cursor.items() if not key.startswith('seen_')}
+        for source_name, cursor in cursors.items()
+    }
+    with open(CURSOR_FILE, 'w', encoding='utf-8') as f:
+        json.dump(cursors, f, ensure_ascii=False, indent=2)
+
+
+def _behind_cursor(cursor, entry_date, entry_id):
+    """Запись старше курсора - уже обработана в прошлых запусках"""
+    high_water = cursor.get('high_water')
+    if not high_water:
+        return False
+    high_water = datetime.fromisoformat(high_water)
+    return entry_date < high_water or (entry_date == high_water and entry_id in cursor.get('ids', []))
+
+
+def advance_feed_cursors(cursors, held_back):
+    """Двигаем курсоры вперед после запуска
+    
+    held_back - новости выше порога, которые не попали в публикацию.
+    Курсор не переходит через них, чтобы в следующем запуске
+    они снова участвовали в отборе.
+    """
+    for source_name, cursor in cursors.items():
+        seen_high_water = cursor.pop('seen_high_water', None)
+        seen_ids = cursor.pop('seen_ids', [])
+        if not seen_high_water:
+            continue
         
-        news_items = []
-        for entry in feed.entries:
-            title = entry.get('title', '').strip()
-            link = entry.get('link', '')
-            summary = entry.get('summary', entry.get('description', '')).strip()
+        high_water = datetime.fromisoformat(seen_high_water)
+        held_dates = [item['published_date'] for item in held_back if item['source'] == source_name]
+        if held_dates and min(held_dates) <= high_water:
+            high_water = min(held_dates) - timedelta(seconds=1)
+            seen_ids = []
+        
+        cursor['high_water'] = high_water.isoformat()
+        cursor['ids'] = seen_ids
+
+
+# Элементы RSS 2.0, которые читает быстрый парсер
+RSS_MEDIA_CONTENT_TAGS = frozenset({
+    '{http://search.yahoo.com/mrss/}content',
+    '{http://search.yahoo.com/mrss}content'
+})
+RSS_CONTENT_ENCODED = '{http://purl.org/rss/1.0/modules/content/}encoded'
+
+# Даты не в pubDate быстрый парсер не разбирает - такую ленту читает feedparser
+RSS_OTHER_DATE_TAGS = (
+    '{http://purl.org/dc/elements/1.1/}date',
+    '{http://www.w3.org/2005/Atom}updated',
+    '{http://www.w3.org/2005/Atom}published'
+)
+
+# User-Agent feedparser из requirements.txt - источники уже пускают его
+FEED_USER_AGENT = 'feedparser/6.0.11 +https://github.com/kurtmckee/feedparser/'
+
+FEED_SCRIPT_REGEX = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+FEED_TAG_REGEX = re.compile('<.*?>')
+
+
+class FeedSchemaError(ValueError):
+    """Лента не похожа на RSS 2.0 наших источников - разбираем через feedparser"""
+
+
+def clean_feed_text(text):
+    """Текст заголовка/описания из ленты: без script/style, тегов и HTML entities
+    
+    Одинаково для обоих парсеров: feedparser отдает заголовки
+    экранированными (AT&amp;T), быстрый парсер - как в XML.
+    """
+    if not text:
+        return ''
+    if '<' in text:
+        text = FEED_SCRIPT_REGEX.sub('', text)
+        text = FEED_TAG_REGEX.sub('', text)
+    if '&' in text:
+        text = html.unescape(text)
+    return text.strip()
+
+
+def _rss_text(element):
+    """Текст элемента (None, если его нет)
+    
+    Вложенные элементы - HTML без CDATA, его разбирает только feedparser.
+    """
+    if element is None:
+        return None
+    if len(element):
+        raise FeedSchemaError(f"markup inside <{element.tag}>")
+    return (element.text or '').strip()
+
+
+def _rss_date(value):
+    """pubDate (RFC 822) -> кортеж UTC, как published_parsed у feedparser"""
+    try:
+        date = parsedate_to_datetime(value.strip())
+    except (TypeError, ValueError) as e:
+        raise FeedSchemaError(f"unknown date format: {value!r}") from e
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.timetuple()[:6]
+
+
+def _rss_entry(item):
+    """Запись ленты из элемента <item>"""
+    link = _rss_text(item.find('link')) or ''
+    guid = item.find('guid')
+    entry_id = _rss_text(guid) or None
+    if not link and entry_id and guid.get('isPermaLink', 'true').lower() != 'false':
+        link = entry_id
+    
+    # Как у feedparser: без description описанием считается content:encoded
+    summary = _rss_text(item.find('description'))
+    if summary is None:
+        summary = _rss_text(item.find(RSS_CONTENT_ENCODED))
+    
+    pub_date = item.findtext('pubDate')
+    if pub_date and pub_date.strip():
+        published = _rss_date(pub_date)
+    elif any(item.find(tag) is not None for tag in RSS_OTHER_DATE_TAGS):
+        raise FeedSchemaError("date outside <pubDate>")
+    else:
+        published = None
+    
+    image_url = None
+    for element in item.iter():
+        if element.tag in RSS_MEDIA_CONTENT_TAGS:
+            image_url = element.get('url')
+            break
+    else:
+        enclosure = item.find('enclosure')
+        if enclosure is not None:
+            image_url = enclosure.get('url')
+    
+    return {
+        'title': _rss_text(item.find('title')) or '',
+        'link': link,
+        'id': entry_id,
+        'summary': summary or '',
+        'published': published,
+        'image_url': image_url
+    }
+
+
+def parse_rss_fast(content):
+    """Разбираем RSS 2.0 потоковым XML парсером (expat) без feedparser
+    
+    Достаем только нужные поля: заголовок, ссылку, id, описание,
+    дату и картинку, разобранные <item> сразу освобождаем.
+    Все, что не похоже на RSS 2.0 (Atom, HTML без CDATA, незнакомая
+    дата, битый XML) - FeedSchemaError.
+    """
+    entries = []
+    try:
+        parser = ElementTree.iterparse(io.BytesIO(content), events=('end',))
+        for _, element in parser:
+            if element.tag == 'item':
+                entries.append(_rss_entry(element))
+                element.clear()
+    except ElementTree.ParseError as e:
+        raise FeedSchemaError(f"XML error: {e}") from e
+    
+    if parser.root.tag != 'rss' or parser.root.find('channel') is None:
+        raise FeedSchemaError(f"root element <{parser.root.tag}>")
+    return entries
+
+
+def _feedparser_entries(content, response_headers=None):
+    """Записи ленты через feedparser в том же виде, что у parse_rss_fast"""
+    import feedparser
+    
+    feed = feedparser.parse(content, response_headers=response_headers)
+    entries = []
+    for entry in feed.entries:
+        image_url = None
+        if 'media_content' in entry:
+            image_url = entry.media_content[0].get('url')
+        elif 'enclosures' in entry and entry.enclosures:
+            image_url = entry.enclosures[0].get('href')
+        
+        published = entry.get('published_parsed') or entry.get('updated_parsed')
+        entries.append({
+            'title': entry.get('title', '').strip(),
+            'link': entry.get('link', ''),
+            'id': entry.get('id'),
+            'summary': entry.get('summary', entry.get('description', '')).strip(),
+            'published': tuple(published[:6]) if published else None,
+            'image_url': image_url
+        })
+    return entries
+
+
+def parse_feed_entries(content, response_headers=None):
+    """Записи ленты: быстрый парсер, при незнакомой схеме - feedparser
+    
+    Returns: (entries, parser) - parser 'fast' или 'feedparser'
+    """
+    if FETCH_FAST_PARSER:
+        try:
+            return parse_rss_fast(content), 'fast'
+        except FeedSchemaError:
+            pass
+    return _feedparser_entries(content, response_headers), 'feedparser'
+
+
+def fetch_rss_feed(source_name, feed_config, cache=None, cursor=None):
+    """Парсим RSS feed
+    
+    cache - запись кэша источника (dict), обновляется на месте: в
+    cache['items'] вся лента, как пришла, до фильтра по курсору.
+    Если источник ответил 304 Not Modified, парсинг пропускается
+    и возвращаются записи из кэша.
+    
+    cursor - курсор источника (dict). Записи не новее курсора
+    отбрасываются до любой обработки, а самая свежая дата
+    запоминается в cursor['seen_high_water'] для advance_feed_cursors.
+    Даты всех записей ленты (и при 304) - в cursor['seen_dates'] для
+    SourceScheduler, без них опрос считается неудачным.
+    
+    Returns: список NewsItem ([] - лента в порядке, но новых записей нет),
+    None - ленту не удалось загрузить или разобрать
+    """
+    try:
+        headers = {'User-Agent': FEED_USER_AGENT}
+        if cache:
+            if cache.get('etag'):
+                headers['If-None-Match'] = cache['etag']
+            if cache.get('last_modified'):
+                headers['If-Modified-Since'] = cache['last_modified']
+        
+        # Качаем сами, чтобы у каждого источника был свой timeout
+        response = get_http_session().get(
+            feed_config['url'],
+            timeout=feed_config.get('timeout', FETCH_TIMEOUT),
+            headers=headers
+        )
+        
+        if response.status_code == 304 and cache and 'items' in cache:
+            cache['not_modified'] = True
+            METRICS.inc('feed_not_modified', source=source_name)
+            news_items = [news_item_from_record(record) for record in cache['items']]
+            if cursor is None:
+                return news_items
             
-            if summary:
-                summary = re.sub('<.*?>', '', summary)
-                summary = html.unescape(summary)
+            # Записи из кэша, обработанные в прошлых запусках, тоже за курсором
+            cursor['seen_dates'] = [item['published_date'].isoformat() for item in news_items]
+            return [
+                item for item in news_items
+                if not _behind_cursor(cursor, item['published_date'], item.get('entry_id') or item.get('link', ''))
+            ]
+        
+        if response.status_code != 200:
+            return None
+        
+        parse_started = time.monotonic()
+        entries, parser = parse_feed_entries(response.content, dict(response.headers))
+        METRICS.inc('feed_parser', source=source_name, parser=parser)
+        
+        if cursor is not None:
+            cursor['seen_dates'] = [datetime(*entry['published']).isoformat() for entry in entries if entry['published']]
+        
+        if not entries:
+            return None
+        
+        # В кэш (и архив --record) идет вся лента, дальше по конвейеру - только новое
+        feed_items = []
+        news_items = []
+        seen_high_water = None
+        seen_ids = []
+        for entry in entries:
+            link = entry['link']
+            entry_id = entry['id'] or link
             
-            published = entry.get('published_parsed') or entry.get('updated_parsed')
-            published_date = datetime(*published[:6]) if published else datetime.now()
+            title = clean_feed_text(entry['title'])
+            summary = clean_feed_text(entry['summary'])
+            published = entry['published']
+            item = NewsItem(
+                title=title,
+                link=link,
+                summary=summary[:300] if summary else '',
+                published_date=datetime(*published) if published else datetime.now(),
+                source=source_name,
+                source_weight=feed_config['weight_multiplier'],
+                source_priority=feed_config['priority'],
+                image_url=entry['image_url'],
+                entry_id=entry_id
+            )
+            feed_items.append(item)
             
-            image_url = None
-            if 'media_content' in entry:
-                image_url = entry.media_content[0].get('url')
-            elif 'enclosures' in entry and entry.enclosures:
-                image_url = entry.enclosures[0].get('href')
+            if published:
+                published_date = item.published_date
+                if cursor is not None and _behind_cursor(cursor, published_date, entry_id):
+                    continue
+                
+                if seen_high_water is None or published_date > seen_high_water:
+                    seen_high_water = published_date
+                    seen_ids = [entry_id]
+                elif published_date == seen_high_water:
+                    seen_ids.append(entry_id)
             
-            news_items.append({
-                'title': title,
-                'link': link,
-                'summary': summary[:300] if summary else '',
-                'published_date': published_date,
-                'source': source_name,
-                'source_weight': feed_config['weight_multiplier'],
-                'source_priority': feed_config['priority'],
-                'image_url': image_url
+            item.tokens = tokenize_title(title)
+            news_items.append(item)
+        
+        if cursor is not None and seen_high_water:
+            cursor['seen_high_water'] = seen_high_water.isoformat()
+            cursor['seen_ids'] = seen_ids
+        
+        parse_seconds = time.monotonic() - parse_started
+        METRICS.observe('parse_seconds', parse_seconds, source=source_name)
+        
+        if cache is not None:
+            cache.clear()
+            cache.update({
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'body_bytes': len(response.content),
+                'parse_seconds': round(parse_seconds, 4),
+                'items': [news_item_to_record(item) for item in feed_items]
             })
         
         return news_items
     
     except Exception as e:
-        return []
+        return None
+
+
+def _fetch_source_timed(source_name, feed_config, cache, cursor):
+    """Загружаем один источник и замеряем время"""
+    started = time.monotonic()
+    news = fetch_rss_feed(source_name, feed_config, cache=cache, cursor=cursor)
+    return news, time.monotonic() - started
+
+
+def _report_feed_cache(feed_cache, fetched_sources, polled_count):
+    """Считаем, сколько трафика и парсинга сэкономили ответы 304"""
+    FEED_CACHE_STATS.clear()
+    FEED_CACHE_STATS.update({'not_modified': 0, 'bytes_saved': 0, 'parse_seconds_saved': 0.0})
+    
+    for source_name in fetched_sources:
+        cache = feed_cache[source_name]
+        if cache.pop('not_modified', False):
+            FEED_CACHE_STATS['not_modified'] += 1
+            FEED_CACHE_STATS['bytes_saved'] += cache.get('body_bytes', 0)
+            FEED_CACHE_STATS['parse_seconds_saved'] += cache.get('parse_seconds', 0.0)
+            METRICS.inc('feed_cache_bytes_saved', cache.get('body_bytes', 0))
+    
+    if FEED_CACHE_STATS['not_modified']:
+        print(f"📦 Feed cache: {FEED_CACHE_STATS['not_modified']}/{polled_count} not modified, "
+              f"saved {FEED_CACHE_STATS['bytes_saved'] / 1024:.1f} KB "
+              f"and {FEED_CACHE_STATS['parse_seconds_saved']:.2f}s parsing")
+
+
+def iter_fetched_news(cursors=None, sources=None, record_path=None):
+    """Загружаем источники параллельно и отдаем (source_name, news) по мере готовности
+    
+    Быстрый источник уходит дальше по конвейеру, пока медленные еще
+    качаются. Порядок - по готовности, на весь сбор FETCH_DEADLINE.
+    cursors - курсоры источников из load_feed_cursors(), если переданы,
+    уже обработанные записи отбрасываются сразу при парсинге.
+    sources - имена источников для опроса (по умолчанию все RSS_SOURCES).
+    record_path - архив для replay: туда дописывается вся лента каждого
+    ответившего источника, до фильтра по курсору, чтобы архив не зависел
+    от того, что решил текущий конфиг.
+    """
+    polled = {name: RSS_SOURCES[name] for name in (sources if sources is not None else RSS_SOURCES)}
+    print(f"\n📡 Fetching news from {'sources' if len(polled) == len(RSS_SOURCES) else ', '.join(polled)}...")
+    started = time.monotonic()
+    fetched_at = datetime.now()
+    recorded = 0
+    FETCH_TIMINGS.clear()
+    
+    # Каждый поток получает свою копию записи кэша - общий dict не разделяется
+    previous_cache = load_feed_cache()
+    feed_cache = {name: dict(previous_cache.get(name, {})) for name in RSS_SOURCES}
+    
+    if cursors is not None:
+        for source_name in RSS_SOURCES:
+            cursors.setdefault(source_name, {})
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, min(FETCH_MAX_WORKERS, len(polled))))
+    futures = {
+        executor.submit(
+            _fetch_source_timed, source_name, feed_config,
+            feed_cache[source_name], cursors[source_name] if cursors is not None else None
+        ): source_name
+        for source_name, feed_config in polled.items()
+    }
+    
+    results = {}
+    failed = []
+    try:
+        for future in as_completed(futures, timeout=FETCH_DEADLINE):
+            source_name = futures[future]
+            news, elapsed = future.result()
+            results[source_name] = len(news or [])
+            FETCH_TIMINGS[source_name] = round(elapsed, 3)
+            METRICS.observe('fetch_seconds', elapsed, source=source_name)
+            
+            if news is None:
+                failed.append(source_name)
+                METRICS.inc('fetch_errors', source=source_name)
+                print(f"✗ {source_name}: Invalid RSS feed")
+                continue
+            
+            if record_path:
+                records = feed_cache[source_name].get('items', [])
+                record_news_archive(record_path, records, fetched_at, verbose=False)
+                recorded += len(records)
+            
+            METRICS.inc('fetch_entries', len(news), source=source_name)
+            if news:
+                print(f"✓ Parsed {source_name}: {len(news)} entries ({elapsed:.2f}s)")
+                yield source_name, news
+            else:
+                # Обычное состояние повторного запуска: все записи уже за курсором
+                print(f"· {source_name}: no new entries ({elapsed:.2f}s)")
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # Не ждем зависшие источники - их результат отбрасываем
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+        for source_name in polled:
+            if source_name in results:
+                continue
+            print(f"✗ {source_name}: Timed out (deadline {FETCH_DEADLINE}s)")
+            METRICS.inc('fetch_timeouts', source=source_name)
+            if cursors is not None:
+                # Зависший поток может дописать курсор позже - отвязываемся от него
+                cursors[source_name] = {
+                    k: v for k, v in cursors[source_name].items() if not k.startswith('seen_')
+                }
+        
+        # Для зависших источников оставляем старую запись - поток мог еще не дописать новую
+        _report_feed_cache(feed_cache, results, len(polled))
+        save_feed_cache({
+            name: feed_cache[name] if name in results else previous_cache.get(name, {})
+            for name in RSS_SOURCES
+        })
+        
+        METRICS.observe('fetch_total_seconds', time.monotonic() - started)
+        if record_path:
+            print(f"✓ Recorded {recorded} entries to {record_path}")
+        # Ни один источник не ответил лентой: все с ошибкой или по timeout
+        if polled and len(failed) == len(results):
+            print("❌ All RSS sources failed")
+        print(f"Total news fetched: {sum(results.values())} in {time.monotonic() - started:.2f}s")
+
+
+def filter_published_stream(chunks, published_index):
+    """Стадия конвейера: отбрасываем уже опубликованные"""
+    for source_name, news in chunks:
+        PIPELINE_STATS['fetched'] += len(news)
+        new_news = []
+        with METRICS.timer('dedup_seconds'):
+            for item in news:
+                if not is_duplicate(item, published_index):
+                    new_news.append(item)
+                else:
+                    print(f"  ⚠ Already published ({'similar title' if not item.get('link') else 'link'}): {item['title'][:60]}...")
+        PIPELINE_STATS['new'] += len(new_news)
+        METRICS.inc('pipeline_items', len(news), stage='fetched')
+        METRICS.inc('pipeline_items', len(new_news), stage='new')
+        yield source_name, new_news
+
 
+def score_stream(chunks):
+    """Стадия конвейера: считаем важность и оставляем новости выше порога"""
+    for source_name, news in chunks:
+        with METRICS.timer('score_seconds'):
+            scores, categories = score_batch(news)
+            scored_news = apply_thresholds(news, scores, categories)
+        PIPELINE_STATS['scored'] += len(scored_news)
+        METRICS.inc('pipeline_items', len(scored_news), stage='scored')
+        yield source_name, scored_news
 
-def fetch_all_news():
-    """Собираем новости из всех источников"""
-    print("\n📡 Fetching news from sources...")
-    all_news = []
+
+def collect_candidates(chunks):
+    """Собираем кандидатов из конвейера в порядке RSS_SOURCES
     
-    for source_name, feed_config in RSS_SOURCES.items():
-        news = fetch_rss_feed(source_name, feed_config)
-        if news:
-            print(f"✓ Parsed {source_name}: {len(news)} entries")
-            all_news.extend(news)
+    Дедупликация выбирает из похожих новостей по порядку, поэтому
+    кандидаты упорядочиваются так же, как без стриминга.
+    """
+    by_source = {}
+    for source_name, news in chunks:
+        by_source.setdefault(source_name, []).extend(news)
+    return [item for source_name in RSS_SOURCES for item in by_source.get(source_name, [])]
+
+
+class PublishedStateError(RuntimeError):
+    """Файлы опубликованных новостей повреждены - начинать с нуля нельзя (будут повторы)"""
+
+
+def published_key(record):
+    """Ключ записи: хэш ссылки или заголовка, если ссылки нет"""
+    return hashlib.sha256((record.get('link') or record['title']).encode('utf-8')).hexdigest()
+
+
+def normalize_published_record(record):
+    """Запись в едином виде: дата в ISO (сравнима как строка), токены списком"""
+    try:
+        published_date = datetime.fromisoformat(record['published_date']).isoformat()
+    except (ValueError, KeyError, TypeError):
+        published_date = datetime.now().isoformat()
+    return {
+        'title': record['title'],
+        'link': record.get('link') or '',
+        'published_date': published_date,
+        'tokens': sorted(title_tokens(record))
+    }
+
+
+class PublishedStore:
+    """Опубликованные новости в SQLite
+    
+    Ключ - хэш ссылки (или заголовка, если ссылки нет), индекс по дате
+    публикации. Запись только добавляет
+    новые строки, очистка - удаление по диапазону дат через индекс.
+    Каждая запись - одна транзакция, поэтому падение посреди запуска
+    не портит базу.
+    
+    Записи, которые отдал load (или уже сохранил add), при следующем
+    add пропускаются без хэширования - стоимость сохранения зависит
+    только от числа новых записей.
+    """
+    
+    def __init__(self, path=PUBLISHED_DB_FILE):
+        self.path = path
+        self._stored = {}  # id(record) -> record (ссылка держит id занятым)
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS published ("
+                "link_hash TEXT PRIMARY KEY, title TEXT NOT NULL, link TEXT NOT NULL, "
+                "published_date TEXT NOT NULL, tokens TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS published_by_date ON published (published_date)")
+            # Сигнатуру токенов старых баз никто не читал - убираем колонку и ее индекс
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(published)")]
+            if 'signature' in columns:
+                self._conn.execute("DROP INDEX IF EXISTS published_by_signature")
+                self._conn.execute("ALTER TABLE published DROP COLUMN signature")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    
+    @staticmethod
+    def make_row(record):
+        """Строка таблицы из записи {'title', 'link', 'published_date', 'tokens'}"""
+        record = normalize_published_record(record)
+        return (
+            published_key(record),
+            record['title'],
+            record['link'],
+            record['published_date'],
+            ' '.join(record['tokens'])  # в токенах нет пробелов, split быстрее json.loads
+        )
+    
+    def load(self, since=None):
+        """Записи не старше since (datetime) в порядке публикации"""
+        rows = self._conn.execute(
+            "SELECT title, link, published_date, tokens FROM published "
+            "WHERE published_date >= ? ORDER BY published_date",
+            (since.isoformat() if since else '',)
+        )
+        records = [
+            {'title': title, 'link': link, 'published_date': published_date, 'tokens': tokens.split()}
+            for title, link, published_date, tokens in rows
+        ]
+        self._stored.update((id(record), record) for record in records)
+        return records
+    
+    def add(self, records):
+        """Добавляем записи, которых еще нет. Возвращает число добавленных"""
+        new_records = [
+            record for record in records
+            if id(record) not in self._stored and isinstance(record, dict) and record.get('title')
+        ]
+        rows = [self.make_row(record) for record in new_records]
+        self._stored.update((id(record), record) for record in new_records)
+        with self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO published (link_hash, title, link, published_date, tokens) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            return self._conn.total_changes - before
+    
+    def delete_before(self, cutoff):
+        """Удаляем записи старше cutoff (datetime). Возвращает число удаленных"""
+        with self._conn:
+            return self._conn.execute(
+                "DELETE FROM published WHERE published_date < ?", (cutoff.isoformat(),)
+            ).rowcount
+    
+    def get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key, value):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM published").fetchone()[0]
+    
+    def close(self):
+        self._conn.close()
+
+
+class PublishedJournal:
+    """Опубликованные новости в двух JSONL файлах: snapshot + журнал
+    
+    Запуск дописывает в журнал только новые записи (одна строка на
+    запись, fsync), поэтому запись стоит столько, сколько новых постов.
+    Когда в журнале набирается compact_every строк, записи из окна
+    переписываются в новый snapshot (временный файл + os.replace), а
+    журнал очищается. Старые записи выпадают именно при compaction.
+    
+    Оборванная последняя строка журнала (падение во время записи)
+    отрезается. Любая другая битая строка - PublishedStateError.
+    """
+    
+    def __init__(self, snapshot_path=PUBLISHED_SNAPSHOT_FILE, journal_path=PUBLISHED_JOURNAL_FILE,
+                 compact_every=PUBLISHED_COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.path = journal_path
+        self.compact_every = compact_every
+        self._records = None  # ссылка (или заголовок) -> запись
+        self._journal_lines = 0
+        self._stored = {}  # id(record) -> record (ссылка держит id занятым)
+    
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.path)
+    
+    def _read_lines(self, path, repair_tail=False):
+        """Записи из JSONL файла (repair_tail - отрезать оборванную последнюю строку)"""
+        if not os.path.exists(path):
+            return []
+        
+        with open(path, 'rb') as f:
+            data = f.read()
+        
+        # Обычно файл целый - разбираем одним вызовом, построчно только для поиска ошибки
+        if data.endswith(b'\n'):
+            try:
+                return json.loads(b'[' + b','.join(data.splitlines()) + b']')
+            except json.JSONDecodeError:
+                pass
+        
+        records = []
+        offset = 0
+        while offset < len(data):
+            end = data.find(b'\n', offset)
+            if end == -1:
+                if not repair_tail:
+                    raise PublishedStateError(f"{path} ends with an incomplete record")
+                print(f"⚠ {path}: dropping incomplete last record ({len(data) - offset} bytes)")
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+                break
+            try:
+                records.append(json.loads(data[offset:end]))
+            except json.JSONDecodeError as e:
+                raise PublishedStateError(f"{path} corrupted at byte {offset}: {e}")
+            offset = end + 1
+        return records
+    
+    def _ensure_loaded(self):
+        if self._records is not None:
+            return
+        
+        records = {}
+        for record in self._read_lines(self.snapshot_path):
+            records[record['link'] or record['title']] = record
+        journal = self._read_lines(self.path, repair_tail=True)
+        for record in journal:
+            records[record['link'] or record['title']] = record
+        self._records = records
+        self._journal_lines = len(journal)
+    
+    def load(self, since=None):
+        """Записи не старше since (datetime) в порядке публикации"""
+        self._ensure_loaded()
+        cutoff = since.isoformat() if since else ''
+        records = sorted(
+            (record for record in self._records.values() if record['published_date'] >= cutoff),
+            key=lambda record: record['published_date']
+        )
+        self._stored.update((id(record), record) for record in records)
+        return records
+    
+    def add(self, records):
+        """Дописываем в журнал записи, которых еще нет. Возвращает число добавленных"""
+        self._ensure_loaded()
+        new_records = []
+        for record in records:
+            if id(record) in self._stored or not isinstance(record, dict) or not record.get('title'):
+                continue
+            self._stored[id(record)] = record
+            normalized = normalize_published_record(record)
+            key = normalized['link'] or normalized['title']
+            if key not in self._records:
+                self._records[key] = normalized
+                new_records.append(normalized)
+        
+        if new_records:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in new_records))
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_lines += len(new_records)
+            if self._journal_lines >= self.compact_every:
+                self.compact()
+        return len(new_records)
+    
+    def delete_before(self, cutoff):
+        """Убираем из памяти записи старше cutoff (из файлов - при compaction)"""
+        self._ensure_loaded()
+        cutoff = cutoff.isoformat()
+        old_keys = [key for key, record in self._records.items() if record['published_date'] < cutoff]
+        for key in old_keys:
+            del self._records[key]
+        return len(old_keys)
+    
+    def compact(self, records=None):
+        """Переписываем текущие записи в snapshot и очищаем журнал"""
+        if records is not None:
+            self._records = {record['link'] or record['title']: record for record in records}
+        self._ensure_loaded()
+        
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in sorted(self._records.values(), key=lambda record: record['published_date']):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        
+        # Упадем здесь - записи журнала уже есть в snapshot, при загрузке они просто совпадут
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._journal_lines = 0
+    
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._records)
+    
+    def close(self):
+        pass
+
+
+def migrate_published_journal(journal):
+    """Однократно переносим записи в журнал из published_news.db или published_news.json
+    
+    Старые файлы не трогаем. Битый JSON - PublishedStateError, а не пустая история.
+    """
+    if os.path.exists(PUBLISHED_DB_FILE):
+        store = PublishedStore(PUBLISHED_DB_FILE)
+        try:
+            records = store.load()
+        finally:
+            store.close()
+        source = PUBLISHED_DB_FILE
+    elif os.path.exists(PUBLISHED_FILE):
+        records = [
+            normalize_published_record(record) for record in _load_published_json()
+            if isinstance(record, dict) and record.get('title')
+        ]
+        source = PUBLISHED_FILE
+    else:
+        return 0
+    
+    journal.compact(records)
+    print(f"✓ Migrated {len(journal)} items from {source} to {journal.snapshot_path}")
+    return len(journal)
+
+
+def migrate_published_json(store, path=PUBLISHED_FILE):
+    """Однократно переносим записи из published_news.json в SQLite
+    
+    JSON файл не трогаем. Битый JSON не переносится и не помечается
+    перенесенным - разбираться с ним нужно вручную.
+    """
+    if store.get_meta('migrated_json') or not os.path.exists(path):
+        return 0
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    except json.JSONDecodeError:
+        print(f"⚠ {path} corrupted - not migrated to {store.path}")
+        return 0
+    
+    added = store.add(records)
+    store.set_meta('migrated_json', datetime.now().isoformat())
+    print(f"✓ Migrated {added} items from {path} to {store.path}")
+    return added
+
+
+_published_store = None
+
+
+def get_published_store():
+    """Хранилище опубликованных новостей на весь запуск"""
+    global _published_store
+    
+    if _published_store is None:
+        if PUBLISHED_BACKEND == 'journal':
+            _published_store = PublishedJournal(PUBLISHED_SNAPSHOT_FILE, PUBLISHED_JOURNAL_FILE, PUBLISHED_COMPACT_EVERY)
+            if not _published_store.exists():
+                migrate_published_journal(_published_store)
         else:
-            print(f"✗ {source_name}: Invalid RSS feed")
+            _published_store = PublishedStore(PUBLISHED_DB_FILE)
+            migrate_published_json(_published_store, PUBLISHED_FILE)
+    return _published_store
+
+
+def close_published_store():
+    global _published_store
     
-    print(f"Total news fetched: {len(all_news)}")
-    return all_news
+    if _published_store is not None:
+        _published_store.close()
+        _published_store = None
 
 
-def load_published_news():
-    """Загружаем опубликованные новости"""
+def load_published_news(days=None):
+    """Загружаем опубликованные новости
+    
+    days - сразу удаляем записи старше окна (в SQLite - индексом по дате,
+    в журнале - из памяти, из файлов при следующей compaction).
+    """
+    if PUBLISHED_BACKEND == 'json':
+        published = _load_published_json()
+        return cleanup_old_news(published, days=days) if days is not None else published
+    
+    store = get_published_store()
+    since = None
+    if days is not None:
+        since = datetime.now() - timedelta(days=days)
+        removed = store.delete_before(since)
+        if removed:
+            print(f"✓ Removed {removed} items older than {days} days")
+    
+    published = store.load(since)
+    print(f"✓ Loaded {len(published)} items from {store.path}")
+    return published
+
+
+def save_published_news(published):
+    """Сохраняем опубликованные новости (в журнал и SQLite дописываются только новые)"""
+    if PUBLISHED_BACKEND == 'json':
+        _save_published_json(published)
+        return
+    
+    store = get_published_store()
+    added = store.add(published)
+    print(f"✓ Saved {added} new published items to {store.path} ({len(store)} total)")
+
+
+def _load_published_json():
+    """Загружаем опубликованные новости из JSON"""
     try:
         with open(PUBLISHED_FILE, 'r', encoding='utf-8') as f:
             published = json.load(f)
@@ -117,13 +1382,13 @@ def load_published_news():
     except FileNotFoundError:
         print(f"⚠ {PUBLISHED_FILE} not found, creating new")
         return []
-    except json.JSONDecodeError:
-        print(f"⚠ {PUBLISHED_FILE} corrupted, starting fresh")
-        return []
+    except json.JSONDecodeError as e:
+        # Пустая история = повторная публикация всего окна, поэтому падаем
+        raise PublishedStateError(f"{PUBLISHED_FILE} corrupted: {e}")
 
 
-def save_published_news(published):
-    """Сохраняем опубликованные новости"""
+def _save_published_json(published):
+    """Сохраняем опубликованные новости в JSON"""
     with open(PUBLISHED_FILE, 'w', encoding='utf-8') as f:
         json.dump(published, f, ensure_ascii=False, indent=2)
     print(f"✓ Saved {len(published)} published items to {PUBLISHED_FILE}")
@@ -157,80 +1422,254 @@ def cleanup_old_news(published, days=7):
     return cleaned
 
 
-def calculate_similarity(title1, title2):
-    """Jaccard similarity для заголовков"""
-    def tokenize(text):
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
-        return set(text.split())
-    
-    tokens1 = tokenize(title1)
-    tokens2 = tokenize(title2)
+@lru_cache(maxsize=16384)
+def tokenize_title(text):
+    """Токены заголовка для Jaccard similarity (кэшируются по тексту)"""
+    text = text.lower()
+    text = re.sub(r'[^\w\s]', '', text)
+    return frozenset(text.split())
+
+
+def title_tokens(item):
+    """Токены заголовка новости
     
+    У свежих новостей токены считаются один раз при парсинге (item['tokens']),
+    у опубликованных записей лежат в JSON списком - их не пересчитываем.
+    """
+    tokens = item.get('tokens')
+    if tokens is None:
+        return tokenize_title(item.get('title', ''))
+    if not isinstance(tokens, frozenset):
+        return frozenset(tokens)
+    return tokens
+
+
+def token_similarity(tokens1, tokens2):
+    """Jaccard similarity для готовых наборов токенов"""
     if not tokens1 or not tokens2:
         return 0.0
     
-    intersection = len(tokens1.intersection(tokens2))
-    union = len(tokens1.union(tokens2))
+    intersection = len(tokens1 & tokens2)
+    union = len(tokens1) + len(tokens2) - intersection
     
     return intersection / union if union > 0 else 0.0
 
 
-def is_duplicate(news_item, published):
-    """Проверяем дубликаты"""
-    link = news_item.get('link', '')
-    title = news_item.get('title', '')
+def calculate_similarity(title1, title2):
+    """Jaccard similarity для заголовков"""
+    return token_similarity(tokenize_title(title1), tokenize_title(title2))
+
+
+class DedupIndex:
+    """Индекс опубликованных новостей для поиска дубликатов без полного перебора
+    
+    Точные совпадения ссылок - через dict, похожие заголовки - через
+    инвертированный индекс токенов: Jaccard считается только для
+    заголовков, у которых есть общий токен среди самых редких токенов
+    проверяемого (prefix filter).
+    Результат совпадает с попарным calculate_similarity >= threshold.
+    
+    Если при добавлении указана дата, проверки с since=... игнорируют
+    записи старше since (нужно replay, где окно публикаций сдвигается).
+    """
+    
+    def __init__(self, items=(), threshold=0.5):
+        self.threshold = threshold
+        self.links = {}
+        self.token_sets = []
+        self.dates = []
+        self.postings = {}
+        for item in items:
+            self.add(item)
+    
+    def __len__(self):
+        return len(self.token_sets)
     
-    for pub_item in published:
-        pub_link = pub_item.get('link', '')
-        pub_title = pub_item.get('title', '')
+    def add(self, item, date=None):
+        """Добавляем новость в индекс"""
+        link = item.get('link', '')
+        if link:
+            self.links[link] = date
         
-        if link and pub_link and link == pub_link:
-            return True
+        if not item.get('title'):
+            return
+        
+        tokens = title_tokens(item)
+        if not tokens:
+            return
+        
+        position = len(self.token_sets)
+        self.token_sets.append(tokens)
+        self.dates.append(date)
+        for token in tokens:
+            self.postings.setdefault(token, []).append(position)
+    
+    def _is_current(self, date, since):
+        return since is None or date is None or date >= since
+    
+    def has_similar_tokens(self, tokens, since=None):
+        """Есть ли в индексе заголовок с similarity >= threshold"""
+        if not tokens:
+            return False
         
-        if title and pub_title:
-            similarity = calculate_similarity(title, pub_title)
-            if similarity >= 0.5:
+        # Jaccard >= threshold требует не меньше threshold * |T| общих токенов,
+        # значит хотя бы один общий токен найдется среди |T| - required + 1
+        # самых редких токенов - кандидатов берем только по ним
+        required = max(1, int(self.threshold * len(tokens)))
+        rare_first = sorted(tokens, key=lambda token: len(self.postings.get(token, ())))
+        candidates = set()
+        for token in rare_first[:len(tokens) - required + 1]:
+            candidates.update(self.postings.get(token, ()))
+        
+        for position in candidates:
+            other = self.token_sets[position]
+            intersection = len(tokens & other)
+            union = len(tokens) + len(other) - intersection
+            if intersection / union >= self.threshold and self._is_current(self.dates[position], since):
                 return True
+        
+        return False
     
-    return False
+    def contains(self, news_item, since=None):
+        """Ссылка уже опубликована или есть похожий заголовок"""
+        link = news_item.get('link', '')
+        if link and link in self.links and self._is_current(self.links[link], since):
+            return True
+        
+        return bool(news_item.get('title')) and self.has_similar_tokens(title_tokens(news_item), since)
 
 
-def calculate_importance(news_item):
-    """Рассчитываем важность новости"""
+def is_duplicate(news_item, published):
+    """Проверяем дубликаты
+    
+    published - DedupIndex (быстро) или список опубликованных новостей.
+    """
+    if not isinstance(published, DedupIndex):
+        published = DedupIndex(published)
+    
+    return published.contains(news_item)
+
+
+class KeywordMatcher:
+    """Автомат Aho-Corasick: находит все ключевые слова в тексте за один проход
+    
+    keywords - пары (keyword, label). find() возвращает set меток всех
+    ключевых слов, которые встречаются в тексте как подстрока
+    (то же самое, что `keyword in text` для каждого слова).
+    """
+    
+    def __init__(self, keywords):
+        transitions = [{}]
+        outputs = [set()]
+        
+        for keyword, label in keywords:
+            node = 0
+            for char in keyword:
+                if char not in transitions[node]:
+                    transitions.append({})
+                    outputs.append(set())
+                    transitions[node][char] = len(transitions) - 1
+                node = transitions[node][char]
+            outputs[node].add(label)
+        
+        # Достраиваем переходы по суффиксным ссылкам до полного автомата,
+        # чтобы на каждый символ был ровно один переход
+        fail = [0] * len(transitions)
+        queue = list(transitions[0].values())
+        for node in queue:
+            for char, child in transitions[node].items():
+                fallback = fail[node]
+                while fallback and char not in transitions[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = transitions[fallback].get(char, 0)
+                outputs[child] |= outputs[fail[child]]
+                queue.append(child)
+            for char, target in transitions[fail[node]].items():
+                transitions[node].setdefault(char, target)
+        
+        self.transitions = transitions
+        self.outputs = [frozenset(output) for output in outputs]
+    
+    def find(self, text):
+        """Метки всех ключевых слов, найденных в тексте"""
+        transitions = self.transitions
+        outputs = self.outputs
+        found = set(outputs[0])
+        node = 0
+        for char in text:
+            node = transitions[node].get(char)
+            if node is None:
+                node = transitions[0].get(char, 0)
+            if outputs[node]:
+                found |= outputs[node]
+        return found
+
+
+def build_title_matcher():
+    """Собираем матчер заголовков из news_config (исключения, категории, флаги)"""
+    keywords = [(keyword, ('exclude',)) for keyword in EXCLUDE_KEYWORDS]
+    for category, rules in IMPORTANCE_RULES.items():
+        keywords += [(keyword.lower(), ('category', category)) for keyword in rules['keywords']]
+    keywords += [('sec', ('flag', 'sec')), ('bitcoin', ('flag', 'bitcoin'))]
+    return KeywordMatcher(keywords)
+
+
+def build_clickbait_regex():
+    """Все CLICKBAIT_PATTERNS одной скомпилированной регуляркой"""
+    if not CLICKBAIT_PATTERNS:
+        return None
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in CLICKBAIT_PATTERNS))
+
+
+# Строятся один раз при импорте
+TITLE_MATCHER = build_title_matcher()
+CLICKBAIT_REGEX = build_clickbait_regex()
+BTC_REGEX = re.compile(r'\bbtc\b')
+NUMERIC_REGEX = re.compile(r'\$\s*[\d,]+\.?\d*\s*[mbk]?|\$\s*[\d,]+|\d+\.?\d*%', re.IGNORECASE)
+
+
+def _match_importance(news_item, verbose=True):
+    """Баллы категорий без множителей: (base_score, categories, is_bitcoin, has_numbers)"""
     title = news_item['title'].lower()
     original_title = news_item['title']  # Для паттернов с учетом регистра
     score = 0
     matched_categories = []
     
-    for exclude in EXCLUDE_KEYWORDS:
-        if exclude in title:
-            return 0, ['EXCLUDED']
+    # Исключения, категории и флаги - один проход по заголовку
+    hits = TITLE_MATCHER.find(title)
+    
+    if ('exclude',) in hits:
+        return 0, ['EXCLUDED'], False, False
     
     # Фильтруем кликбейт/неполные заголовки
-    for pattern in CLICKBAIT_PATTERNS:
-        if re.search(pattern, original_title):
+    if CLICKBAIT_REGEX and CLICKBAIT_REGEX.search(original_title):
+        if verbose:
             print(f"  ⚠️ Clickbait filtered: {original_title[:50]}...")
-            return 0, ['CLICKBAIT']
+        return 0, ['CLICKBAIT'], False, False
     
     for category, rules in IMPORTANCE_RULES.items():
-        category_matched = False
-        for keyword in rules['keywords']:
-            if keyword.lower() in title:
-                score += rules['weight']
-                if category not in matched_categories:
-                    matched_categories.append(category)
-                category_matched = True
-                break
+        if ('category', category) in hits:
+            score += rules['weight']
+            matched_categories.append(category)
     
-    if 'sec' in title and 'CRITICAL' not in matched_categories and 'HIGH' not in matched_categories:
+    if ('flag', 'sec') in hits and 'CRITICAL' not in matched_categories and 'HIGH' not in matched_categories:
         score += 50
         matched_categories.append('HIGH')
     
-    if 'bitcoin' in title or re.search(r'\bbtc\b', title):
+    is_bitcoin = ('flag', 'bitcoin') in hits or bool(BTC_REGEX.search(title))
+    has_numbers = bool(NUMERIC_REGEX.search(title))
+    
+    return score, matched_categories, is_bitcoin, has_numbers
+
+
+def calculate_importance(news_item):
+    """Рассчитываем важность новости"""
+    score, matched_categories, is_bitcoin, has_numbers = _match_importance(news_item)
+    
+    if is_bitcoin:
         score *= 1.3
     
-    if re.search(r'\$\s*[\d,]+\.?\d*\s*[mbk]?|\$\s*[\d,]+|\d+\.?\d*%', title, re.IGNORECASE):
+    if has_numbers:
         score *= 1.2
     
     score *= news_item['source_weight']
@@ -238,58 +1677,390 @@ def calculate_importance(news_item):
     return round(score), matched_categories
 
 
-def deduplicate_news(news_list):
-    """Удаляем дубликаты по similarity"""
-    if not news_list:
-        return []
+# С какого размера пачки множители считаются через NumPy: на пачках
+# одного запуска (десятки новостей) импорт NumPy дольше самого расчета
+SCORE_NUMPY_MIN_BATCH = 10000
+
+
+def score_batch(items, verbose=True):
+    """Рассчитываем важность пачки новостей
     
-    sorted_news = sorted(news_list, key=lambda x: (x['source_priority'], -x['score']))
+    Возвращает два параллельных списка: баллы и категории.
+    Множители (bitcoin x1.3, цифры x1.2, source_weight) применяются
+    ко всей пачке сразу - через NumPy для пачек от SCORE_NUMPY_MIN_BATCH,
+    если он установлен. Результат совпадает с calculate_importance.
+    """
+    matches = [_match_importance(item, verbose) for item in items]
+    categories = [match[1] for match in matches]
+    np = get_numpy() if len(matches) >= SCORE_NUMPY_MIN_BATCH else None
     
-    unique_news = []
-    for item in sorted_news:
-        is_dup = False
-        for unique_item in unique_news:
-            similarity = calculate_similarity(item['title'], unique_item['title'])
-            if similarity >= 0.3:
-                is_dup = True
-                break
+    if np is not None:
+        scores = np.array([match[0] for match in matches], dtype=np.float64)
+        scores = scores * np.where([match[2] for match in matches], 1.3, 1.0)
+        scores = scores * np.where([match[3] for match in matches], 1.2, 1.0)
+        scores = scores * np.array([item['source_weight'] for item in items], dtype=np.float64)
+        return np.rint(scores).astype(np.int64).tolist(), categories
+    
+    scores = []
+    for item, (score, _, is_bitcoin, has_numbers) in zip(items, matches):
+        score = score * (1.3 if is_bitcoin else 1.0)
+        score = score * (1.2 if has_numbers else 1.0)
+        scores.append(round(score * item['source_weight']))
+    
+    return scores, categories
+
+
+def source_threshold(source):
+    """Порог публикации для источника"""
+    return STOCK_MARKET_THRESHOLD if source in STOCK_MARKET_SOURCES else MIN_IMPORTANCE_SCORE
+
+
+def apply_thresholds(items, scores, categories):
+    """Оставляем новости не ниже порога своего источника и проставляем score/categories"""
+    np = get_numpy() if len(items) >= SCORE_NUMPY_MIN_BATCH else None
+    if np is not None:
+        thresholds = np.array([source_threshold(item['source']) for item in items])
+        passed = (np.asarray(scores) >= thresholds).tolist()
+    else:
+        passed = [score >= source_threshold(item['source']) for item, score in zip(items, scores)]
+    
+    scored_news = []
+    for item, score, item_categories, keep in zip(items, scores, categories, passed):
+        if keep:
+            item['score'] = score
+            item['categories'] = item_categories
+            scored_news.append(item)
+    
+    return scored_news
+
+
+# Порог схожести для дедупликации внутри запуска
+BATCH_DEDUP_THRESHOLD = 0.3
+
+
+class TopNewsSelector:
+    """Отбор топ-K новостей без дубликатов за один проход
+    
+    Кандидаты подаются в порядке дедупликации (source_priority, -score):
+    из похожих новостей остается первая, то есть из источника с лучшим
+    приоритетом. Принятые новости лежат в куче на limit элементов по
+    (score, -порядок), поэтому при равных баллах выигрывает более ранняя.
+    
+    Похожесть проверяется по членам кучи и по индексу (DedupIndex)
+    принятых, но вытесненных из кучи новостей - вытесненная новость
+    все равно отсекает свои дубликаты, как в полном попарном сравнении.
+    """
+    
+    def __init__(self, limit=MAX_NEWS_PER_RUN, threshold=BATCH_DEDUP_THRESHOLD):
+        self.limit = limit
+        self.threshold = threshold
+        self.accepted = 0
+        self._heap = []
+        self._evicted = DedupIndex(threshold=threshold)
+        self._seq = 0
+    
+    def _is_duplicate(self, tokens):
+        for _, _, member in self._heap:
+            if token_similarity(tokens, title_tokens(member)) >= self.threshold:
+                return True
+        return self._evicted.has_similar_tokens(tokens)
+    
+    def offer(self, item):
+        """Предлагаем кандидата. False - дубликат уже принятой новости"""
+        if self._is_duplicate(title_tokens(item)):
+            return False
+        
+        self.accepted += 1
+        entry = (item['score'], -self._seq, item)
+        self._seq += 1
+        if len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+            return True
+        
+        # Вытесняем минимальную (или сразу откладываем новую) - в индекс для дедупликации
+        if self._heap and entry[:2] > self._heap[0][:2]:
+            entry = heapq.heapreplace(self._heap, entry)
+        self._evicted.add(entry[2])
+        return True
+    
+    def top(self):
+        """Принятые новости с лучшими баллами, по убыванию"""
+        return [item for _, _, item in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+
+def select_unique_top_news(candidates, limit=MAX_NEWS_PER_RUN):
+    """Топ новостей без дубликатов: одна сортировка по приоритету и один проход
+    
+    Полная сортировка кандидатов остается: дедупликация должна видеть их
+    в порядке (source_priority, -score), чтобы из похожих осталась новость
+    лучшего источника. Экономия - в дедупликации: кандидат сравнивается с
+    limit членами кучи и индексом вытесненных, а не попарно со всеми
+    принятыми.
+    
+    Результат совпадает с попарной дедупликацией и сортировкой
+    (эталон - bench_helpers.select_top_news(deduplicate_news(...))).
+    Возвращает (топ новостей, сколько осталось после дедупликации).
+    """
+    selector = TopNewsSelector(limit)
+    for item in sorted(candidates, key=lambda x: (x['source_priority'], -x['score'])):
+        selector.offer(item)
+    return selector.top(), selector.accepted
+
+
+class ImageCache:
+    """Кэш обрезанных картинок: индекс в SQLite, байты в файлах
+    
+    Индекс хранит для URL ETag оригинала и имя файла - sha256 самих
+    байтов, поэтому одна картинка по разным URL лежит одним файлом.
+    Записи старше ttl_days сверяются с источником по ETag, сверх
+    max_entries вытесняются давно не использованные URL, а файлы
+    без ссылок удаляет prune при открытии кэша - пока идет запуск,
+    другой поток может записать файл раньше своей строки в индексе.
+    
+    Там же хранится file_id, который Telegram вернул для картинки:
+    повторно фото отправляется по file_id без загрузки.
+    """
+    
+    def __init__(self, directory=IMAGE_CACHE_DIR, ttl_days=IMAGE_CACHE_TTL_DAYS,
+                 max_entries=IMAGE_CACHE_MAX_ENTRIES, max_file_ids=TELEGRAM_FILE_ID_MAX_ENTRIES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.max_file_ids = max_file_ids
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "url TEXT PRIMARY KEY, etag TEXT, digest TEXT NOT NULL, "
+                "validated_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS telegram_files ("
+                "url TEXT PRIMARY KEY, file_id TEXT NOT NULL, accessed_at REAL NOT NULL)"
+            )
+        self.prune()
+    
+    def _file(self, digest):
+        return os.path.join(self.directory, f"{digest}.jpg")
+    
+    def lookup(self, url):
+        """Запись кэша {'etag', 'digest', 'fresh'} или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, digest, validated_at FROM images WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or not os.path.exists(self._file(row[1])):
+            return None
+        return {'etag': row[0], 'digest': row[1], 'fresh': row[2] >= time.time() - self.ttl}
+    
+    def read(self, url, entry, revalidated=False):
+        """Байты из кэша (revalidated - источник ответил 304)"""
+        with open(self._file(entry['digest']), 'rb') as f:
+            data = f.read()
+        now = time.time()
+        with self._lock, self._conn:
+            if revalidated:
+                self._conn.execute("UPDATE images SET validated_at = ? WHERE url = ?", (now, url))
+            self._conn.execute("UPDATE images SET accessed_at = ? WHERE url = ?", (now, url))
+            self.hits += 1
+        return data
+    
+    def put(self, url, data, etag=None):
+        """Сохраняем байты и вытесняем лишние записи"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._file(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
         
-        if not is_dup:
-            unique_news.append(item)
+        now = time.time()
+        with self._lock, self._conn:
+            self.misses += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (url, etag, digest, validated_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, etag, digest, now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM images WHERE url IN ("
+                "SELECT url FROM images ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
     
-    return unique_news
+    def prune(self):
+        """Удаляем файлы, на которые не ссылается ни одна запись
+        
+        Только когда кэшем никто не пишет (при открытии): иначе можно
+        удалить файл, строка которого еще не попала в индекс.
+        """
+        with self._lock:
+            used = {row[0] for row in self._conn.execute("SELECT DISTINCT digest FROM images")}
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.jpg') and name[:-4] not in used:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+    
+    def get_file_id(self, url):
+        """file_id фото, уже загруженного в Telegram, или None"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT file_id FROM telegram_files WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE telegram_files SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            return row[0]
+    
+    def put_file_id(self, url, file_id):
+        """Запоминаем file_id и вытесняем давно не использованные"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO telegram_files (url, file_id, accessed_at) VALUES (?, ?, ?)",
+                (url, file_id, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM telegram_files WHERE url IN ("
+                "SELECT url FROM telegram_files ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_file_ids,)
+            )
+    
+    def forget_file_id(self, url):
+        """Забываем file_id, который Telegram больше не принимает"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM telegram_files WHERE url = ?", (url,))
+    
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Кэш картинок на весь запуск (открывается при первом обращении)"""
+    global _image_cache
+    
+    with _image_cache_lock:
+        if _image_cache is None:
+            try:
+                _image_cache = ImageCache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"  ⚠️ Image cache unavailable: {e}")
+                return None
+        return _image_cache
+
+
+def download_image(response, max_bytes):
+    """Читаем ответ потоком, не больше max_bytes (иначе None)"""
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        return None
+    
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def crop_watermark(content, crop_pixels=70):
+    """Обрезаем низ картинки и кодируем в JPEG
+    
+    Большие JPEG декодируются сразу в уменьшенном масштабе (не больше
+    IMAGE_MAX_SIDE, Telegram больше не показывает), поэтому память на
+    оригинал ограничена. Качество IMAGE_JPEG_QUALITY понижается, только
+    если фото не влезает в лимит Telegram.
+    
+    Returns: bytes или None, если картинка слишком маленькая
+    """
+    from PIL import Image
+    
+    img = Image.open(io.BytesIO(content))
+    width, height = img.size
+    if height <= crop_pixels:
+        return None
+    
+    img.draft('RGB', (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    scaled_crop = round(crop_pixels * img.size[1] / height)
+    img = img.crop((0, 0, img.size[0], img.size[1] - scaled_crop))
+    img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    
+    quality = IMAGE_JPEG_QUALITY
+    while True:
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        if output.tell() <= TELEGRAM_PHOTO_MAX_BYTES or quality <= 50:
+            return output.getvalue()
+        quality -= 10
 
 
 def process_image_for_telegram(image_url, source):
-    """Обрабатываем картинку: обрезаем watermark для CoinDesk"""
+    """Обрабатываем картинку: обрезаем watermark для CoinDesk
+    
+    Обрезанные картинки берутся из ImageCache без скачивания и
+    декодирования, устаревшие записи сверяются по ETag.
+    """
     
     if source.lower() != 'coindesk':
         return image_url
     
     try:
-        from PIL import Image
-        
-        response = requests.get(image_url, timeout=10)
-        if response.status_code != 200:
-            print(f"  ⚠️ Failed to download image for cropping")
-            return image_url
+        crop_pixels = 70
+        cache = get_image_cache()
+        entry = cache.lookup(image_url) if cache is not None else None
+        if entry and entry['fresh']:
+            print(f"  ✓ Cropped CoinDesk image from cache")
+            return io.BytesIO(cache.read(image_url, entry))
         
-        img = Image.open(io.BytesIO(response.content))
-        width, height = img.size
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
         
-        crop_pixels = 70
-        if height > crop_pixels:
-            img_cropped = img.crop((0, 0, width, height - crop_pixels))
+        with get_http_session().get(image_url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and entry:
+                print(f"  ✓ Cropped CoinDesk image from cache (not modified)")
+                return io.BytesIO(cache.read(image_url, entry, revalidated=True))
             
-            output = io.BytesIO()
-            img_cropped.save(output, format='JPEG', quality=95)
-            output.seek(0)
+            if response.status_code != 200:
+                print(f"  ⚠️ Failed to download image for cropping")
+                return image_url
             
-            print(f"  ✓ Cropped CoinDesk watermark (removed {crop_pixels}px)")
-            return output
-        else:
+            content = download_image(response, IMAGE_MAX_BYTES)
+            etag = response.headers.get('ETag')
+        
+        if content is None:
+            print(f"  ⚠️ Image larger than {IMAGE_MAX_BYTES // (1024 * 1024)}MB - skipping crop")
+            return image_url
+        
+        cropped = crop_watermark(content, crop_pixels)
+        if cropped is None:
             print(f"  ⚠️ Image too small to crop")
             return image_url
+        
+        if cache is not None:
+            cache.put(image_url, cropped, etag=etag)
+        
+        print(f"  ✓ Cropped CoinDesk watermark (removed {crop_pixels}px)")
+        return io.BytesIO(cropped)
             
     except ImportError:
         print(f"  ⚠️ Pillow not installed - skipping watermark removal")
@@ -299,32 +2070,7 @@ def process_image_for_telegram(image_url, source):
         return image_url
 
 
-def get_alpha_take(news_item):
-    """Получаем Alpha Take от OpenAI для новости"""
-    
-    if not OPENAI_AVAILABLE:
-        return None
-    
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        print("  ⚠️ OPENAI_API_KEY not found - skipping Alpha Take")
-        return None
-    
-    try:
-        client = OpenAI(api_key=api_key)
-        
-        score = news_item.get('score', 0)
-        if score >= 80:
-            impact = "HIGH"
-        elif score >= 60:
-            impact = "MEDIUM"
-        else:
-            impact = "LOW"
-        
-        categories = ', '.join(news_item.get('categories', []))
-        summary = news_item.get('summary', '')
-        
-        system_prompt = """You are a crypto market analyst writing for regular investors.
+ALPHA_TAKE_SYSTEM_PROMPT = """You are a crypto market analyst writing for regular investors.
 
 TASK: Analyze the news and provide VALUE-ADDED insight, NOT a summary of the headline.
 
@@ -354,71 +2100,432 @@ Headline: "SEC delays ETF decision"
 BAD: "The SEC delaying the ETF decision creates uncertainty" (restates)
 GOOD: "Historically, delays lead to 5-10% dips as traders exit; buying opportunity often follows within 2 weeks."
 
-Headline: "Bitcoin hits $70,000"
-BAD: "Bitcoin reaching $70,000 shows strong momentum" (restates)
-GOOD: "Last time BTC broke a major round number, it continued 15-20% higher before consolidating."
-"""
+Headline: "Bitcoin hits $70,000"
+BAD: "Bitcoin reaching $70,000 shows strong momentum" (restates)
+GOOD: "Last time BTC broke a major round number, it continued 15-20% higher before consolidating."
+"""
+
+ALPHA_TAKE_MODEL = "gpt-4o-mini"
+
+# Меняется вместе с промптом или моделью - старые ответы в кэше перестают совпадать
+ALPHA_TAKE_PROMPT_VERSION = hashlib.sha256(
+    (ALPHA_TAKE_MODEL + ALPHA_TAKE_SYSTEM_PROMPT).encode('utf-8')
+).hexdigest()[:12]
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def _count_openai_response(response):
+    """Hook httpx: запрос и соединение (network_stream) для отчета о переиспользовании"""
+    stream = response.extensions.get('network_stream')
+    with _openai_client_lock:
+        host = OPENAI_HTTP_STATS.setdefault(response.request.url.host, {'requests': 0, 'connections': set()})
+        host['requests'] += 1
+        if stream is not None:
+            host['connections'].add(id(stream))
+
+
+def get_openai_client():
+    """Общий OpenAI клиент на весь запуск (создается при первом обращении)"""
+    global _openai_client
+    
+    with _openai_client_lock:
+        if _openai_client is not None:
+            return _openai_client
+        
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not OPENAI_AVAILABLE or not api_key:
+            return None
+        
+        from openai import OpenAI, DefaultHttpxClient
+        
+        # Свой httpx клиент - чтобы считать запросы и keep-alive соединения.
+        # Без повторов: с ними запрос длится до (1 + retries) x ALPHA_TAKE_TIMEOUT,
+        # переживает ALPHA_TAKE_DEADLINE и задерживает выход из процесса -
+        # новость без Alpha Take все равно публикуется
+        _openai_client = OpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=DefaultHttpxClient(event_hooks={'response': [_count_openai_response]})
+        )
+        return _openai_client
+
+
+def _alpha_take_user_prompt(news_item):
+    """Промпт с новостью для Alpha Take"""
+    score = news_item.get('score', 0)
+    if score >= 80:
+        impact = "HIGH"
+    elif score >= 60:
+        impact = "MEDIUM"
+    else:
+        impact = "LOW"
+    
+    categories = ', '.join(news_item.get('categories', []))
+    summary = news_item.get('summary', '')
+    
+    return f"""News Title: {news_item['title']}
+
+Summary: {summary if summary else 'No summary available'}
+
+Score: {score} | Impact: {impact}
+Categories: {categories}
+Source: {news_item['source'].upper()}
+
+Generate Alpha Take, Context, and Hashtags."""
+
+
+def _parse_alpha_take(content):
+    """Разбираем ответ модели на ALPHA_TAKE / CONTEXT / HASHTAGS"""
+    alpha_take = None
+    context = None
+    hashtags = None
+    
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('ALPHA_TAKE:'):
+            alpha_take = line.replace('ALPHA_TAKE:', '').strip()
+        elif line.startswith('CONTEXT:'):
+            context = line.replace('CONTEXT:', '').strip()
+        elif line.startswith('HASHTAGS:'):
+            hashtags = line.replace('HASHTAGS:', '').strip()
+    
+    if not alpha_take:
+        alpha_take = content
+    
+    if alpha_take and len(alpha_take) > 10:
+        return {
+            "alpha_take": alpha_take,
+            "context": context,
+            "hashtags": hashtags
+        }
+    
+    return None
+
+
+class AlphaTakeCache:
+    """Кэш ответов OpenAI в SQLite
+    
+    Ключ - хэш нормализованного заголовка, summary и версии промпта,
+    поэтому перезапуски и та же история с чуть другим заголовком
+    не оплачиваются повторно. Записи старше ttl_days не отдаются,
+    сверх max_entries вытесняются давно не использованные.
+    """
+    
+    def __init__(self, path=ALPHA_TAKE_CACHE_FILE, ttl_days=ALPHA_TAKE_CACHE_TTL_DAYS,
+                 max_entries=ALPHA_TAKE_CACHE_MAX_ENTRIES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS alpha_takes ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS alpha_takes_accessed ON alpha_takes (accessed_at)")
+    
+    @staticmethod
+    def make_key(news_item):
+        """Хэш нормализованного заголовка + summary + версии промпта"""
+        title = ' '.join(sorted(tokenize_title(news_item.get('title', ''))))
+        summary = ' '.join(news_item.get('summary', '').split())
+        raw = f"{ALPHA_TAKE_PROMPT_VERSION}\n{title}\n{summary}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, news_item):
+        """Alpha Take из кэша или None"""
+        key = self.make_key(news_item)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response FROM alpha_takes WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE alpha_takes SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+    
+    def put(self, news_item, alpha_take_data):
+        """Сохраняем ответ и вытесняем устаревшие записи"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO alpha_takes (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (self.make_key(news_item), json.dumps(alpha_take_data, ensure_ascii=False), now, now)
+            )
+            self._conn.execute("DELETE FROM alpha_takes WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM alpha_takes WHERE key IN ("
+                "SELECT key FROM alpha_takes ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+    
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM alpha_takes").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
 
-        user_prompt = f"""News Title: {news_item['title']}
+_alpha_take_cache = None
+_alpha_take_cache_lock = threading.Lock()
 
-Summary: {summary if summary else 'No summary available'}
 
-Score: {score} | Impact: {impact}
-Categories: {categories}
-Source: {news_item['source'].upper()}
+def get_alpha_take_cache():
+    """Кэш Alpha Take на весь запуск (открывается при первом обращении)"""
+    global _alpha_take_cache
+    
+    with _alpha_take_cache_lock:
+        if _alpha_take_cache is None:
+            try:
+                _alpha_take_cache = AlphaTakeCache()
+            except sqlite3.Error as e:
+                print(f"  ⚠️ Alpha Take cache unavailable: {e}")
+                return None
+        return _alpha_take_cache
 
-Generate Alpha Take, Context, and Hashtags."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=200,
-            temperature=0.3,
-            timeout=10.0
-        )
+def get_alpha_take(news_item, use_cache=True):
+    """Получаем Alpha Take от OpenAI для новости
+    
+    use_cache=False - без чтения и записи кэша (кэшем управляет вызывающий).
+    """
+    
+    if not OPENAI_AVAILABLE:
+        return None
+    
+    cache = get_alpha_take_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(news_item)
+        if cached:
+            print(f"  ✓ Alpha Take from cache: {cached['alpha_take'][:50]}...")
+            return cached
+    
+    client = get_openai_client()
+    if client is None:
+        print("  ⚠️ OPENAI_API_KEY not found - skipping Alpha Take")
+        return None
+    
+    try:
+        with METRICS.timer('openai_seconds', mode='single'):
+            response = client.chat.completions.create(
+                model=ALPHA_TAKE_MODEL,
+                messages=[
+                    {"role": "system", "content": ALPHA_TAKE_SYSTEM_PROMPT},
+                    {"role": "user", "content": _alpha_take_user_prompt(news_item)}
+                ],
+                max_tokens=200,
+                temperature=0.3,
+                timeout=ALPHA_TAKE_TIMEOUT
+            )
+        if response.usage:
+            METRICS.inc('openai_tokens', response.usage.total_tokens, mode='single')
         
         content = response.choices[0].message.content.strip()
+        alpha_take_data = _parse_alpha_take(content)
         
-        alpha_take = None
-        context = None
-        hashtags = None
-        
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('ALPHA_TAKE:'):
-                alpha_take = line.replace('ALPHA_TAKE:', '').strip()
-            elif line.startswith('CONTEXT:'):
-                context = line.replace('CONTEXT:', '').strip()
-            elif line.startswith('HASHTAGS:'):
-                hashtags = line.replace('HASHTAGS:', '').strip()
-        
-        if not alpha_take:
-            alpha_take = content
-        
-        if alpha_take and len(alpha_take) > 10:
-            print(f"  ✓ Generated Alpha Take: {alpha_take[:50]}...")
-            if context:
-                print(f"  ✓ Context: {context}")
-            if hashtags:
-                print(f"  ✓ Hashtags: {hashtags}")
-            
-            return {
-                "alpha_take": alpha_take,
-                "context": context,
-                "hashtags": hashtags
-            }
+        if alpha_take_data:
+            print(f"  ✓ Generated Alpha Take: {alpha_take_data['alpha_take'][:50]}...")
+            if alpha_take_data['context']:
+                print(f"  ✓ Context: {alpha_take_data['context']}")
+            if alpha_take_data['hashtags']:
+                print(f"  ✓ Hashtags: {alpha_take_data['hashtags']}")
+            if cache is not None:
+                cache.put(news_item, alpha_take_data)
+            return alpha_take_data
         else:
             print(f"  ⚠️ Empty Alpha Take received")
             return None
             
     except Exception as e:
         print(f"  ⚠️ OpenAI error: {e}")
+        METRICS.inc('openai_errors', mode='single')
         return None
 
 
+ALPHA_TAKE_BATCH_INSTRUCTIONS = """
+BATCH MODE: You will receive several news items, each starting with a line "### ITEM <n>".
+Analyze every item independently, in the same order. For each item output exactly this block:
+### ITEM <n>
+ALPHA_TAKE: ...
+CONTEXT: ...
+HASHTAGS: ...
+Do not write anything outside the blocks.
+"""
+
+BATCH_ITEM_REGEX = re.compile(r'^\s*#+\s*ITEM\s+(\d+)\s*$', re.MULTILINE)
+
+# Токены и время последнего пакетного запроса
+ALPHA_TAKE_BATCH_STATS = {}
+
+
+def _parse_alpha_take_batch(content, count):
+    """Разбираем пакетный ответ на блоки ### ITEM n (None - блок не разобран)"""
+    results = [None] * count
+    parts = BATCH_ITEM_REGEX.split(content)
+    
+    for number, block in zip(parts[1::2], parts[2::2]):
+        index = int(number) - 1
+        if 0 <= index < count and results[index] is None and 'ALPHA_TAKE:' in block:
+            results[index] = _parse_alpha_take(block.strip())
+    
+    return results
+
+
+def _request_alpha_takes_batch(items):
+    """Один запрос к OpenAI на все новости: общий системный промпт оплачивается один раз"""
+    client = get_openai_client()
+    if client is None:
+        return [None] * len(items)
+    
+    user_prompt = '\n\n'.join(
+        f"### ITEM {number}\n{_alpha_take_user_prompt(item)}" for number, item in enumerate(items, 1)
+    )
+    
+    try:
+        started = time.monotonic()
+        response = client.chat.completions.create(
+            model=ALPHA_TAKE_MODEL,
+            messages=[
+                {"role": "system", "content": ALPHA_TAKE_SYSTEM_PROMPT + ALPHA_TAKE_BATCH_INSTRUCTIONS},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=200 * len(items),
+            temperature=0.3,
+            timeout=ALPHA_TAKE_TIMEOUT * 2
+        )
+        latency = time.monotonic() - started
+    except Exception as e:
+        print(f"  ⚠️ OpenAI batch error: {e}")
+        METRICS.inc('openai_errors', mode='batch')
+        return [None] * len(items)
+    
+    total_tokens = response.usage.total_tokens if response.usage else 0
+    METRICS.observe('openai_seconds', latency, mode='batch')
+    METRICS.inc('openai_tokens', total_tokens, mode='batch')
+    ALPHA_TAKE_BATCH_STATS.clear()
+    ALPHA_TAKE_BATCH_STATS.update({
+        'items': len(items),
+        'tokens': total_tokens,
+        'tokens_per_item': round(total_tokens / len(items), 1),
+        'latency': round(latency, 3),
+        'latency_per_item': round(latency / len(items), 3)
+    })
+    print(f"  ✓ Batched Alpha Take: {len(items)} items, {total_tokens} tokens "
+          f"({ALPHA_TAKE_BATCH_STATS['tokens_per_item']}/item), {latency:.2f}s "
+          f"({ALPHA_TAKE_BATCH_STATS['latency_per_item']:.2f}s/item)")
+    
+    return _parse_alpha_take_batch(response.choices[0].message.content.strip(), len(items))
+
+
+def get_alpha_takes_batch(items, check_cache=True):
+    """Alpha Take для всех новостей одним запросом
+    
+    Сначала кэш, промахи - одним пакетным запросом, блоки, которые
+    не удалось разобрать, - отдельными запросами параллельно.
+    check_cache=False - кэш уже проверен вызывающим, ответы только записываются.
+    Возвращает список, параллельный items (None - Alpha Take нет).
+    """
+    cache = get_alpha_take_cache()
+    if check_cache and cache is not None:
+        results = [cache.get(item) for item in items]
+    else:
+        results = [None] * len(items)
+    misses = [index for index, data in enumerate(results) if data is None]
+    
+    if len(misses) > 1:
+        parsed = _request_alpha_takes_batch([items[index] for index in misses])
+        for index, data in zip(misses, parsed):
+            results[index] = data
+            if data and cache is not None:
+                cache.put(items[index], data)
+    
+    failed = [index for index, data in enumerate(results) if data is None]
+    if failed:
+        if len(misses) > 1:
+            print(f"  ⚠️ {len(failed)} batch blocks not parsed - falling back to per-item requests")
+        with ThreadPoolExecutor(max_workers=max(1, min(ALPHA_TAKE_MAX_WORKERS, len(failed)))) as executor:
+            fallback = executor.map(lambda index: get_alpha_take(items[index], use_cache=False), failed)
+            for index, data in zip(failed, fallback):
+                results[index] = data
+                if data and cache is not None:
+                    cache.put(items[index], data)
+    
+    return results
+
+
+def generate_alpha_takes(items):
+    """Генерируем Alpha Take параллельно и отдаем новости по порядку по мере готовности
+    
+    Не больше ALPHA_TAKE_MAX_WORKERS запросов одновременно, на всю пачку -
+    ALPHA_TAKE_DEADLINE секунд. Если время вышло, новость отдается без
+    Alpha Take, чтобы ее можно было опубликовать сразу.
+    
+    По умолчанию каждая новость - отдельный запрос и уходит в публикацию,
+    как только готов ее ответ. ALPHA_TAKE_BATCH_ENABLED (опция) отправляет
+    промахи кэша одним запросом (get_alpha_takes_batch): системный промпт
+    оплачивается один раз, но новости ждут общий ответ. Новости, у которых
+    Alpha Take уже есть (повтор из outbox), отдаются как есть.
+    """
+    if not items:
+        return
+    missing = [item for item in items if not item.get('alpha_take_data')]
+    if missing and not OPENAI_AVAILABLE:
+        print("⚠️ OpenAI not available - Alpha Take will be skipped")
+    
+    deadline = time.monotonic() + ALPHA_TAKE_DEADLINE
+    executor = ThreadPoolExecutor(max_workers=max(1, min(ALPHA_TAKE_MAX_WORKERS, len(missing))))
+    
+    if ALPHA_TAKE_BATCH_ENABLED and len(missing) > 1:
+        # Сначала кэш: клиент OpenAI и пакетный запрос - только для промахов
+        cache = get_alpha_take_cache()
+        waiters = {}
+        for item in missing:
+            cached = cache.get(item) if cache is not None else None
+            if cached:
+                waiters[id(item)] = lambda timeout, cached=cached: cached
+        misses = [item for item in missing if id(item) not in waiters]
+        if misses:
+            batch_future = executor.submit(get_alpha_takes_batch, misses, check_cache=False)
+            for index, item in enumerate(misses):
+                waiters[id(item)] = lambda timeout, index=index: batch_future.result(timeout)[index]
+    else:
+        waiters = {id(item): executor.submit(get_alpha_take, item).result for item in missing}
+    
+    try:
+        for item in items:
+            if id(item) not in waiters:
+                yield item
+                continue
+            try:
+                alpha_take_data = waiters[id(item)](timeout=max(0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                print(f"  ⚠️ Alpha Take deadline exceeded - publishing without it: {item['title'][:50]}...")
+                alpha_take_data = None
+            
+            if alpha_take_data:
+                item['alpha_take_data'] = alpha_take_data
+            yield item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    cache = _alpha_take_cache
+    if cache is not None and cache.hits + cache.misses:
+        print(f"🧠 Alpha Take cache: {cache.hits} hits, {cache.misses} misses ({len(cache)} entries)")
+
+
 def format_telegram_message(news_item):
     """Форматируем сообщение для Telegram"""
     
@@ -523,18 +2630,89 @@ def format_twitter_message(news_item):
     return tweet
 
 
-def publish_to_telegram(news_item):
-    """Публикуем в Telegram"""
+def telegram_file_id(news_item):
+    """file_id картинки новости, если она уже загружалась в Telegram"""
+    image = news_item.get('image_url')
+    if not image or not isinstance(image, str) or not image.strip():
+        return None
+    cache = get_image_cache()
+    return cache.get_file_id(image) if cache is not None else None
+
+
+def prepare_telegram_image(news_item):
+    """Картинка для Telegram: URL, обрезанный файл (BytesIO) или None"""
+    image = news_item.get('image_url')
+    if image and isinstance(image, str) and image.strip():
+        # Уже загружена в Telegram - уйдет по file_id, обрабатывать не нужно
+        if telegram_file_id(news_item):
+            return image
+        with METRICS.timer('image_seconds', source=news_item['source']):
+            return process_image_for_telegram(image, news_item['source'])
+    return None
+
+
+def remember_telegram_file_id(news_item, response):
+    """Сохраняем file_id самого большого размера из ответа sendPhoto"""
+    cache = get_image_cache()
+    if cache is None:
+        return
+    try:
+        photo = response.json()['result']['photo']
+        cache.put_file_id(news_item['image_url'], photo[-1]['file_id'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        pass
+
+
+class PublishRateLimited(Exception):
+    """Канал отказал по лимиту (HTTP 429), пост можно повторить через retry_after секунд"""
+    
+    def __init__(self, channel, retry_after):
+        super().__init__(f"{channel} rate limited, retry after {retry_after:.0f}s")
+        self.channel = channel
+        self.retry_after = retry_after
+
+
+def telegram_retry_after(response):
+    """retry_after из ответа Bot API (parameters.retry_after или заголовок Retry-After)"""
+    try:
+        return float(response.json()['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError, TypeError):
+        return PUBLISH_DEFAULT_RETRY_AFTER
+
+
+def twitter_retry_after(headers, now=None):
+    """Сколько ждать по заголовкам лимитов Twitter
+    
+    Исчерпан суточный лимит пользователя - ждем x-user-limit-24hour-reset,
+    иначе окно эндпоинта x-rate-limit-reset (оба - unix time).
+    """
+    now = time.time() if now is None else now
+    if headers.get('x-user-limit-24hour-remaining') == '0':
+        reset = headers.get('x-user-limit-24hour-reset')
+    else:
+        reset = headers.get('x-rate-limit-reset')
+    try:
+        return max(1.0, float(reset) - now)
+    except (TypeError, ValueError):
+        return PUBLISH_DEFAULT_RETRY_AFTER
+
+
+def publish_to_telegram(news_item, processed_image=None):
+    """Публикуем в Telegram
+    
+    processed_image - результат prepare_telegram_image, если картинка
+    подготовлена заранее (иначе готовим здесь).
+    На 429 поднимает PublishRateLimited - пост не теряется, а ждет.
+    """
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
         return False
     
     try:
         message = format_telegram_message(news_item)
-        image = news_item.get('image_url')
-        
-        processed_image = None
-        if image and isinstance(image, str) and image.strip():
-            processed_image = process_image_for_telegram(image, news_item['source'])
         
         # Inline keyboard с кнопкой Subscribe
         reply_markup = {
@@ -546,58 +2724,91 @@ def publish_to_telegram(news_item):
             ]]
         }
         
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
+        url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
         
-        is_file = isinstance(processed_image, io.BytesIO)
+        # Картинка уже есть в Telegram - отправляем только file_id
+        response = None
+        file_id = telegram_file_id(news_item)
+        if file_id:
+            payload = {
+                'chat_id': TELEGRAM_CHANNEL_ID,
+                'photo': file_id,
+                'caption': message,
+                'parse_mode': 'HTML',
+                'reply_markup': reply_markup
+            }
+            response = get_http_session().post(url, json=payload)
+            if response.status_code == 429:
+                raise PublishRateLimited('telegram', telegram_retry_after(response))
+            if response.status_code != 200:
+                print(f"  ⚠️ Telegram file_id rejected ({response.status_code}) - uploading image again")
+                get_image_cache().forget_file_id(news_item['image_url'])
+                response = None
+                processed_image = None
         
-        if processed_image:
-            if is_file:
-                files = {'photo': ('image.jpg', processed_image, 'image/jpeg')}
-                data = {
-                    'chat_id': TELEGRAM_CHANNEL_ID,
-                    'caption': message,
-                    'parse_mode': 'HTML',
-                    'reply_markup': json.dumps(reply_markup)
-                }
-                response = requests.post(url, data=data, files=files)
+        uploaded = response is None
+        if uploaded:
+            if processed_image is None:
+                processed_image = prepare_telegram_image(news_item)
+            
+            is_file = isinstance(processed_image, io.BytesIO)
+            
+            if processed_image:
+                if is_file:
+                    files = {'photo': ('image.jpg', processed_image, 'image/jpeg')}
+                    data = {
+                        'chat_id': TELEGRAM_CHANNEL_ID,
+                        'caption': message,
+                        'parse_mode': 'HTML',
+                        'reply_markup': json.dumps(reply_markup)
+                    }
+                    response = get_http_session().post(url, data=data, files=files)
+                else:
+                    payload = {
+                        'chat_id': TELEGRAM_CHANNEL_ID,
+                        'photo': processed_image,
+                        'caption': message,
+                        'parse_mode': 'HTML',
+                        'reply_markup': reply_markup
+                    }
+                    response = get_http_session().post(url, json=payload)
             else:
+                url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
                 payload = {
                     'chat_id': TELEGRAM_CHANNEL_ID,
-                    'photo': processed_image,
-                    'caption': message,
+                    'text': message,
                     'parse_mode': 'HTML',
+                    'disable_web_page_preview': False,
                     'reply_markup': reply_markup
                 }
-                response = requests.post(url, json=payload)
-        else:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-            payload = {
-                'chat_id': TELEGRAM_CHANNEL_ID,
-                'text': message,
-                'parse_mode': 'HTML',
-                'disable_web_page_preview': False,
-                'reply_markup': reply_markup
-            }
-            response = requests.post(url, json=payload)
+                response = get_http_session().post(url, json=payload)
         
         if response.status_code == 200:
+            if uploaded and processed_image:
+                remember_telegram_file_id(news_item, response)
             print(f"✓ Published: {news_item['title'][:60]}...")
             return True
+        elif response.status_code == 429:
+            raise PublishRateLimited('telegram', telegram_retry_after(response))
         else:
             print(f"✗ Telegram error: {response.status_code}")
             return False
             
+    except PublishRateLimited:
+        raise
     except Exception as e:
         print(f"✗ Telegram error: {e}")
         return False
 
 
-def publish_to_twitter(news_item):
-    """Публикуем в Twitter"""
-    if not all([TWITTER_API_KEY, TWITTER_API_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET]):
-        return False
+_twitter_client = None
+
+
+def get_twitter_client():
+    """Общий tweepy клиент на весь запуск поверх общей HTTP сессии"""
+    global _twitter_client
     
-    try:
+    if _twitter_client is None:
         import tweepy
         
         client = tweepy.Client(
@@ -606,6 +2817,20 @@ def publish_to_twitter(news_item):
             access_token=TWITTER_ACCESS_TOKEN,
             access_token_secret=TWITTER_ACCESS_TOKEN_SECRET
         )
+        # tweepy передает заголовки и auth в каждый запрос, сессию можно подменить
+        client.session = get_http_session()
+        _twitter_client = client
+    
+    return _twitter_client
+
+
+def publish_to_twitter(news_item):
+    """Публикуем в Twitter (на 429 поднимает PublishRateLimited)"""
+    if not all([TWITTER_API_KEY, TWITTER_API_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET]):
+        return False
+    
+    try:
+        client = get_twitter_client()
         
         tweet = format_twitter_message(news_item)
         
@@ -622,92 +2847,694 @@ def publish_to_twitter(news_item):
         print("⚠️ Tweepy not installed - skipping Twitter")
         return False
     except Exception as e:
+        # tweepy.TooManyRequests: исходный ответ с заголовками лимитов в e.response
+        response = getattr(e, 'response', None)
+        if getattr(response, 'status_code', None) == 429:
+            raise PublishRateLimited('twitter', twitter_retry_after(response.headers)) from e
         print(f"✗ Twitter error: {e}")
         return False
 
 
-def main():
+class TokenBucket:
+    """Темп отправки одного канала
+    
+    Подряд уходит до burst постов, дальше - rate постов в секунду.
+    block(seconds) - канал сам попросил подождать (429): до этого
+    момента токены не выдаются, после него бакет начинает с одного.
+    Время - time.monotonic().
+    """
+    
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+    
+    def wait_time(self, now=None):
+        """Сколько ждать до следующего токена, сек"""
+        now = time.monotonic() if now is None else now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return max(0.0, 1 - self.tokens) / self.rate
+    
+    def acquire(self):
+        """Ждем токен и забираем его"""
+        pause = self.wait_time()
+        if pause > 0:
+            time.sleep(pause)
+        self._refill(time.monotonic())
+        self.tokens = max(0.0, self.tokens - 1)
+    
+    def block(self, seconds):
+        """Не выдаем токены seconds секунд"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 1.0
+        self.updated = self.blocked_until
+
+
+class ChannelPublisher:
+    """Очередь публикаций одного канала
+    
+    Один поток на канал: посты уходят в порядке submit с темпом
+    TokenBucket канала (PUBLISH_RATE_LIMITS). Каналы друг друга не ждут.
+    На PublishRateLimited ждем retry_after и повторяем пост; если ждать
+    дольше PUBLISH_MAX_WAIT, этот и следующие посты канала откладываются
+    (результат None), а retry_at - когда канал снова можно пробовать.
+    """
+    
+    def __init__(self, name, publish, rate=1.0, burst=1, retry_at=None):
+        self.name = name
+        self.publish = publish
+        self.bucket = TokenBucket(rate, burst)
+        self.retry_at = None
+        if retry_at is not None:
+            wait = (retry_at - datetime.now()).total_seconds()
+            if wait > PUBLISH_MAX_WAIT:
+                self.retry_at = retry_at
+            elif wait > 0:
+                self.bucket.block(wait)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'publish-{name}')
+    
+    def submit(self, news_item, *args):
+        """Ставим новость в очередь, возвращаем Future с результатом publish
+        
+        Аргументы-Future (например, картинка из prepare_telegram_image)
+        разрешаются в потоке канала перед отправкой.
+        """
+        return self._executor.submit(self._send, news_item, *args)
+    
+    def _send(self, news_item, *args):
+        # Заранее подготовленные аргументы (Future) дожидаемся до паузы
+        args = [arg.result() if isinstance(arg, Future) else arg for arg in args]
+        while self.retry_at is None:
+            self.bucket.acquire()
+            # Файл картинки после неудачной попытки прочитан до конца
+            for arg in args:
+                if isinstance(arg, io.BytesIO):
+                    arg.seek(0)
+            try:
+                with METRICS.timer('publish_seconds', channel=self.name):
+                    ok = self.publish(news_item, *args)
+            except PublishRateLimited as e:
+                METRICS.inc('published', channel=self.name, result='rate_limited')
+                if e.retry_after > PUBLISH_MAX_WAIT:
+                    self.retry_at = datetime.now() + timedelta(seconds=e.retry_after)
+                    print(f"  ⏳ {self.name}: rate limited for {e.retry_after:.0f}s - keeping posts in outbox")
+                    break
+                print(f"  ⏳ {self.name}: rate limited - retrying in {e.retry_after:.0f}s")
+                self.bucket.block(e.retry_after)
+                continue
+            METRICS.inc('published', channel=self.name, result='ok' if ok else 'failed')
+            return ok
+        METRICS.inc('published', channel=self.name, result='deferred')
+        return None
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def default_channels():
+    """Каналы, в которые публикуем"""
+    return ('telegram', 'twitter') if TWITTER_ENABLED else ('telegram',)
+
+
+def publish_news(items, channels=None, retry_at=None):
+    """Публикуем новости во все каналы
+    
+    Картинки готовятся в отдельном потоке заранее (пока уходит новость N,
+    готовится N+1), каждая новость с готовым Alpha Take сразу ставится в
+    очереди Telegram и Twitter, которые работают параллельно.
+    
+    channels - {id(item): каналы} для новостей, которые уже ушли не во все
+    каналы (по умолчанию default_channels()), retry_at - {канал: datetime},
+    до которого канал просил не писать. Если после прохода канал все еще
+    под лимитом, время попадает в PUBLISH_RETRY_AT.
+    
+    Returns: [(news_item, telegram_ok, twitter_ok)] в порядке items,
+    None - в канал не отправляли (не нужно или отложено по лимиту)
+    """
+    started = time.monotonic()
+    channels = channels or {}
+    retry_at = retry_at or {}
+    targets = {id(item): channels.get(id(item), default_channels()) for item in items}
+    
+    image_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='publish-images')
+    images = {
+        id(item): image_executor.submit(prepare_telegram_image, item)
+        for item in items if 'telegram' in targets[id(item)]
+    }
+    
+    publishers = {
+        name: ChannelPublisher(name, publish, retry_at=retry_at.get(name), **PUBLISH_RATE_LIMITS.get(name, {}))
+        for name, publish in (('telegram', publish_to_telegram), ('twitter', publish_to_twitter))
+    }
+    
+    pending = []
+    try:
+        for item in generate_alpha_takes(items):
+            telegram_future = publishers['telegram'].submit(item, images[id(item)]) if 'telegram' in targets[id(item)] else None
+            twitter_future = publishers['twitter'].submit(item) if 'twitter' in targets[id(item)] else None
+            pending.append((item, telegram_future, twitter_future))
+    finally:
+        for publisher in publishers.values():
+            publisher.shutdown()
+        image_executor.shutdown(wait=False, cancel_futures=True)
+    
+    PUBLISH_RETRY_AT.clear()
+    PUBLISH_RETRY_AT.update({name: publisher.retry_at for name, publisher in publishers.items() if publisher.retry_at})
+    
+    results = [
+        (
+            item,
+            telegram_future.result() if telegram_future else None,
+            twitter_future.result() if twitter_future else None
+        )
+        for item, telegram_future, twitter_future in pending
+    ]
+    if results:
+        print(f"⏱ Publishing took {time.monotonic() - started:.2f}s")
+    
+    cache = _image_cache
+    if cache is not None and cache.hits + cache.misses:
+        print(f"🖼 Image cache: {cache.hits} hits, {cache.misses} misses ({len(cache)} entries)")
+        METRICS.inc('image_cache_hits', cache.hits)
+        METRICS.inc('image_cache_misses', cache.misses)
+    return results
+
+
+def configured_channels():
+    """Каналы из default_channels(), для которых заданы ключи"""
+    credentials = {
+        'telegram': [TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID],
+        'twitter': [TWITTER_API_KEY, TWITTER_API_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET]
+    }
+    return tuple(channel for channel in default_channels() if all(credentials[channel]))
+
+
+class PublishOutbox:
+    """Посты между отбором и отправкой (publish_outbox.json)
+    
+    Новость попадает сюда сразу после отбора и остается, пока не уйдет во
+    все каналы: если запуск упал или канал ответил лимитом, следующий
+    запуск продолжит с того же места. Ошибки отправки повторяются до
+    OUTBOX_MAX_ATTEMPTS раз, лимиты (429) попыток не тратят - канал ждет
+    retry_at. Посты старше OUTBOX_MAX_AGE_HOURS выбрасываются.
+    """
+    
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self.entries = []
+        self.retry_at = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Outbox {path} is corrupted ({e}) - starting empty")
+            return
+        self.entries = state.get('entries', [])
+        self.retry_at = {channel: datetime.fromisoformat(at) for channel, at in state.get('retry_at', {}).items()}
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def add(self, items, channels):
+        """Ставим отобранные новости в очередь каналов channels"""
+        queued_at = datetime.now().isoformat()
+        for item in items:
+            self.entries.append({
+                'item': news_item_to_record(item),
+                'channels': {channel: 'pending' for channel in channels},
+                'attempts': {channel: 0 for channel in channels},
+                'queued_at': queued_at
+            })
+    
+    def pending(self, now=None):
+        """[(запись, NewsItem, каналы)] - что можно отправлять сейчас
+        
+        Каналы, которые просили ждать дольше PUBLISH_MAX_WAIT, пропускаем.
+        """
+        now = now or datetime.now()
+        blocked = {
+            channel for channel, at in self.retry_at.items()
+            if (at - now).total_seconds() > PUBLISH_MAX_WAIT
+        }
+        pending = []
+        for entry in self.entries:
+            channels = tuple(
+                channel for channel, status in entry['channels'].items()
+                if status == 'pending' and channel not in blocked
+            )
+            if channels:
+                pending.append((entry, news_item_from_record(entry['item']), channels))
+        return pending
+    
+    def record(self, entry, channel, ok):
+        """Результат отправки в канал: True, False (ошибка) или None (отложено по лимиту)"""
+        if ok:
+            entry['channels'][channel] = 'sent'
+        elif ok is False:
+            entry['attempts'][channel] += 1
+            if entry['attempts'][channel] >= OUTBOX_MAX_ATTEMPTS:
+                entry['channels'][channel] = 'failed'
+                METRICS.inc('outbox_dropped', channel=channel, reason='attempts')
+                print(f"✗ {channel}: giving up after {OUTBOX_MAX_ATTEMPTS} attempts: {entry['item']['title'][:50]}...")
+    
+    def prune(self, now=None):
+        """Убираем посты, ушедшие во все каналы, и слишком старые"""
+        now = now or datetime.now()
+        cutoff = now - timedelta(hours=OUTBOX_MAX_AGE_HOURS)
+        kept = []
+        for entry in self.entries:
+            channels = [channel for channel, status in entry['channels'].items() if status == 'pending']
+            if not channels:
+                continue
+            if datetime.fromisoformat(entry['queued_at']) < cutoff:
+                for channel in channels:
+                    METRICS.inc('outbox_dropped', channel=channel, reason='expired')
+                print(f"🗑 Outbox: dropping post older than {OUTBOX_MAX_AGE_HOURS}h "
+                      f"({', '.join(channels)}): {entry['item']['title'][:50]}...")
+                continue
+            kept.append(entry)
+        self.entries = kept
+        self.retry_at = {channel: at for channel, at in self.retry_at.items() if at > now}
+    
+    def save(self):
+        state = {
+            'retry_at': {channel: at.isoformat() for channel, at in self.retry_at.items()},
+            'entries': self.entries
+        }
+        _write_atomic(self.path, json.dumps(state, ensure_ascii=False, indent=2) + '\n')
+
+
+def drain_outbox(outbox):
+    """Отправляем все, что ждет в outbox, и сохраняем результат
+    
+    Returns: [(news_item, telegram_ok, twitter_ok)]
+    """
+    outbox.prune()
+    pending = outbox.pending()
+    results = []
+    if pending:
+        channels = {id(item): item_channels for _, item, item_channels in pending}
+        results = publish_news([item for _, item, _ in pending], channels, outbox.retry_at)
+        for (entry, _, item_channels), (item, telegram_ok, twitter_ok) in zip(pending, results):
+            # Alpha Take сохраняем, чтобы повтор не генерировал его заново
+            if item.get('alpha_take_data'):
+                entry['item']['alpha_take_data'] = item['alpha_take_data']
+            for channel, ok in (('telegram', telegram_ok), ('twitter', twitter_ok)):
+                if channel in item_channels:
+                    outbox.record(entry, channel, ok)
+        outbox.retry_at.update(PUBLISH_RETRY_AT)
+    
+    outbox.prune()
+    outbox.save()
+    METRICS.inc('outbox_pending', len(outbox))
+    return results
+
+
+def run_cycle(cursors, published, published_index, outbox, sources=None, record_path=None, limit=MAX_NEWS_PER_RUN):
+    """Один проход: загрузка -> фильтр -> скоринг -> топ -> outbox -> публикация
+    
+    Отобранные новости ставятся в outbox и сразу дописываются в published
+    и published_index, курсоры двигаются и сохраняются. Затем отправляется
+    все, что ждет в outbox, включая посты прошлых запусков. sources - какие
+    источники опрашивать (по умолчанию все), limit - сколько новостей
+    можно отобрать.
+    
+    Returns: (top_news, [(news_item, telegram_ok, twitter_ok)]) - отобранные
+    в этот проход новости и результаты отправки
+    """
+    # Конвейер: каждый источник проходит фильтр и скоринг, как только загружен
+    PIPELINE_STATS.clear()
+    PIPELINE_STATS.update({'fetched': 0, 'new': 0, 'scored': 0})
+    stream = iter_fetched_news(cursors, sources, record_path)
+    stream = filter_published_stream(stream, published_index)
+    stream = score_stream(stream)
+    scored_news = collect_candidates(stream)
+    
+    print(f"New news items: {PIPELINE_STATS['new']}")
+    print(f"News above threshold: {len(scored_news)}")
+    
+    with METRICS.timer('select_seconds'):
+        top_news, unique_count = select_unique_top_news(scored_news, limit)
+    print(f"After deduplication: {unique_count}")
+    METRICS.inc('pipeline_items', unique_count, stage='unique')
+    
+    if top_news:
+        print(f"\n📢 Publishing top {len(top_news)} news items:")
+        for i, item in enumerate(top_news, 1):
+            print(f"{i}. [{item['score']}] {item['title']}")
+            if item.get('summary'):
+                print(f"   Summary: {item['summary'][:50]}...")
+        
+        # Сначала outbox, потом published: упавший между ними запуск
+        # отправит пост дважды, но не потеряет его
+        channels = configured_channels()
+        if channels:
+            outbox.add(top_news, channels)
+            outbox.save()
+        else:
+            print("⚠️ No publishing channels configured - nothing will be sent")
+        
+        for item in top_news:
+            record = {
+                'title': item['title'],
+                'link': item.get('link', ''),
+                'published_date': datetime.now().isoformat(),
+                'tokens': sorted(title_tokens(item))
+            }
+            published.append(record)
+            published_index.add(record)
+        
+        with METRICS.timer('save_published_seconds'):
+            save_published_news(published)
+    
+    # Кандидаты выше порога, не вошедшие в топ, остаются за курсором
+    selected_ids = {id(item) for item in top_news}
+    advance_feed_cursors(cursors, held_back=[item for item in scored_news if id(item) not in selected_ids])
+    save_feed_cursors(cursors)
+    
+    if not outbox.pending():
+        # Отправлять нечего, но протухшие посты все равно выбрасываем
+        outbox.prune()
+        outbox.save()
+        if not top_news:
+            print("💤 No important news found" if not scored_news else "⏸ Publishing limit reached")
+        if len(outbox):
+            print(f"📬 Outbox: {len(outbox)} posts waiting for rate limits to reset")
+        return top_news, []
+    if not top_news:
+        print(f"\n📬 Resuming {len(outbox)} unsent posts from outbox")
+    
+    print("\n🤖 Generating Alpha Takes with OpenAI...")
+    
+    # Публикуем каждую новость, как только готов ее Alpha Take
+    results = drain_outbox(outbox)
+    telegram_count = sum(1 for _, telegram_ok, _ in results if telegram_ok)
+    twitter_count = sum(1 for _, _, twitter_ok in results if twitter_ok)
+    
+    print(f"\n✅ Published: {telegram_count} to Telegram, {twitter_count} to Twitter")
+    if len(outbox):
+        print(f"📬 Outbox: {len(outbox)} posts waiting for the next run")
+    return top_news, results
+
+
+def main(record_path=None):
     print("=" * 60)
     print("🤖 Crypto News Bot - Starting...")
     print("=" * 60)
     
-    all_news = fetch_all_news()
-    published = load_published_news()
-    published = cleanup_old_news(published)
+    METRICS.reset()
+    cursors = load_feed_cursors()
+    with METRICS.timer('load_published_seconds'):
+        published = load_published_news(days=PUBLISHED_WINDOW_DAYS)
     
-    print(f"Already published (last 7 days): {len(published)}")
+    print(f"Already published (last {PUBLISHED_WINDOW_DAYS} days): {len(published)}")
     
-    new_news = []
-    for item in all_news:
-        if not is_duplicate(item, published):
-            new_news.append(item)
-        else:
-            print(f"  ⚠ Already published ({'similar title' if not item.get('link') else 'link'}): {item['title'][:60]}...")
+    published_index = DedupIndex(published)
+    outbox = PublishOutbox()
+    run_cycle(cursors, published, published_index, outbox, record_path=record_path)
     
-    print(f"New news items: {len(new_news)}")
+    close_published_store()
+    close_http_session()
+    emit_run_metrics()
+    print("=" * 60)
+
+
+class SourceScheduler:
+    """Расписание опроса источников в режиме --daemon
     
-    print("\n🎯 Calculating importance scores...")
-    scored_news = []
-    stock_sources = ['marketwatch', 'yahoo_finance', 'reuters']
+    Интервал каждого источника подстраивается под то, как часто в нем
+    появляются записи: после опроса с новыми записями - DAEMON_GAP_FRACTION
+    от среднего промежутка между ними (скользящее среднее по датам в ленте),
+    после опроса без новых - растет в DAEMON_IDLE_BACKOFF раз (не больше 2x),
+    после ошибки - удваивается до DAEMON_ERROR_MAX_INTERVAL.
+    Время - time.monotonic(), промежутки - по датам записей.
+    """
+    
+    def __init__(self, sources, now):
+        self.sources = {
+            name: {'interval': DAEMON_MIN_INTERVAL, 'next_poll': now, 'gap': None, 'last_entry': None, 'errors': 0}
+            for name in sources
+        }
+    
+    def due(self, now):
+        """Источники, которые пора опросить"""
+        return [name for name, state in self.sources.items() if state['next_poll'] <= now]
+    
+    def next_poll(self):
+        """Когда наступит ближайший опрос"""
+        return min(state['next_poll'] for state in self.sources.values())
     
-    for item in new_news:
-        score, categories = calculate_importance(item)
+    def _target(self, state):
+        if state['gap'] is None:
+            return DAEMON_MAX_INTERVAL
+        return min(DAEMON_MAX_INTERVAL, max(DAEMON_MIN_INTERVAL, state['gap'] * DAEMON_GAP_FRACTION))
+    
+    def record(self, source_name, now, entry_dates):
+        """Учитываем опрос и назначаем следующий
         
-        threshold = MIN_IMPORTANCE_SCORE
-        if item['source'] in stock_sources:
-            threshold = STOCK_MARKET_THRESHOLD
+        entry_dates - даты записей ленты (datetime), None - опрос не удался.
+        Returns: интервал до следующего опроса, сек
+        """
+        state = self.sources[source_name]
         
-        if score >= threshold:
-            item['score'] = score
-            item['categories'] = categories
-            scored_news.append(item)
+        if entry_dates is None:
+            state['errors'] += 1
+            interval = self._target(state) * 2 ** state['errors']
+            ceiling = DAEMON_ERROR_MAX_INTERVAL
+        else:
+            state['errors'] = 0
+            last_entry = state['last_entry']
+            new_dates = sorted(date for date in entry_dates if last_entry is None or date > last_entry)
+            for date in new_dates:
+                if last_entry is not None:
+                    gap = (date - last_entry).total_seconds()
+                    state['gap'] = gap if state['gap'] is None else state['gap'] + DAEMON_GAP_SMOOTHING * (gap - state['gap'])
+                last_entry = date
+            state['last_entry'] = last_entry
+            
+            if new_dates:
+                interval = self._target(state)
+            else:
+                interval = min(state['interval'] * DAEMON_IDLE_BACKOFF, 2 * self._target(state))
+            ceiling = DAEMON_MAX_INTERVAL
+        
+        state['interval'] = min(ceiling, max(DAEMON_MIN_INTERVAL, interval))
+        state['next_poll'] = now + state['interval']
+        return state['interval']
+
+
+def daemon_publish_budget(selected_at, outbox, now):
+    """Сколько новостей daemon может отобрать сейчас
     
-    print(f"News above threshold: {len(scored_news)}")
+    Лимит - MAX_NEWS_PER_RUN за DAEMON_PUBLISH_WINDOW. Считаем отобранные
+    за окно (selected_at - time.monotonic() отбора, старые выбрасываются)
+    и посты outbox, отобранные раньше окна, но еще не ушедшие: иначе
+    пока канал под лимитом, очередь растет, а потом уходит одной пачкой.
+    """
+    while selected_at and selected_at[0] <= now - DAEMON_PUBLISH_WINDOW:
+        selected_at.popleft()
+    window_start = datetime.now() - timedelta(seconds=DAEMON_PUBLISH_WINDOW)
+    waiting = sum(1 for entry in outbox.entries if datetime.fromisoformat(entry['queued_at']) <= window_start)
+    return max(0, MAX_NEWS_PER_RUN - len(selected_at) - waiting)
+
+
+def run_daemon(record_path=None):
+    """Постоянная работа: состояние, кэши и соединения живут между проходами
+    
+    Каждый источник опрашивается по расписанию SourceScheduler, новость
+    публикуется в тот же проход, в котором появилась в ленте. Не больше
+    MAX_NEWS_PER_RUN новостей за DAEMON_PUBLISH_WINDOW секунд
+    (daemon_publish_budget).
+    Останавливается по SIGTERM или Ctrl+C, закончив текущий проход.
+    """
+    print("=" * 60)
+    print("🤖 Crypto News Bot - Daemon mode")
+    print("=" * 60)
+    
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
     
-    final_news = deduplicate_news(scored_news)
-    print(f"After deduplication: {len(final_news)}")
+    cursors = load_feed_cursors()
+    published = load_published_news(days=PUBLISHED_WINDOW_DAYS)
+    published_index = DedupIndex(published)
+    outbox = PublishOutbox()
+    window_date = datetime.now().date()
+    print(f"Already published (last {PUBLISHED_WINDOW_DAYS} days): {len(published)}")
     
-    if not final_news:
-        print("💤 No important news found")
+    scheduler = SourceScheduler(RSS_SOURCES, time.monotonic())
+    selected_at = deque()
+    
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            due = scheduler.due(now)
+            if not due:
+                stop.wait(scheduler.next_poll() - now)
+                continue
+            
+            # Раз в сутки сдвигаем окно опубликованных и пересобираем индекс
+            if datetime.now().date() != window_date:
+                published = load_published_news(days=PUBLISHED_WINDOW_DAYS)
+                published_index = DedupIndex(published)
+                window_date = datetime.now().date()
+            
+            METRICS.reset()
+            top_news, _ = run_cycle(
+                cursors, published, published_index, outbox, sources=due, record_path=record_path,
+                limit=daemon_publish_budget(selected_at, outbox, now)
+            )
+            selected_at.extend(time.monotonic() for _ in top_news)
+            
+            polled_at = time.monotonic()
+            for source_name in due:
+                seen_dates = cursors[source_name].pop('seen_dates', None)
+                entry_dates = [datetime.fromisoformat(date) for date in seen_dates] if seen_dates is not None else None
+                interval = scheduler.record(source_name, polled_at, entry_dates)
+                METRICS.observe('poll_interval_seconds', interval, source=source_name)
+                print(f"  ⏲ {source_name}: next poll in {interval:.0f}s")
+            emit_run_metrics()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("🛑 Daemon stopped")
+        close_published_store()
+        close_http_session()
         print("=" * 60)
-        return
+
+
+def load_replay_runs(path):
+    """Читаем архив (JSONL) и группируем записи по запускам
     
-    final_news.sort(key=lambda x: x['score'], reverse=True)
-    top_news = final_news[:5]
+    Запуск определяется полем fetched_at (пишет --record). Для записей
+    без него берется ближайший следующий слот cron по published_date.
+    Веса и приоритеты источников берутся из текущего RSS_SOURCES,
+    выключенные в конфиге источники пропускаются.
+    """
+    runs = {}
+    slot = timedelta(minutes=REPLAY_RUN_MINUTES)
     
-    print(f"\n📢 Publishing top {len(top_news)} news items:")
-    for i, item in enumerate(top_news, 1):
-        print(f"{i}. [{item['score']}] {item['title']}")
-        if item.get('summary'):
-            print(f"   Summary: {item['summary'][:50]}...")
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            
+            record = json.loads(line)
+            feed_config = RSS_SOURCES.get(record.get('source'))
+            if not feed_config:
+                continue
+            
+            fetched_at = record.pop('fetched_at', None)
+            item = news_item_from_record(record)
+            item['source_weight'] = feed_config['weight_multiplier']
+            item['source_priority'] = feed_config['priority']
+            
+            if fetched_at:
+                run_at = datetime.fromisoformat(fetched_at)
+            else:
+                published = item['published_date']
+                run_at = datetime.min + ((published - datetime.min) // slot + 1) * slot
+            runs.setdefault(run_at, []).append(item)
     
-    print("\n🤖 Generating Alpha Takes with OpenAI...")
-    for item in top_news:
-        alpha_take_data = get_alpha_take(item)
-        if alpha_take_data:
-            item['alpha_take_data'] = alpha_take_data
+    return sorted(runs.items(), key=lambda run: run[0])
+
+
+def replay_archive(path):
+    """Прогоняем архив через dedup -> score -> dedupe -> top без сети и публикации
+    
+    Архив --record хранит ленты целиком, поэтому каждый запуск заново
+    видит все неопубликованные записи - как живой бот видит кандидатов,
+    отложенных курсором. Печатает, что было бы опубликовано, и
+    пропускную способность этапов.
+    Возвращает отчет: {'published': [(run_at, item), ...], 'stages': {...}}.
+    """
+    print("=" * 60)
+    print(f"🔁 Replaying {path}")
+    print("=" * 60)
     
-    telegram_count = 0
-    twitter_count = 0
+    stages = {name: {'items': 0, 'seconds': 0.0} for name in ('load', 'dedup', 'score', 'select')}
     
-    for item in top_news:
-        if publish_to_telegram(item):
-            telegram_count += 1
+    def track(stage, count, started):
+        stages[stage]['items'] += count
+        stages[stage]['seconds'] += time.perf_counter() - started
+    
+    started = time.perf_counter()
+    runs = load_replay_runs(path)
+    track('load', sum(len(items) for _, items in runs), started)
+    
+    window = timedelta(days=PUBLISHED_WINDOW_DAYS)
+    would_publish = []
+    published = []
+    published_index = DedupIndex()
+    compacted_on = None
+    
+    for run_at, items in runs:
+        since = run_at - window
         
-        if TWITTER_ENABLED and publish_to_twitter(item):
-            twitter_count += 1
+        # Раз в сутки пересобираем индекс только из записей внутри окна
+        if compacted_on != run_at.date():
+            published = [(date, item) for date, item in published if date >= since]
+            published_index = DedupIndex()
+            for date, item in published:
+                published_index.add(item, date=date)
+            compacted_on = run_at.date()
         
-        published.append({
-            'title': item['title'],
-            'link': item.get('link', ''),
-            'published_date': datetime.now().isoformat()
-        })
-    
-    save_published_news(published)
+        started = time.perf_counter()
+        new_news = [item for item in items if not published_index.contains(item, since=since)]
+        track('dedup', len(items), started)
+        
+        started = time.perf_counter()
+        scores, categories = score_batch(new_news, verbose=False)
+        scored_news = apply_thresholds(new_news, scores, categories)
+        track('score', len(new_news), started)
+        
+        started = time.perf_counter()
+        top_news, _ = select_unique_top_news(scored_news)
+        track('select', len(scored_news), started)
+        
+        for item in top_news:
+            print(f"{run_at:%Y-%m-%d %H:%M} [{item['score']}] {item['source']}: {item['title']}")
+            would_publish.append((run_at, item))
+            published.append((run_at, item))
+            published_index.add(item, date=run_at)
     
-    print(f"\n✅ Published: {telegram_count} to Telegram, {twitter_count} to Twitter")
+    total_items = stages['load']['items']
+    total_seconds = sum(stage['seconds'] for stage in stages.values())
+    print(f"\n📊 Replay: {len(runs)} runs, {total_items} entries, "
+          f"{len(would_publish)} would be published")
+    for name, stage in stages.items():
+        rate = stage['items'] / stage['seconds'] if stage['seconds'] else 0
+        print(f"  {name:<7} {stage['items']:>8} items {stage['seconds']:8.3f}s {rate:>12,.0f} items/s")
+    print(f"  total   {total_seconds:.3f}s")
     print("=" * 60)
+    
+    return {'published': would_publish, 'stages': stages}
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Crypto News Bot')
+    parser.add_argument('--record', metavar='ARCHIVE',
+                        help='дописывать загруженные записи в архив JSONL')
+    parser.add_argument('--replay', metavar='ARCHIVE',
+                        help='прогнать архив JSONL офлайн и показать, что было бы опубликовано')
+    parser.add_argument('--daemon', action='store_true',
+                        help='работать постоянно, опрашивая каждый источник по своему расписанию')
+    args = parser.parse_args()
+    
+    if args.replay:
+        replay_archive(args.replay)
+    elif args.daemon:
+        run_daemon(record_path=args.record)
+    else:
+        main(record_path=args.record)
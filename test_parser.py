@@ -1,10 +1,25 @@
 """Тестовый скрипт для проверки парсера без публикации в Telegram"""
 
+import contextlib
 import feedparser
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from datetime import datetime, timedelta
 from news_config import IMPORTANCE_RULES, EXCLUDE_KEYWORDS, MIN_IMPORTANCE_SCORE, RSS_SOURCES
+from news_config import HTTP_TIMEOUT, HTTP_HOST_TIMEOUTS
 import re
 
+import news_parser
+from bench_helpers import deduplicate_news, fetch_all_news, legacy_importance, select_top_news, simulate_polling
+
 
 def test_feed_parsing():
     """Тестируем парсинг одного источника"""
@@ -103,6 +118,1351 @@ def test_all_sources():
             print(f"✗ {source_name:15s} - Error: {e}")
 
 
+@contextlib.contextmanager
+def temp_feed_cache():
+    """Кэш лент на время теста - во временной папке, а не в .cache рабочей копии"""
+    original = news_parser.CACHE_DIR, news_parser.FEED_CACHE_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser.CACHE_DIR = tmp
+        news_parser.FEED_CACHE_FILE = os.path.join(tmp, 'feed_cache.json')
+        try:
+            yield tmp
+        finally:
+            news_parser.CACHE_DIR, news_parser.FEED_CACHE_FILE = original
+
+
+@temp_feed_cache()
+def test_parallel_fetch():
+    """Тестируем параллельную загрузку источников (без сети)"""
+    print("\n\n⚡ Testing parallel fetch...\n")
+    
+    delays = {'coindesk': 0.3, 'decrypt': 0.1, 'marketwatch': 0.2, 'reuters': 0.3}
+    
+    def fake_fetch(source_name, feed_config, cache=None, cursor=None):
+        time.sleep(delays.get(source_name, 0.1))
+        return [{'title': f'{source_name} news', 'source': source_name}]
+    
+    original = news_parser.fetch_rss_feed
+    news_parser.fetch_rss_feed = fake_fetch
+    try:
+        started = time.monotonic()
+        news = fetch_all_news()
+        elapsed = time.monotonic() - started
+    finally:
+        news_parser.fetch_rss_feed = original
+    
+    # Порядок как в RSS_SOURCES, время ~ самый медленный источник
+    assert [item['source'] for item in news] == list(RSS_SOURCES)
+    assert elapsed < sum(delays.values())
+    assert set(news_parser.FETCH_TIMINGS) == set(RSS_SOURCES)
+    
+    # Лента без новых записей ([]) - не ошибка, в отличие от сбоя загрузки (None)
+    import io
+    
+    log = io.StringIO()
+    news_parser.fetch_rss_feed = lambda source_name, feed_config, cache=None, cursor=None: (
+        None if source_name == 'reuters' else []
+    )
+    try:
+        with contextlib.redirect_stdout(log):
+            assert fetch_all_news() == []
+    finally:
+        news_parser.fetch_rss_feed = original
+    lines = log.getvalue().splitlines()
+    assert '✗ reuters: Invalid RSS feed' in lines
+    assert any(line.startswith('· decrypt: no new entries') for line in lines)
+    assert not any('decrypt: Invalid' in line or 'All RSS sources failed' in line for line in lines)
+    print(f"✓ Fetched {len(news)} sources in {elapsed:.2f}s (sequential: {sum(delays.values()):.2f}s)")
+
+
+SAMPLE_RSS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Test</title>
+<item><title>SEC Approves Bitcoin ETF</title><link>https://example.com/sec-etf</link>
+<description>&lt;p&gt;Approval &amp;amp; details&lt;/p&gt;</description>
+<pubDate>Mon, 23 Mar 2026 11:34:46 GMT</pubDate></item>
+</channel></rss>"""
+
+
+class FakeFeedHandler(BaseHTTPRequestHandler):
+    """RSS сервер с поддержкой ETag"""
+    requests_seen = []
+    
+    def do_GET(self):
+        FakeFeedHandler.requests_seen.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(SAMPLE_RSS)
+    
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_server(handler):
+    """Поднимаем локальный HTTP сервер в фоне"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_conditional_fetch():
+    """Тестируем ETag кэш: второй запрос получает 304 и не парсит feed"""
+    print("\n\n📦 Testing conditional fetch...\n")
+    
+    server = start_fake_server(FakeFeedHandler)
+    try:
+        feed_config = {
+            'url': f'http://127.0.0.1:{server.server_port}/rss',
+            'priority': 1,
+            'weight_multiplier': 1.0
+        }
+        cache = {}
+        first = news_parser.fetch_rss_feed('coindesk', feed_config, cache=cache)
+        assert cache['etag'] == '"v1"' and not cache.get('not_modified')
+        
+        second = news_parser.fetch_rss_feed('coindesk', feed_config, cache=cache)
+    finally:
+        server.shutdown()
+    
+    assert FakeFeedHandler.requests_seen[-1] == '"v1"'
+    assert cache['not_modified']
+    assert second == first and first[0]['summary'] == 'Approval & details'
+    print(f"✓ 304 Not Modified served {len(second)} cached entries")
+
+
+def test_feed_cursor():
+    """Тестируем курсор: обработанные записи отбрасываются, отложенные - нет"""
+    print("\n\n🔖 Testing feed cursor...\n")
+    
+    server = start_fake_server(FakeFeedHandler)
+    try:
+        feed_config = {
+            'url': f'http://127.0.0.1:{server.server_port}/rss',
+            'priority': 1,
+            'weight_multiplier': 1.0
+        }
+        cursors = {'coindesk': {}}
+        first = news_parser.fetch_rss_feed('coindesk', feed_config, cursor=cursors['coindesk'])
+        assert len(first) == 1
+        
+        # Новость выше порога, но не опубликована - должна вернуться
+        news_parser.advance_feed_cursors(cursors, held_back=first)
+        held = news_parser.fetch_rss_feed('coindesk', feed_config, cursor=cursors['coindesk'])
+        assert [item['link'] for item in held] == [first[0]['link']]
+        
+        news_parser.advance_feed_cursors(cursors, held_back=[])
+        cache = {}
+        settled = news_parser.fetch_rss_feed('coindesk', feed_config, cache=cache, cursor=cursors['coindesk'])
+    finally:
+        server.shutdown()
+    
+    # Из конвейера запись ушла, а в кэше (и архиве --record) лента целиком
+    assert settled == []
+    assert [record['link'] for record in cache['items']] == [first[0]['link']]
+    assert cursors['coindesk']['ids'] == ['https://example.com/sec-etf']
+    print(f"✓ Cursor at {cursors['coindesk']['high_water']}, settled entries skipped")
+
+
+def test_dedup_index():
+    """Тестируем индекс дубликатов против полного перебора"""
+    print("\n\n🔎 Testing dedup index...\n")
+    
+    rng = random.Random(42)
+    words = ['bitcoin', 'etf', 'sec', 'approves', 'blackrock', 'surges', 'fed', 'cuts',
+             'rates', 'ethereum', 'upgrade', 'hack', '$100m', 'exchange', 'market', 'crash']
+    
+    def random_item(i):
+        title = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 7)))
+        link = f'https://example.com/{rng.randint(0, 300)}' if rng.random() < 0.8 else ''
+        return {'title': title.title(), 'link': link}
+    
+    published = [random_item(i) for i in range(300)]
+    index = news_parser.DedupIndex(published)
+    
+    def brute_force(item):
+        for pub_item in published:
+            if item['link'] and pub_item['link'] and item['link'] == pub_item['link']:
+                return True
+            if item['title'] and pub_item['title']:
+                if news_parser.calculate_similarity(item['title'], pub_item['title']) >= 0.5:
+                    return True
+        return False
+    
+    candidates = [random_item(i) for i in range(500)]
+    mismatches = [item for item in candidates if index.contains(item) != brute_force(item)]
+    
+    assert not mismatches, mismatches[:3]
+    print(f"✓ Index matches brute force on {len(candidates)} items "
+          f"({sum(index.contains(item) for item in candidates)} duplicates)")
+
+
+def test_matcher_equivalence():
+    """Тестируем, что скомпилированный матчер дает те же баллы"""
+    print("\n\n🧮 Testing compiled keyword matcher...\n")
+    
+    with open('published_news.json', 'r', encoding='utf-8') as f:
+        titles = [item['title'] for item in json.load(f) if isinstance(item, dict) and item.get('title')]
+    
+    # Плюс синтетические заголовки из ключевых слов конфига
+    rng = random.Random(7)
+    vocabulary = EXCLUDE_KEYWORDS + [k for rules in IMPORTANCE_RULES.values() for k in rules['keywords']]
+    vocabulary += ['Bitcoin', 'BTC', 'SEC', '$5.2B', '12%', 'What', 'How', '?', ':', '...', 'Here\'s why']
+    for _ in range(2000):
+        titles.append(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 8))))
+    
+    for title in titles:
+        for weight in (1.0, 1.2, 1.3):
+            item = {'title': title, 'source_weight': weight}
+            assert news_parser.calculate_importance(item) == legacy_importance(item), title
+    
+    print(f"✓ Same scores for {len(titles)} titles")
+
+
+def test_score_batch():
+    """Тестируем пакетный скоринг (с NumPy и без) против calculate_importance"""
+    print("\n\n📊 Testing batch scoring...\n")
+    
+    rng = random.Random(11)
+    vocabulary = [k for rules in IMPORTANCE_RULES.values() for k in rules['keywords']]
+    vocabulary += ['Bitcoin', 'BTC', 'SEC', '$5.2B', '12%', 'market', 'opinion']
+    sources = list(RSS_SOURCES)
+    items = []
+    for _ in range(1000):
+        source = rng.choice(sources)
+        items.append({
+            'title': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 6))),
+            'source': source,
+            'source_weight': RSS_SOURCES[source]['weight_multiplier']
+        })
+    
+    expected = [news_parser.calculate_importance(item) for item in items]
+    original_np = news_parser.get_numpy()
+    original_min_batch = news_parser.SCORE_NUMPY_MIN_BATCH
+    news_parser.SCORE_NUMPY_MIN_BATCH = 0
+    try:
+        for numpy_module in ([original_np] if original_np else []) + [None]:
+            news_parser.np = numpy_module
+            scores, categories = news_parser.score_batch(items)
+            assert list(zip(scores, categories)) == expected
+            
+            passed = news_parser.apply_thresholds([dict(item) for item in items], scores, categories)
+            assert all(item['score'] >= news_parser.source_threshold(item['source']) for item in passed)
+            assert len(passed) == sum(
+                score >= news_parser.source_threshold(item['source']) for item, score in zip(items, scores)
+            )
+    finally:
+        news_parser.np = original_np
+        news_parser.SCORE_NUMPY_MIN_BATCH = original_min_batch
+    
+    print(f"✓ score_batch matches calculate_importance on {len(items)} items "
+          f"(numpy: {'yes' if original_np else 'not installed'})")
+
+
+def test_replay():
+    """Тестируем офлайн replay архива"""
+    print("\n\n🔁 Testing replay...\n")
+    
+    start = datetime(2026, 3, 1, 12, 0)
+    
+    def record(minutes, source, title, link):
+        fetched_at = start + timedelta(minutes=minutes)
+        return {
+            'fetched_at': fetched_at.isoformat(), 'source': source, 'title': title, 'link': link,
+            'summary': '', 'published_date': (fetched_at - timedelta(minutes=5)).isoformat(), 'image_url': None
+        }
+    
+    records = [
+        record(0, 'coindesk', 'SEC Approves Bitcoin ETF', 'https://example.com/a'),
+        record(0, 'decrypt', 'SEC Approves Bitcoin ETF Filing', 'https://example.com/b'),
+        record(0, 'yahoo_finance', 'Market crash: SEC approves everything', 'https://example.com/y'),
+        record(30, 'coindesk', 'SEC Approves Bitcoin ETF', 'https://example.com/a'),
+        record(30, 'coindesk', 'Bitcoin Surges 15% After Fed Rate Cut', 'https://example.com/c'),
+        # Через 8 дней запись вышла из окна публикаций
+        record(8 * 24 * 60, 'coindesk', 'SEC Approves Bitcoin ETF', 'https://example.com/a'),
+    ]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'archive.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(r) + '\n' for r in records)
+        report = news_parser.replay_archive(path)
+    
+    published = [(run_at - start, item['link'], item['score']) for run_at, item in report['published']]
+    assert published == [
+        (timedelta(0), 'https://example.com/a', 234),
+        (timedelta(minutes=30), 'https://example.com/c', 168),
+        (timedelta(days=8), 'https://example.com/a', 234),
+    ], published
+    assert report['stages']['load']['items'] == 5
+    
+    # --record пишет ленту целиком, даже когда все записи уже за курсором
+    def fake_fetch(source_name, feed_config, cache=None, cursor=None):
+        cache['items'] = [news_parser.news_item_to_record(news_parser.NewsItem(
+            title='SEC Approves Bitcoin ETF', link='https://example.com/a', source=source_name, published_date=start
+        ))]
+        return []
+    
+    original = news_parser.fetch_rss_feed
+    news_parser.fetch_rss_feed = fake_fetch
+    try:
+        with temp_feed_cache() as tmp:
+            path = os.path.join(tmp, 'archive.jsonl')
+            assert list(news_parser.iter_fetched_news(sources=['coindesk'], record_path=path)) == []
+            runs = news_parser.load_replay_runs(path)
+    finally:
+        news_parser.fetch_rss_feed = original
+    assert [[item['link'] for item in items] for _, items in runs] == [['https://example.com/a']]
+    print(f"✓ Replay published {len(published)} items")
+
+
+def test_parallel_alpha_takes():
+    """Тестируем параллельные Alpha Take с общим дедлайном"""
+    print("\n\n🤖 Testing parallel Alpha Takes...\n")
+    
+    delays = [0.3, 0.1, 0.2, 2.0, 0.1]
+    items = [{'title': f'News {i}', 'delay': delay} for i, delay in enumerate(delays)]
+    
+    def fake_alpha_take(news_item):
+        time.sleep(news_item['delay'])
+        return {'alpha_take': f"Take for {news_item['title']}", 'context': None, 'hashtags': None}
+    
+    original = (news_parser.get_alpha_take, news_parser.ALPHA_TAKE_DEADLINE, news_parser.ALPHA_TAKE_BATCH_ENABLED)
+    news_parser.get_alpha_take = fake_alpha_take
+    news_parser.ALPHA_TAKE_DEADLINE = 1.0
+    news_parser.ALPHA_TAKE_BATCH_ENABLED = False
+    try:
+        started = time.monotonic()
+        ready_at = []
+        for item in news_parser.generate_alpha_takes(items):
+            ready_at.append((item['title'], time.monotonic() - started, 'alpha_take_data' in item))
+    finally:
+        news_parser.get_alpha_take, news_parser.ALPHA_TAKE_DEADLINE, news_parser.ALPHA_TAKE_BATCH_ENABLED = original
+    
+    # Порядок сохранен, первая новость готова через ~0.3s, медленная - без Alpha Take по дедлайну
+    assert [title for title, _, _ in ready_at] == [item['title'] for item in items]
+    assert ready_at[0][1] < 0.6
+    assert [has_take for _, _, has_take in ready_at] == [True, True, True, False, True]
+    assert ready_at[-1][1] < 1.5
+    print(f"✓ {len(items)} items, first ready in {ready_at[0][1]:.2f}s, all in {ready_at[-1][1]:.2f}s")
+
+
+def test_alpha_take_cache():
+    """Тестируем кэш Alpha Take: нормализация заголовка, TTL и вытеснение"""
+    print("\n\n🧠 Testing Alpha Take cache...\n")
+    
+    take = {'alpha_take': 'Institutional demand follows approval', 'context': 'Strong positive', 'hashtags': '#ETF #SEC'}
+    item = {'title': 'SEC Approves Bitcoin ETF', 'summary': 'The SEC  approved it.'}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = news_parser.AlphaTakeCache(os.path.join(tmp, 'cache.db'), ttl_days=1, max_entries=2)
+        assert cache.get(item) is None
+        cache.put(item, take)
+        
+        # Тот же заголовок с другим регистром/пунктуацией - попадание
+        assert cache.get({'title': 'sec approves bitcoin ETF!', 'summary': 'The SEC approved it.'}) == take
+        assert cache.get({'title': 'SEC Approves Bitcoin ETF', 'summary': 'Different summary'}) is None
+        
+        for i in range(3):
+            cache.put({'title': f'Other news {i}', 'summary': ''}, take)
+        assert len(cache) == 2
+        assert cache.get(item) is None
+        
+        cache.ttl = -1
+        assert cache.get({'title': 'Other news 2', 'summary': ''}) is None
+        hits, misses = cache.hits, cache.misses
+        cache.close()
+    
+    assert (hits, misses) == (1, 4)
+    print(f"✓ Cache hits/misses: {hits}/{misses}")
+
+
+class FakeChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Заглушка /v1/chat/completions: в пакетном ответе блок ITEM 2 сломан"""
+    requests_seen = []
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        system, user = body['messages'][0]['content'], body['messages'][1]['content']
+        titles = re.findall(r'News Title: (.*)', user)
+        
+        if 'BATCH MODE' in system:
+            FakeChatCompletionsHandler.requests_seen.append('batch')
+            blocks = []
+            for number, title in enumerate(titles, 1):
+                if number == 2:
+                    blocks.append(f"### ITEM {number}\nSorry, no take.")
+                else:
+                    blocks.append(f"### ITEM {number}\nALPHA_TAKE: Batched take about {title}\n"
+                                  f"CONTEXT: Strong positive\nHASHTAGS: #BTC #ETF")
+            content = '\n\n'.join(blocks)
+        else:
+            FakeChatCompletionsHandler.requests_seen.append('single')
+            content = f"ALPHA_TAKE: Single take about {titles[0]}\nCONTEXT: Medium neutral\nHASHTAGS: #Crypto #Markets"
+        
+        payload = json.dumps({
+            'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 600, 'completion_tokens': 150, 'total_tokens': 750}
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, *args):
+        pass
+
+
+def test_batched_alpha_takes():
+    """Тестируем пакетный Alpha Take против локальной заглушки OpenAI"""
+    print("\n\n📦 Testing batched Alpha Takes...\n")
+    
+    from openai import OpenAI
+    
+    items = [
+        {'title': f'Bitcoin news {i}', 'summary': '', 'score': 100, 'categories': ['HIGH'], 'source': 'coindesk'}
+        for i in range(1, 4)
+    ]
+    
+    server = start_fake_server(FakeChatCompletionsHandler)
+    original = (news_parser._openai_client, news_parser._alpha_take_cache)
+    original_client_factory, original_batch_enabled = news_parser.get_openai_client, news_parser.ALPHA_TAKE_BATCH_ENABLED
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser._openai_client = OpenAI(api_key='test', base_url=f'http://127.0.0.1:{server.server_port}/v1')
+        news_parser._alpha_take_cache = news_parser.AlphaTakeCache(os.path.join(tmp, 'cache.db'))
+        try:
+            results = news_parser.get_alpha_takes_batch(items)
+            # Повторный запуск - все из кэша, без запросов
+            cached = news_parser.get_alpha_takes_batch(items)
+            
+            # Пакетный режим в пайплайне: все из кэша - клиент OpenAI не создается
+            clients_built = []
+            news_parser._openai_client = None
+            news_parser.get_openai_client = lambda: clients_built.append(1)
+            news_parser.ALPHA_TAKE_BATCH_ENABLED = True
+            streamed = list(news_parser.generate_alpha_takes([dict(item) for item in items]))
+        finally:
+            news_parser._alpha_take_cache.close()
+            news_parser._openai_client, news_parser._alpha_take_cache = original
+            news_parser.get_openai_client = original_client_factory
+            news_parser.ALPHA_TAKE_BATCH_ENABLED = original_batch_enabled
+            server.shutdown()
+    
+    assert [data['alpha_take'] for data in results] == [
+        'Batched take about Bitcoin news 1',
+        'Single take about Bitcoin news 2',
+        'Batched take about Bitcoin news 3',
+    ]
+    assert results[0]['context'] == 'Strong positive' and results[0]['hashtags'] == '#BTC #ETF'
+    assert cached == results
+    assert FakeChatCompletionsHandler.requests_seen == ['batch', 'single']
+    assert [item['alpha_take_data'] for item in streamed] == results and not clients_built
+    assert news_parser.ALPHA_TAKE_BATCH_STATS['tokens_per_item'] == 250
+    print(f"✓ 1 batch request + 1 fallback for {len(items)} items, stats: {news_parser.ALPHA_TAKE_BATCH_STATS}")
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 сервер с keep-alive: /flaky отвечает 503 на первый запрос, POST - всегда 503"""
+    protocol_version = 'HTTP/1.1'
+    hits = {}
+    
+    def reply(self, status):
+        body = b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        hits = KeepAliveHandler.hits[self.path] = KeepAliveHandler.hits.get(self.path, 0) + 1
+        self.reply(503 if self.path == '/flaky' and hits == 1 else 200)
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        KeepAliveHandler.hits[self.path] = KeepAliveHandler.hits.get(self.path, 0) + 1
+        self.reply(503)
+    
+    def log_message(self, *args):
+        pass
+
+
+def test_http_session():
+    """Тестируем общую HTTP сессию: keep-alive, повторы и timeout по хосту"""
+    print("\n\n🔌 Testing pooled HTTP session...\n")
+    
+    assert news_parser.http_timeout('https://api.telegram.org/bot1/sendPhoto') == HTTP_HOST_TIMEOUTS['api.telegram.org']
+    assert news_parser.http_timeout('https://www.coindesk.com/feed') == HTTP_TIMEOUT
+    
+    server = start_fake_server(KeepAliveHandler)
+    base = f'http://127.0.0.1:{server.server_port}'
+    news_parser.close_http_session()
+    try:
+        session = news_parser.get_http_session()
+        assert news_parser.get_http_session() is session
+        
+        for _ in range(3):
+            assert session.get(f'{base}/feed').status_code == 200
+        # GET повторяется после 503, POST - нет (чтобы не отправить дважды)
+        assert session.get(f'{base}/flaky').status_code == 200
+        assert session.post(f'{base}/post', json={}).status_code == 503
+        
+        stats = news_parser.http_connection_stats()['127.0.0.1']
+    finally:
+        news_parser.close_http_session()
+        server.shutdown()
+    
+    assert KeepAliveHandler.hits == {'/feed': 3, '/flaky': 2, '/post': 1}
+    assert stats == {'requests': 6, 'connections': 1}
+    assert news_parser.http_connection_stats() == {}
+    print(f"✓ {stats['requests']} requests over {stats['connections']} connection, 503 retried for GET only")
+
+
+def test_publish_pipeline():
+    """Тестируем публикацию: каналы параллельно, порядок и пауза внутри канала"""
+    print("\n\n📢 Testing concurrent publishing...\n")
+    
+    items = [{'title': f'News {i}', 'image_url': f'https://example.com/{i}.jpg'} for i in range(4)]
+    sent = {'telegram': [], 'twitter': []}
+    started = time.monotonic()
+    
+    def fake_prepare(news_item):
+        time.sleep(0.1)
+        return f"cropped-{news_item['title']}"
+    
+    def fake_telegram(news_item, processed_image=None):
+        assert processed_image == f"cropped-{news_item['title']}"
+        sent['telegram'].append((news_item['title'], time.monotonic() - started))
+        time.sleep(0.2)
+        return True
+    
+    def fake_twitter(news_item):
+        sent['twitter'].append((news_item['title'], time.monotonic() - started))
+        time.sleep(0.2)
+        return news_item['title'] != 'News 2'
+    
+    names = ['prepare_telegram_image', 'publish_to_telegram', 'publish_to_twitter', 'get_alpha_take',
+             'ALPHA_TAKE_BATCH_ENABLED', 'TWITTER_ENABLED', 'PUBLISH_RATE_LIMITS']
+    original = {name: getattr(news_parser, name) for name in names}
+    news_parser.prepare_telegram_image = fake_prepare
+    news_parser.publish_to_telegram = fake_telegram
+    news_parser.publish_to_twitter = fake_twitter
+    news_parser.get_alpha_take = lambda news_item: None
+    news_parser.ALPHA_TAKE_BATCH_ENABLED = False
+    news_parser.TWITTER_ENABLED = True
+    news_parser.PUBLISH_RATE_LIMITS = {'telegram': {'rate': 1 / 0.3, 'burst': 1}, 'twitter': {'rate': 1000.0, 'burst': 4}}
+    try:
+        results = news_parser.publish_news(items)
+        elapsed = time.monotonic() - started
+    finally:
+        for name, value in original.items():
+            setattr(news_parser, name, value)
+    
+    titles = [item['title'] for item in items]
+    assert [item['title'] for item, _, _ in results] == titles
+    assert [(telegram_ok, twitter_ok) for _, telegram_ok, twitter_ok in results] == [
+        (True, True), (True, True), (True, False), (True, True)
+    ]
+    assert [title for title, _ in sent['telegram']] == titles
+    assert [title for title, _ in sent['twitter']] == titles
+    
+    # Telegram не чаще rate из PUBLISH_RATE_LIMITS, Twitter в это время не ждет
+    telegram_times = [at for _, at in sent['telegram']]
+    assert all(b - a >= 0.29 for a, b in zip(telegram_times, telegram_times[1:]))
+    assert sent['twitter'][-1][1] < telegram_times[-1]
+    
+    # Последовательно было бы 4 x (0.1 + 0.2 + 0.2) = 2.0s
+    assert elapsed < 1.6
+    print(f"✓ {len(items)} items to 2 channels in {elapsed:.2f}s (sequential ~2.0s)")
+
+
+class FakeImageHandler(BaseHTTPRequestHandler):
+    """Отдает JPEG с ETag, на If-None-Match отвечает 304"""
+    requests_seen = []
+    image = b''
+    
+    def do_GET(self):
+        FakeImageHandler.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"img1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('ETag', '"img1"')
+        self.send_header('Content-Length', str(len(FakeImageHandler.image)))
+        self.end_headers()
+        self.wfile.write(FakeImageHandler.image)
+    
+    def log_message(self, *args):
+        pass
+
+
+def test_image_cache():
+    """Тестируем кэш обрезанных картинок: повтор без скачивания, ETag, лимит размера"""
+    print("\n\n🖼 Testing image cache...\n")
+    
+    import io
+    from PIL import Image
+    
+    original = io.BytesIO()
+    Image.new('RGB', (400, 300), (200, 30, 30)).save(original, format='JPEG', quality=95)
+    FakeImageHandler.image = original.getvalue()
+    
+    server = start_fake_server(FakeImageHandler)
+    base = f'http://127.0.0.1:{server.server_port}'
+    saved = (news_parser._image_cache, news_parser.IMAGE_MAX_BYTES)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = news_parser._image_cache = news_parser.ImageCache(tmp, max_entries=2)
+        try:
+            first = news_parser.process_image_for_telegram(f'{base}/a.jpg', 'coindesk').getvalue()
+            repeat = news_parser.process_image_for_telegram(f'{base}/a.jpg', 'coindesk').getvalue()
+            
+            # Устаревшая запись сверяется по ETag и не скачивается заново
+            cache._conn.execute("UPDATE images SET validated_at = 0")
+            revalidated = news_parser.process_image_for_telegram(f'{base}/a.jpg', 'coindesk').getvalue()
+            
+            # Та же картинка по другим URL - один файл, третий URL вытесняет первый
+            news_parser.process_image_for_telegram(f'{base}/b.jpg', 'coindesk')
+            news_parser.process_image_for_telegram(f'{base}/c.jpg', 'coindesk')
+            files = [name for name in os.listdir(tmp) if name.endswith('.jpg')]
+            evicted = cache.lookup(f'{base}/a.jpg')
+            
+            # Файл без строки в индексе (другой поток еще пишет) put не трогает,
+            # лишнее убирается при следующем открытии кэша
+            orphan = os.path.join(tmp, f"{'f' * 64}.jpg")
+            with open(orphan, 'wb') as f:
+                f.write(b'in flight')
+            cache.put(f'{base}/e.jpg', b'other bytes')
+            orphan_kept = os.path.exists(orphan)
+            pruned = news_parser.ImageCache(tmp, max_entries=2)
+            pruned.close()
+            orphan_pruned = not os.path.exists(orphan)
+            
+            news_parser.IMAGE_MAX_BYTES = 100
+            too_large = news_parser.process_image_for_telegram(f'{base}/d.jpg', 'coindesk')
+        finally:
+            cache.close()
+            news_parser._image_cache, news_parser.IMAGE_MAX_BYTES = saved
+            news_parser.close_http_session()
+            server.shutdown()
+    
+    assert Image.open(io.BytesIO(first)).size == (400, 230)
+    assert repeat == first and revalidated == first
+    assert FakeImageHandler.requests_seen[:2] == [('/a.jpg', None), ('/a.jpg', '"img1"')]
+    assert len(files) == 1 and evicted is None
+    assert orphan_kept and orphan_pruned
+    assert too_large == f'{base}/d.jpg'
+    print(f"✓ Cropped once, {len(FakeImageHandler.requests_seen)} downloads for 6 requests, "
+          f"{len(first)} bytes (original {len(original.getvalue())})")
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    """Заглушка Telegram Bot API: sendPhoto возвращает file_id, неизвестный file_id - 400"""
+    requests_seen = []
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers['Content-Type'].startswith('multipart/form-data'):
+            kind, photo = 'upload', 'file-uploaded'
+        else:
+            photo = json.loads(body)['photo']
+            kind = 'file_id' if photo.startswith('file-') else 'url'
+            photo = photo if kind == 'file_id' else 'file-from-url'
+        FakeBotApiHandler.requests_seen.append((self.path.rsplit('/', 1)[-1], kind))
+        
+        if kind == 'file_id' and photo == 'file-stale':
+            status, payload = 400, {'ok': False, 'description': 'Bad Request: wrong file identifier'}
+        else:
+            status, payload = 200, {'ok': True, 'result': {'photo': [
+                {'file_id': f'{photo}-small', 'width': 90}, {'file_id': photo, 'width': 800}
+            ]}}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+def test_telegram_file_id():
+    """Тестируем повторную отправку фото по file_id против заглушки Bot API"""
+    print("\n\n📎 Testing Telegram file_id reuse...\n")
+    
+    import io
+    
+    cropped = {'title': 'Cropped news', 'source': 'coindesk', 'image_url': 'https://example.com/hero.jpg', 'score': 90}
+    linked = {'title': 'Linked news', 'source': 'decrypt', 'image_url': 'https://example.com/other.jpg', 'score': 90}
+    
+    server = start_fake_server(FakeBotApiHandler)
+    names = ['TELEGRAM_API_URL', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHANNEL_ID', '_image_cache']
+    saved = {name: getattr(news_parser, name) for name in names}
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser.TELEGRAM_API_URL = f'http://127.0.0.1:{server.server_port}'
+        news_parser.TELEGRAM_BOT_TOKEN = 'test-token'
+        news_parser.TELEGRAM_CHANNEL_ID = '@test'
+        cache = news_parser._image_cache = news_parser.ImageCache(tmp, max_file_ids=1)
+        try:
+            # Первый раз - загрузка файла, потом только file_id (картинка не готовится)
+            assert news_parser.publish_to_telegram(cropped, io.BytesIO(b'jpeg bytes'))
+            assert news_parser.prepare_telegram_image(cropped) == cropped['image_url']
+            assert news_parser.publish_to_telegram(cropped)
+            
+            # Устаревший file_id - Telegram отвечает 400, отправляем заново и запоминаем новый
+            cache.put_file_id(linked['image_url'], 'file-stale')
+            assert news_parser.publish_to_telegram(linked)
+            
+            stored = (cache.get_file_id(cropped['image_url']), cache.get_file_id(linked['image_url']))
+        finally:
+            cache.close()
+            for name, value in saved.items():
+                setattr(news_parser, name, value)
+            news_parser.close_http_session()
+            server.shutdown()
+    
+    assert FakeBotApiHandler.requests_seen == [
+        ('sendPhoto', 'upload'), ('sendPhoto', 'file_id'), ('sendPhoto', 'file_id'), ('sendPhoto', 'url')
+    ]
+    # max_file_ids=1: старый file_id вытеснен новым
+    assert stored == (None, 'file-from-url')
+    print(f"✓ Requests: {FakeBotApiHandler.requests_seen}")
+
+
+def test_published_store():
+    """Тестируем SQLite хранилище: перенос из JSON, окно, дозапись"""
+    print("\n\n🗄 Testing published store...\n")
+    
+    now = datetime.now()
+    legacy = [
+        {'title': 'Old SEC news', 'link': 'https://example.com/old', 'published_date': (now - timedelta(days=30)).isoformat()},
+        {'title': 'Bitcoin ETF approved', 'link': 'https://example.com/etf', 'published_date': (now - timedelta(days=1)).isoformat()},
+        {'title': 'No link news', 'link': '', 'published_date': (now - timedelta(days=2)).isoformat()},
+        'garbage entry',
+    ]
+    
+    saved = (news_parser.PUBLISHED_FILE, news_parser.PUBLISHED_DB_FILE, news_parser.PUBLISHED_BACKEND)
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser.PUBLISHED_FILE = os.path.join(tmp, 'published_news.json')
+        news_parser.PUBLISHED_DB_FILE = os.path.join(tmp, 'published_news.db')
+        news_parser.PUBLISHED_BACKEND = 'sqlite'
+        with open(news_parser.PUBLISHED_FILE, 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+        try:
+            published = news_parser.load_published_news(days=7)
+            titles = [item['title'] for item in published]
+            
+            published.append({'title': 'Fed cuts rates', 'link': 'https://example.com/fed',
+                              'published_date': now.isoformat(), 'tokens': ['cuts', 'fed', 'rates']})
+            news_parser.save_published_news(published)
+            news_parser.save_published_news(published)
+            news_parser.close_published_store()
+            
+            # Повторное открытие: перенос не повторяется, старая запись не возвращается
+            reloaded = news_parser.load_published_news(days=7)
+            store = news_parser.get_published_store()
+            plan = ' '.join(str(row) for row in store._conn.execute(
+                "EXPLAIN QUERY PLAN DELETE FROM published WHERE published_date < ?", (now.isoformat(),)
+            ))
+        finally:
+            news_parser.close_published_store()
+            news_parser.PUBLISHED_FILE, news_parser.PUBLISHED_DB_FILE, news_parser.PUBLISHED_BACKEND = saved
+    
+    assert titles == ['No link news', 'Bitcoin ETF approved']
+    assert [item['title'] for item in reloaded] == ['No link news', 'Bitcoin ETF approved', 'Fed cuts rates']
+    assert reloaded[1]['tokens'] == ['approved', 'bitcoin', 'etf']
+    assert news_parser.is_duplicate({'title': 'Bitcoin ETF approved today', 'link': 'https://x.com/1'}, reloaded)
+    assert 'published_by_date' in plan
+    
+    # База со старой колонкой signature: колонка и индекс уходят, данные остаются
+    import sqlite3
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'published_news.db')
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute("CREATE TABLE published (link_hash TEXT PRIMARY KEY, title TEXT NOT NULL, link TEXT NOT NULL, "
+                         "published_date TEXT NOT NULL, signature TEXT NOT NULL, tokens TEXT NOT NULL)")
+            conn.execute("CREATE INDEX published_by_signature ON published (signature)")
+            conn.execute("INSERT INTO published VALUES ('h', 'Bitcoin ETF approved', 'https://example.com/etf', ?, 's', "
+                         "'approved bitcoin etf')", (now.isoformat(),))
+        conn.close()
+        store = news_parser.PublishedStore(path)
+        try:
+            added = store.add([{'title': 'Fed cuts rates', 'link': 'https://example.com/fed', 'published_date': now.isoformat()}])
+            columns = [row[1] for row in store._conn.execute("PRAGMA table_info(published)")]
+            indexes = [row[1] for row in store._conn.execute("PRAGMA index_list(published)")]
+            old_titles = [record['title'] for record in store.load()]
+        finally:
+            store.close()
+    assert added == 1 and 'signature' not in columns and 'published_by_signature' not in indexes
+    assert sorted(old_titles) == ['Bitcoin ETF approved', 'Fed cuts rates']
+    print(f"✓ Migrated {len(titles)} of {len(legacy)} legacy items, {len(reloaded)} after append, plan: {plan}")
+
+
+def test_published_journal():
+    """Тестируем журнал: дозапись, оборванная строка, compaction, битые файлы"""
+    print("\n\n📓 Testing published journal...\n")
+    
+    now = datetime.now()
+    record = lambda i: {'title': f'Bitcoin news number {i}', 'link': f'https://example.com/{i}',
+                        'published_date': (now - timedelta(hours=i)).isoformat()}
+    
+    names = ['PUBLISHED_FILE', 'PUBLISHED_DB_FILE', 'PUBLISHED_SNAPSHOT_FILE', 'PUBLISHED_JOURNAL_FILE',
+             'PUBLISHED_BACKEND', 'PUBLISHED_COMPACT_EVERY']
+    saved = {name: getattr(news_parser, name) for name in names}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names[:4]:
+            setattr(news_parser, name, os.path.join(tmp, os.path.basename(saved[name])))
+        news_parser.PUBLISHED_BACKEND = 'journal'
+        news_parser.PUBLISHED_COMPACT_EVERY = 3
+        snapshot, journal = news_parser.PUBLISHED_SNAPSHOT_FILE, news_parser.PUBLISHED_JOURNAL_FILE
+        with open(news_parser.PUBLISHED_FILE, 'w', encoding='utf-8') as f:
+            json.dump([record(i) for i in range(10, 13)], f)
+        
+        def journal_lines():
+            with open(journal, encoding='utf-8') as f:
+                return f.read().count('\n')
+        
+        try:
+            # Перенос из JSON в snapshot, дальше дописываются только новые записи
+            published = news_parser.load_published_news(days=7)
+            with open(snapshot, encoding='utf-8') as f:
+                snapshot_before = f.read()
+            published.append(record(1))
+            news_parser.save_published_news(published)
+            news_parser.save_published_news(published)
+            assert journal_lines() == 1
+            with open(snapshot, encoding='utf-8') as f:
+                assert f.read() == snapshot_before
+            news_parser.close_published_store()
+            
+            # Падение посреди записи: оборванная строка отрезается, остальное на месте
+            with open(journal, 'a', encoding='utf-8') as f:
+                f.write('{"title": "Torn rec')
+            published = news_parser.load_published_news(days=7)
+            assert len(published) == 4 and journal_lines() == 1
+            
+            # Третья запись в журнале - compaction в snapshot
+            published += [record(2), record(3)]
+            news_parser.save_published_news(published)
+            assert journal_lines() == 0
+            news_parser.close_published_store()
+            assert len(news_parser.load_published_news(days=7)) == 6
+            news_parser.close_published_store()
+            
+            # Битая строка в середине - ошибка, а не пустая история
+            with open(snapshot, 'a', encoding='utf-8') as f:
+                f.write('not json\n')
+            try:
+                news_parser.load_published_news(days=7)
+                assert False, 'corrupted snapshot must raise'
+            except news_parser.PublishedStateError as e:
+                error = str(e)
+        finally:
+            news_parser.close_published_store()
+            for name, value in saved.items():
+                setattr(news_parser, name, value)
+    
+    print(f"✓ Append-only journal, torn tail repaired, compaction done, corruption raises: {error}")
+
+
+def test_news_item():
+    """Тестируем NewsItem: доступ как у dict и запись для архива"""
+    print("\n\n🧩 Testing NewsItem...\n")
+    
+    record = {'title': 'SEC approves Bitcoin ETF', 'link': 'https://example.com/etf', 'summary': '',
+              'published_date': '2026-03-01T10:00:00', 'source': 'coindesk', 'source_weight': 1.2,
+              'source_priority': 1, 'image_url': None, 'fetched_at': '2026-03-01T10:30:00'}
+    item = news_parser.news_item_from_record(record)
+    
+    assert isinstance(item, news_parser.NewsItem)
+    assert item['title'] == item.title and item.get('image_url') is None and item.get('summary', 'x') == ''
+    assert 'score' not in item and item.get('score', 0) == 0
+    item['score'] = 150
+    assert 'score' in item and item['score'] == 150
+    for action in (lambda: item['alpha_take_data'], lambda: item.__setitem__('delay', 1)):
+        try:
+            action()
+            assert False, 'unknown or empty key must raise KeyError'
+        except KeyError:
+            pass
+    assert not hasattr(item, '__dict__')
+    
+    # Запись для архива - без токенов и пустых полей, обратно - та же новость
+    roundtrip = news_parser.news_item_to_record(item)
+    assert 'tokens' not in roundtrip and 'image_url' not in roundtrip
+    # Ключи в порядке объявления полей, а не в порядке хэшей frozenset
+    assert list(roundtrip) == ['title', 'link', 'summary', 'published_date', 'source',
+                               'source_weight', 'source_priority', 'score']
+    assert news_parser.news_item_from_record(roundtrip) == item
+    print(f"✓ {item.title}: dict-style access, record round trip, no __dict__")
+
+
+@temp_feed_cache()
+def test_streaming_pipeline():
+    """Тестируем конвейер: быстрый источник скорится, пока медленный качается"""
+    print("\n\n🌊 Testing streaming pipeline...\n")
+    
+    delays = {'decrypt': 0.05, 'coindesk': 0.6}
+    
+    def fake_fetch(source_name, feed_config, cache=None, cursor=None):
+        time.sleep(delays.get(source_name, 0.1))
+        return [news_parser.NewsItem(
+            title=f'SEC approves Bitcoin ETF, {source_name} reports', link=f'https://example.com/{source_name}',
+            source=source_name, source_weight=feed_config['weight_multiplier'],
+            source_priority=feed_config['priority'], published_date=datetime.now()
+        )]
+    
+    original = news_parser.fetch_rss_feed
+    news_parser.fetch_rss_feed = fake_fetch
+    news_parser.PIPELINE_STATS.update({'fetched': 0, 'new': 0, 'scored': 0})
+    scored_at = {}
+    try:
+        started = time.monotonic()
+        stream = news_parser.iter_fetched_news()
+        stream = news_parser.filter_published_stream(stream, news_parser.DedupIndex())
+        stream = news_parser.score_stream(stream)
+        
+        def timed(chunks):
+            for source_name, news in chunks:
+                scored_at[source_name] = time.monotonic() - started
+                yield source_name, news
+        
+        candidates = news_parser.collect_candidates(timed(stream))
+    finally:
+        news_parser.fetch_rss_feed = original
+    
+    # decrypt прошел скоринг задолго до конца загрузки coindesk
+    assert scored_at['decrypt'] < 0.4 <= delays['coindesk'] <= scored_at['coindesk']
+    # Кандидаты в порядке RSS_SOURCES, а не в порядке готовности
+    assert [item['source'] for item in candidates] == list(RSS_SOURCES)
+    assert news_parser.PIPELINE_STATS['fetched'] == len(RSS_SOURCES)
+    
+    scores = [40, 90, 90, 75, 90, 10, 60]
+    items = [{'title': f'News {i}', 'score': score} for i, score in enumerate(scores)]
+    assert select_top_news(items, limit=3) == sorted(items, key=lambda x: x['score'], reverse=True)[:3]
+    print(f"✓ decrypt scored at {scored_at['decrypt']:.2f}s, coindesk at {scored_at['coindesk']:.2f}s, "
+          f"{len(candidates)} candidates")
+
+
+def test_top_news_selector():
+    """Тестируем отбор топ-K через кучу против сортировки и попарной дедупликации"""
+    print("\n\n🏆 Testing heap top-K selection...\n")
+    
+    rng = random.Random(21)
+    stories = [[f'story{i}', f'topic{i}', f'event{i}', 'crypto', 'market'] for i in range(40)]
+    fillers = ['today', 'update', 'report', 'analysts', 'says', 'after', 'week', 'price']
+    
+    for case in range(200):
+        candidates = []
+        for i in range(rng.randint(0, 60)):
+            words = rng.choice(stories) + rng.sample(fillers, rng.randint(0, 5))
+            candidates.append({
+                'title': ' '.join(rng.sample(words, len(words))), 'link': f'https://example.com/{case}/{i}',
+                'score': rng.choice([60, 75, 90, 100, 130, 150]), 'source_priority': rng.randint(1, 4)
+            })
+        limit = rng.randint(1, 8)
+        
+        expected_unique = deduplicate_news(candidates)
+        expected = select_top_news(expected_unique, limit=limit)
+        top, unique_count = news_parser.select_unique_top_news(candidates, limit=limit)
+        
+        assert [id(item) for item in top] == [id(item) for item in expected], case
+        assert unique_count == len(expected_unique), case
+    
+    print(f"✓ Same top-K and dedup count as sort + pairwise dedup on 200 random runs")
+
+
+def test_run_metrics():
+    """Тестируем метрики запуска: счетчики из потоков, таймеры, JSON и Prometheus"""
+    print("\n\n📈 Testing run metrics...\n")
+    
+    metrics = news_parser.Metrics()
+    
+    def worker(source):
+        for _ in range(100):
+            metrics.inc('fetch_entries', 2, source=source)
+            metrics.observe('fetch_seconds', 0.02, source=source)
+    
+    threads = [threading.Thread(target=worker, args=(source,)) for source in ('coindesk', 'decrypt') * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with metrics.timer('score_seconds'):
+        time.sleep(0.01)
+    
+    summary = metrics.summary()
+    assert summary['counters'] == {'fetch_entries{source="coindesk"}': 400, 'fetch_entries{source="decrypt"}': 400}
+    assert summary['histograms']['fetch_seconds{source="decrypt"}']['count'] == 200
+    assert summary['histograms']['score_seconds']['min'] >= 0.01
+    
+    text = metrics.prometheus()
+    assert '# TYPE crypto_news_bot_fetch_entries gauge' in text
+    assert 'crypto_news_bot_fetch_entries{source="coindesk"} 400' in text
+    assert 'crypto_news_bot_fetch_seconds_bucket{source="decrypt",le="0.01"} 0' in text
+    assert 'crypto_news_bot_fetch_seconds_bucket{source="decrypt",le="0.05"} 200' in text
+    assert 'crypto_news_bot_score_seconds_count 1' in text
+    
+    # Стадии конвейера пишут в общий METRICS
+    news_parser.METRICS.reset()
+    chunks = [('decrypt', [news_parser.NewsItem(title='SEC approves Bitcoin ETF', source='decrypt')])]
+    list(news_parser.score_stream(news_parser.filter_published_stream(chunks, news_parser.DedupIndex())))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'run_metrics.json')
+        prom_path = os.path.join(tmp, 'textfile', 'bot.prom')
+        news_parser.emit_run_metrics(json_path, prom_path)
+        
+        with open(json_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        assert saved['counters']['pipeline_items{stage="fetched"}'] == 1
+        assert saved['histograms']['dedup_seconds']['count'] == 1
+        assert saved['histograms']['score_seconds']['count'] == 1
+        with open(prom_path, 'r', encoding='utf-8') as f:
+            assert 'crypto_news_bot_run_duration_seconds' in f.read()
+    
+    print(f"✓ {len(summary['counters'])} counters, {len(summary['histograms'])} histograms, "
+          f"JSON and Prometheus textfile written")
+
+
+FEED_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'feeds')
+
+
+def test_fast_feed_parser():
+    """Тестируем быстрый разбор RSS: те же записи, что у feedparser, и откат на feedparser"""
+    print("\n\n📰 Testing fast feed parser...\n")
+    
+    def normalized(entries):
+        return [
+            (news_parser.clean_feed_text(entry['title']), entry['link'], entry['id'],
+             news_parser.clean_feed_text(entry['summary']), entry['published'], entry['image_url'])
+            for entry in entries
+        ]
+    
+    total = 0
+    for filename in sorted(os.listdir(FEED_FIXTURES_DIR)):
+        with open(os.path.join(FEED_FIXTURES_DIR, filename), 'rb') as f:
+            content = f.read()
+        entries, parser = news_parser.parse_feed_entries(content)
+        assert parser == 'fast', filename
+        assert normalized(entries) == normalized(news_parser._feedparser_entries(content)), filename
+        assert all(entry['published'] and entry['title'] for entry in entries), filename
+        total += len(entries)
+    
+    # HTML в заголовке и описании, script, даты в других зонах, ссылка из guid
+    tricky = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/" xmlns:content="http://purl.org/rss/1.0/modules/content/">
+<channel><title>T</title>
+<item><title><![CDATA[AT&amp;T &amp; <b>Bitcoin</b> rises]]></title><link>https://example.com/1</link>
+<guid isPermaLink="false">abc</guid><pubDate>Thu, 16 Oct 2026 14:05:12 -0400</pubDate>
+<description><![CDATA[<p>Hi &amp; bye <script>alert(1)</script> x</p>]]></description>
+<media:group><media:content url="https://example.com/1.jpg" medium="image"/></media:group></item>
+<item><title>AT&amp;T plain &lt;b&gt;x&lt;/b&gt;</title><guid>https://example.com/2</guid>
+<content:encoded><![CDATA[<p>full</p>]]></content:encoded><enclosure url="https://example.com/2.jpg" type="image/jpeg"/></item>
+</channel></rss>"""
+    fast = normalized(news_parser.parse_rss_fast(tricky))
+    assert fast == normalized(news_parser._feedparser_entries(tricky))
+    assert fast[0] == ('AT&T & Bitcoin rises', 'https://example.com/1', 'abc', 'Hi & bye  x',
+                       (2026, 10, 16, 18, 5, 12), 'https://example.com/1.jpg')
+    assert fast[1][:2] == ('AT&T plain x', 'https://example.com/2')
+    
+    # Незнакомая схема - FeedSchemaError, parse_feed_entries откатывается на feedparser
+    surprises = [
+        tricky.replace(b'<guid>https://example.com/2</guid>',
+                       b'<dc:date xmlns:dc="http://purl.org/dc/elements/1.1/">2026-10-16T10:00:00Z</dc:date>'),
+        b'<feed xmlns="http://www.w3.org/2005/Atom"><title>A</title><entry><title>Atom entry</title></entry></feed>',
+        b'<rss version="2.0"><channel><item><title>Bitcoin&nbsp;ETF</title></item></channel></rss>',
+        b'<rss version="2.0"><channel><item><title>Bitcoin <b>ETF</b></title></item></channel></rss>',
+        b'<rss version="2.0"><channel><item><title>X</title><pubDate>yesterday</pubDate></item></channel></rss>'
+    ]
+    for content in surprises:
+        try:
+            news_parser.parse_rss_fast(content)
+        except news_parser.FeedSchemaError:
+            pass
+        else:
+            raise AssertionError(content)
+        entries, parser = news_parser.parse_feed_entries(content)
+        assert parser == 'feedparser'
+    assert news_parser.parse_feed_entries(surprises[1])[0][0]['title'] == 'Atom entry'
+    
+    print(f"✓ {total} fixture entries match feedparser, {len(surprises)} unknown schemas fall back")
+
+
+@temp_feed_cache()
+def test_source_scheduler():
+    """Тестируем расписание --daemon: задержка публикации, backoff и проход по части источников"""
+    print("\n\n⏲ Testing daemon source scheduler...\n")
+    
+    rng = random.Random(23)
+    start = datetime(2026, 10, 1)
+    duration = 24 * 3600
+    polls_per_hour = {}
+    for mean_gap in (600, 1800):
+        arrivals = []
+        moment = rng.expovariate(1 / mean_gap)
+        while moment < duration:
+            arrivals.append(moment)
+            moment += rng.expovariate(1 / mean_gap)
+        
+        scheduler = news_parser.SourceScheduler(['decrypt'], 0.0)
+        latencies, polls = simulate_polling(scheduler, 'decrypt', arrivals, duration, start)
+        latencies.sort()
+        median = latencies[len(latencies) // 2]
+        polls_per_hour[mean_gap] = polls / 24
+        # Задержка - малая доля промежутка между записями, а не 15 минут cron
+        assert median < mean_gap * 0.1, (mean_gap, median)
+        print(f"✓ Story every {mean_gap // 60} min: median latency {median:.0f}s, {polls / 24:.0f} polls/hour")
+    # Интервал подстраивается под источник: частая лента опрашивается заметно чаще тихой
+    assert polls_per_hour[600] > 2 * polls_per_hour[1800], polls_per_hour
+    
+    # Ошибки - экспоненциальный backoff до DAEMON_ERROR_MAX_INTERVAL, успех сбрасывает
+    scheduler = news_parser.SourceScheduler(['coindesk'], 0.0)
+    intervals = [scheduler.record('coindesk', 0.0, None) for _ in range(8)]
+    assert intervals == sorted(intervals) and intervals[-1] == news_parser.DAEMON_ERROR_MAX_INTERVAL
+    assert scheduler.record('coindesk', 0.0, []) <= news_parser.DAEMON_MAX_INTERVAL
+    
+    # Проход по одному источнику: остальные не опрашиваются, seen_* не попадают в файл курсоров
+    fetched = []
+    
+    def fake_fetch(source_name, feed_config, cache=None, cursor=None):
+        fetched.append(source_name)
+        published_date = datetime(2026, 10, 16, 12, 0)
+        cursor['seen_dates'] = [published_date.isoformat()]
+        cursor['seen_high_water'] = published_date.isoformat()
+        cursor['seen_ids'] = ['https://example.com/etf']
+        return [news_parser.NewsItem(
+            title='SEC approves spot Bitcoin ETF after record inflows', link='https://example.com/etf',
+            source=source_name, source_weight=feed_config['weight_multiplier'],
+            source_priority=feed_config['priority'], published_date=published_date,
+            entry_id='https://example.com/etf'
+        )]
+    
+    names = ['fetch_rss_feed', 'CURSOR_FILE', 'save_published_news', 'TELEGRAM_BOT_TOKEN', 'TWITTER_ENABLED']
+    original = {name: getattr(news_parser, name) for name in names}
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser.fetch_rss_feed = fake_fetch
+        news_parser.CURSOR_FILE = os.path.join(tmp, 'feed_cursors.json')
+        news_parser.save_published_news = lambda published: None
+        news_parser.TELEGRAM_BOT_TOKEN = None
+        news_parser.TWITTER_ENABLED = False
+        try:
+            cursors = {}
+            outbox = news_parser.PublishOutbox(os.path.join(tmp, 'publish_outbox.json'))
+            # Лимит публикаций исчерпан - новость остается перед курсором
+            _, results = news_parser.run_cycle(cursors, [], news_parser.DedupIndex(), outbox, sources=['decrypt'], limit=0)
+            saved = news_parser.load_feed_cursors()
+        finally:
+            for name, value in original.items():
+                setattr(news_parser, name, value)
+    
+    assert results == []
+    assert fetched == ['decrypt']
+    assert cursors['decrypt']['seen_dates'] == ['2026-10-16T12:00:00']
+    assert saved['decrypt'] == {'high_water': '2026-10-16T11:59:59', 'ids': []}
+    assert all(not key.startswith('seen_') for cursor in saved.values() for key in cursor)
+    print(f"✓ Cycle polled only {sorted(set(fetched))}, held back the candidate over the publishing limit")
+
+
+class FakeRateLimitedBotApiHandler(BaseHTTPRequestHandler):
+    """Заглушка Bot API: на запросы из limited (номер -> retry_after) отвечает 429"""
+    sent = []
+    limited = {}
+    requests_count = 0
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FakeRateLimitedBotApiHandler.requests_count += 1
+        retry_after = FakeRateLimitedBotApiHandler.limited.get(FakeRateLimitedBotApiHandler.requests_count)
+        if retry_after is not None:
+            status, payload = 429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after}
+            }
+        else:
+            FakeRateLimitedBotApiHandler.sent.append(body['text'])
+            status, payload = 200, {'ok': True, 'result': {'message_id': len(FakeRateLimitedBotApiHandler.sent)}}
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+def test_publish_outbox():
+    """Тестируем outbox: 429 с retry_after не теряет посты, долгий лимит переносит их в следующий запуск"""
+    print("\n\n📬 Testing publish outbox...\n")
+    
+    now = datetime.now()
+    items = [
+        news_parser.NewsItem(
+            title=f'Bitcoin ETF news {i}', link=f'https://example.com/{i}', source='decrypt',
+            published_date=now, score=90, categories=['etf']
+        )
+        for i in range(3)
+    ]
+    sent_titles = lambda: [item.title for text in FakeRateLimitedBotApiHandler.sent for item in items if item.title in text]
+    
+    # Заголовки лимитов Twitter: суточный лимит важнее окна эндпоинта
+    headers = {'x-rate-limit-reset': str(int(now.timestamp()) + 900),
+               'x-user-limit-24hour-remaining': '0', 'x-user-limit-24hour-reset': str(int(now.timestamp()) + 7200)}
+    assert 7190 <= news_parser.twitter_retry_after(headers, now.timestamp()) <= 7200
+    del headers['x-user-limit-24hour-remaining']
+    assert 890 <= news_parser.twitter_retry_after(headers, now.timestamp()) <= 900
+    
+    server = start_fake_server(FakeRateLimitedBotApiHandler)
+    names = ['TELEGRAM_API_URL', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHANNEL_ID', 'TWITTER_ENABLED',
+             'get_alpha_take', 'ALPHA_TAKE_BATCH_ENABLED', 'PUBLISH_RATE_LIMITS']
+    saved = {name: getattr(news_parser, name) for name in names}
+    news_parser.TELEGRAM_API_URL = f'http://127.0.0.1:{server.server_port}'
+    news_parser.TELEGRAM_BOT_TOKEN = 'test-token'
+    news_parser.TELEGRAM_CHANNEL_ID = '@test'
+    news_parser.TWITTER_ENABLED = False
+    news_parser.get_alpha_take = lambda news_item: {'alpha_take': 'Flows matter', 'context': None, 'hashtags': ''}
+    news_parser.ALPHA_TAKE_BATCH_ENABLED = False
+    news_parser.PUBLISH_RATE_LIMITS = {'telegram': {'rate': 100.0, 'burst': 3}}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publish_outbox.json')
+            
+            # Короткий лимит: ждем retry_after в этом же запуске и повторяем тот же пост
+            FakeRateLimitedBotApiHandler.sent, FakeRateLimitedBotApiHandler.requests_count = [], 0
+            FakeRateLimitedBotApiHandler.limited = {2: 1}
+            outbox = news_parser.PublishOutbox(path)
+            outbox.add(items, news_parser.configured_channels())
+            started = time.monotonic()
+            results = news_parser.drain_outbox(outbox)
+            waited = time.monotonic() - started
+            assert [telegram_ok for _, telegram_ok, _ in results] == [True, True, True]
+            assert sent_titles() == [item.title for item in items]
+            assert waited >= 1.0 and len(outbox) == 0
+            
+            # Долгий лимит: первый пост ушел, остальные ждут в файле до следующего запуска
+            FakeRateLimitedBotApiHandler.sent, FakeRateLimitedBotApiHandler.requests_count = [], 0
+            FakeRateLimitedBotApiHandler.limited = {2: 3600}
+            outbox = news_parser.PublishOutbox(path)
+            outbox.add(items, ('telegram',))
+            results = news_parser.drain_outbox(outbox)
+            assert [telegram_ok for _, telegram_ok, _ in results] == [True, None, None]
+            assert sent_titles() == [items[0].title]
+            
+            resumed = news_parser.PublishOutbox(path)
+            assert [entry['item']['title'] for entry in resumed.entries] == [item.title for item in items[1:]]
+            assert resumed.entries[0]['attempts'] == {'telegram': 0}
+            assert resumed.entries[0]['item']['alpha_take_data']['alpha_take'] == 'Flows matter'
+            assert 3500 < (resumed.retry_at['telegram'] - datetime.now()).total_seconds() <= 3600
+            # Пока лимит не истек, следующий запуск в канал не пишет
+            assert resumed.pending() == [] and news_parser.drain_outbox(resumed) == []
+            
+            # Лимит истек: следующий запуск дотправляет оставшиеся без новой генерации Alpha Take
+            resumed.retry_at['telegram'] = datetime.now() - timedelta(seconds=1)
+            news_parser.get_alpha_take = lambda news_item: None
+            results = news_parser.drain_outbox(resumed)
+            assert [item['alpha_take_data']['alpha_take'] for item, _, _ in results] == ['Flows matter'] * 2
+            assert sent_titles() == [item.title for item in items]
+            assert len(news_parser.PublishOutbox(path)) == 0
+            
+            # Ошибки (не лимиты) тратят попытки, протухшие посты выбрасываются
+            outbox = news_parser.PublishOutbox(path)
+            outbox.add(items[:1], ('telegram',))
+            for _ in range(news_parser.OUTBOX_MAX_ATTEMPTS):
+                outbox.record(outbox.entries[0], 'telegram', False)
+            outbox.add(items[1:2], ('telegram',))
+            outbox.entries[1]['queued_at'] = (now - timedelta(hours=news_parser.OUTBOX_MAX_AGE_HOURS + 1)).isoformat()
+            outbox.prune()
+            assert len(outbox) == 0
+    finally:
+        for name, value in saved.items():
+            setattr(news_parser, name, value)
+        news_parser.close_http_session()
+        server.shutdown()
+    
+    print(f"✓ 429 retried in-run after {waited:.1f}s, long limit resumed next run, {len(sent_titles())} posts delivered once")
+
+
+@temp_feed_cache()
+def test_daemon_publish_budget():
+    """Тестируем лимит публикаций --daemon и outbox без настроенных каналов"""
+    print("\n\n🚦 Testing daemon publish budget...\n")
+    
+    def fake_fetch(source_name, feed_config, cache=None, cursor=None):
+        published_date = datetime(2026, 10, 16, 12, 0)
+        cursor['seen_high_water'] = published_date.isoformat()
+        cursor['seen_ids'] = ['https://example.com/etf']
+        return [news_parser.NewsItem(
+            title='SEC approves spot Bitcoin ETF after record inflows', link='https://example.com/etf',
+            source=source_name, source_weight=feed_config['weight_multiplier'],
+            source_priority=feed_config['priority'], published_date=published_date,
+            entry_id='https://example.com/etf'
+        )]
+    
+    names = ['fetch_rss_feed', 'CURSOR_FILE', 'save_published_news', 'TELEGRAM_BOT_TOKEN', 'TWITTER_ENABLED']
+    original = {name: getattr(news_parser, name) for name in names}
+    with tempfile.TemporaryDirectory() as tmp:
+        news_parser.fetch_rss_feed = fake_fetch
+        news_parser.CURSOR_FILE = os.path.join(tmp, 'feed_cursors.json')
+        news_parser.save_published_news = lambda published: None
+        news_parser.TELEGRAM_BOT_TOKEN = None
+        news_parser.TWITTER_ENABLED = False
+        outbox_path = os.path.join(tmp, 'publish_outbox.json')
+        try:
+            # Каналы не настроены - в outbox ничего не ставим, а протухший пост
+            # заблокированного канала выбрасываем, даже если отправлять нечего
+            outbox = news_parser.PublishOutbox(outbox_path)
+            outbox.add([news_parser.NewsItem(title='Old post', published_date=datetime.now())], ('telegram',))
+            outbox.entries[0]['queued_at'] = (datetime.now() - timedelta(hours=news_parser.OUTBOX_MAX_AGE_HOURS + 1)).isoformat()
+            outbox.retry_at['telegram'] = datetime.now() + timedelta(hours=1)
+            top_news, results = news_parser.run_cycle({}, [], news_parser.DedupIndex(), outbox, sources=['decrypt'], limit=1)
+            queued = news_parser.PublishOutbox(outbox_path).entries
+        finally:
+            for name, value in original.items():
+                setattr(news_parser, name, value)
+    
+    # Отобранная новость учитывается в лимите, даже если отправлять ее некуда
+    assert [item['title'] for item in top_news] == ['SEC approves spot Bitcoin ETF after record inflows']
+    assert results == [] and queued == []
+    
+    # Лимит daemon: отобранные за окно и не ушедшие из outbox посты старше окна
+    window = news_parser.DAEMON_PUBLISH_WINDOW
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = news_parser.PublishOutbox(os.path.join(tmp, 'publish_outbox.json'))
+        outbox.add([news_parser.NewsItem(title=f'Blocked {i}', published_date=datetime.now()) for i in range(2)], ('telegram',))
+        outbox.entries[0]['queued_at'] = (datetime.now() - timedelta(seconds=window + 60)).isoformat()
+        selected_at = deque([0.0, window - 10.0, window - 5.0])
+        budget = news_parser.daemon_publish_budget(selected_at, outbox, window + 1.0)
+    assert list(selected_at) == [window - 10.0, window - 5.0]
+    assert budget == news_parser.MAX_NEWS_PER_RUN - 3
+    print(f"✓ Budget {budget}/{news_parser.MAX_NEWS_PER_RUN}: 2 selected in the window + 1 old post still in outbox")
+
+
+def test_lazy_imports():
+    """Тестируем холодный старт: импорт news_parser не тянет тяжелые библиотеки и ничего не печатает"""
+    print("\n\n🧊 Testing lazy imports...\n")
+    
+    heavy = ('openai', 'feedparser', 'numpy', 'PIL', 'tweepy', 'httpx')
+    script = f"import sys, news_parser; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == '', result.stdout
+    print(f"✓ import news_parser loads none of {', '.join(heavy)}")
+
+
 def main():
     print("=" * 70)
     print("🧪 CRYPTO NEWS BOT - TEST SUITE")
@@ -117,6 +1477,81 @@ def main():
     # Тест 3: Все источники
     test_all_sources()
     
+    # Тест 4: Параллельная загрузка
+    test_parallel_fetch()
+    
+    # Тест 5: Conditional GET
+    test_conditional_fetch()
+    
+    # Тест 6: Курсор источников
+    test_feed_cursor()
+    
+    # Тест 7: Индекс дубликатов
+    test_dedup_index()
+    
+    # Тест 8: Скомпилированный матчер
+    test_matcher_equivalence()
+    
+    # Тест 9: Пакетный скоринг
+    test_score_batch()
+    
+    # Тест 10: Replay архива
+    test_replay()
+    
+    # Тест 11: Параллельные Alpha Take
+    test_parallel_alpha_takes()
+    
+    # Тест 12: Кэш Alpha Take
+    test_alpha_take_cache()
+    
+    # Тест 13: Пакетный Alpha Take
+    test_batched_alpha_takes()
+    
+    # Тест 14: Общая HTTP сессия
+    test_http_session()
+    
+    # Тест 15: Публикация в каналы
+    test_publish_pipeline()
+    
+    # Тест 16: Кэш картинок
+    test_image_cache()
+    
+    # Тест 17: Telegram file_id
+    test_telegram_file_id()
+    
+    # Тест 18: Хранилище опубликованных новостей
+    test_published_store()
+    
+    # Тест 19: Журнал опубликованных новостей
+    test_published_journal()
+    
+    # Тест 20: NewsItem
+    test_news_item()
+    
+    # Тест 21: Потоковый конвейер
+    test_streaming_pipeline()
+    
+    # Тест 22: Отбор топ-K
+    test_top_news_selector()
+    
+    # Тест 23: Метрики запуска
+    test_run_metrics()
+    
+    # Тест 24: Быстрый разбор RSS
+    test_fast_feed_parser()
+    
+    # Тест 25: Расписание --daemon
+    test_source_scheduler()
+    
+    # Тест 26: Ленивые импорты
+    test_lazy_imports()
+    
+    # Тест 27: Outbox публикаций и лимиты каналов
+    test_publish_outbox()
+    
+    # Тест 28: Лимит публикаций --daemon
+    test_daemon_publish_budget()
+    
     print("\n" + "=" * 70)
     print("✅ Testing complete!")
     print("=" * 70)